@@ -1,7 +1,5 @@
 import streamlit as st
 import pandas as pd
-import io
-import zipfile
 import base64
 from datetime import datetime
 import os
@@ -12,17 +10,83 @@ from pathlib import Path
 # Import custom utilities
 from utils.excel_processor import ExcelProcessor
 from utils.report_generator import ReportGenerator
-from utils.pdf_generator import PDFGenerator
-from utils.template_renderer import TemplateRenderer
+from utils.pdf_generator import PDFGenerator, PDF_ENGINES
+from utils.template_renderer import get_shared_renderer
+from utils.output_cache import OutputCache
+from utils.bill_pipeline import BillPipeline
+from utils.incremental import IncrementalReportBuilder, IncrementalStore
+from utils.ledger import BillLedger
+from utils.job_queue import JobQueue, QUEUED, RUNNING, DONE, FAILED
+from utils.batch_scheduler import BatchScheduler
+from utils.archive_writer import ReportArchive
+from utils import instrumentation
+
+def build_job_pipeline(components, options):
+    """Build the pipeline of a background job from the settings it was submitted with"""
+    pipeline = BillPipeline(
+        ExcelProcessor(),
+        components['report_generator'],
+        components['pdf_generator'],
+        components['output_cache']
+    )
+    pipeline.max_workers = options.get('max_workers')
+    pipeline.pdf_engine = options.get('pdf_engine')
+    if options.get('incremental'):
+        pipeline.incremental = IncrementalReportBuilder(components['report_generator'], components['incremental_store'])
+    if options.get('ledger'):
+        pipeline.ledger = components['ledger']
+    return pipeline
+
+@st.cache_resource
+def get_shared_components():
+    """Build the processing objects once per server process instead of on every rerun
+    
+    The template renderer is the process-wide one, with its templates
+    compiled at startup and shared with the report generator. Background
+    jobs of several workbooks run them in parallel on the batch scheduler's
+    warmed worker processes. Jobs left unfinished by a previous server
+    process are resumed.
+    """
+    components = {
+        'excel_processor': ExcelProcessor(),
+        'report_generator': ReportGenerator(),
+        'pdf_generator': PDFGenerator(),
+        'template_renderer': get_shared_renderer(),
+        'output_cache': OutputCache(),
+        'incremental_store': IncrementalStore(),
+        'ledger': BillLedger()
+    }
+    components['batch_scheduler'] = BatchScheduler()
+    components['job_queue'] = JobQueue(lambda options: build_job_pipeline(components, options),
+                                       scheduler=components['batch_scheduler'])
+    components['job_queue'].store.purge()
+    components['job_queue'].resume_unfinished()
+    return components
 
 class BillGeneratorApp:
     """Main application class for the Bill Generator"""
     
     def __init__(self):
-        self.excel_processor = ExcelProcessor()
-        self.report_generator = ReportGenerator()
-        self.pdf_generator = PDFGenerator()
-        self.template_renderer = TemplateRenderer()
+        components = get_shared_components()
+        self.excel_processor = components['excel_processor']
+        self.report_generator = components['report_generator']
+        self.pdf_generator = components['pdf_generator']
+        self.template_renderer = components['template_renderer']
+        self.output_cache = components['output_cache']
+        self.incremental_builder = IncrementalReportBuilder(self.report_generator, components['incremental_store'])
+        self.ledger = components['ledger']
+        self.job_queue = components['job_queue']
+        self.run_in_background = True
+        self.parallel_workbooks = True
+        self.use_output_cache = True
+        self.flat_zip_layout = False
+        self.show_performance = False
+        self.pipeline = BillPipeline(
+            self.excel_processor,
+            self.report_generator,
+            self.pdf_generator,
+            self.output_cache
+        )
         
     def setup_page_config(self):
         """Configure Streamlit page settings"""
@@ -66,49 +130,98 @@ class BillGeneratorApp:
             </div>
             """, unsafe_allow_html=True)
     
-    def process_files(self, uploaded_files):
-        """Process multiple Excel files and generate reports"""
+    def validate_uploads(self, uploaded_files):
+        """Check the number and size of the uploaded files, reporting any problem"""
         if not uploaded_files:
             st.warning("Please upload at least one Excel file.")
-            return
+            return False
         
         if len(uploaded_files) > 10:
             st.error("Maximum 10 files can be processed simultaneously.")
-            return
+            return False
         
         # Check file sizes
         for uploaded_file in uploaded_files:
             if uploaded_file.size > 50 * 1024 * 1024:  # 50MB limit
                 st.error(f"File {uploaded_file.name} is too large. Maximum size is 50MB.")
-                return
+                return False
+        
+        return True
+    
+    def process_files(self, uploaded_files):
+        """Process multiple Excel files and generate reports"""
+        if not self.validate_uploads(uploaded_files):
+            return
         
         # Create progress bar
         progress_bar = st.progress(0)
         status_text = st.empty()
         
-        all_outputs = {}
+        results = st.session_state.setdefault('bill_results', {})
+        
+        # Files already processed in this session are kept as they are
+        pending = []
+        for uploaded_file in uploaded_files:
+            if self.get_file_key(uploaded_file) in results:
+                st.success(f"✅ {uploaded_file.name} already processed")
+            else:
+                pending.append(uploaded_file)
         
-        for idx, uploaded_file in enumerate(uploaded_files):
+        # Upcoming workbooks are parsed in the background while earlier ones generate their reports
+        use_cache = self.use_output_cache and self.pipeline.can_use_output_cache()
+        for idx, loaded in enumerate(self.pipeline.load_ahead(pending, use_cache)):
+            uploaded_file = loaded.uploaded_file
             try:
                 # Update progress
-                progress = (idx + 1) / len(uploaded_files)
+                progress = (idx + 1) / len(pending)
                 progress_bar.progress(progress)
                 status_text.text(f"Processing {uploaded_file.name}...")
                 
-                # Process Excel file
-                file_data = self.excel_processor.process_excel_file(uploaded_file)
+                file_key = self.get_file_key(uploaded_file)
                 
-                if file_data:
-                    # Generate reports
-                    reports = self.report_generator.generate_all_reports(file_data)
-                    
-                    # Create file outputs
-                    file_outputs = self.create_file_outputs(reports, uploaded_file.name)
-                    all_outputs[uploaded_file.name] = file_outputs
-                    
+                # Reuse outputs of an identical earlier upload
+                if loaded.outputs:
+                    results[file_key] = {
+                        'filename': uploaded_file.name,
+                        'reports': None,
+                        'outputs': loaded.outputs,
+                        'cache_key': loaded.cache_key
+                    }
+                    st.success(f"✅ Successfully processed {uploaded_file.name} (cached)")
+                    continue
+                
+                if loaded.error is not None:
+                    st.error(f"❌ {str(loaded.error)}")
+                    continue
+                
+                # A ledger bill is recorded once its outputs exist, so it is rendered in
+                # full before the next bill of the batch looks up its previous bill
+                if self.pipeline.ledger is not None:
+                    results[file_key] = {
+                        'filename': uploaded_file.name,
+                        'reports': None,
+                        'outputs': self.pipeline.finish_workbook(loaded),
+                        'cache_key': loaded.cache_key
+                    }
                     st.success(f"✅ Successfully processed {uploaded_file.name}")
-                else:
-                    st.error(f"❌ Failed to process {uploaded_file.name}")
+                    continue
+                
+                # Generate reports; PDFs are rendered when first requested
+                with instrumentation.workbook(uploaded_file.name):
+                    reports, incremental_result = self.pipeline.generate_reports(loaded.file_data)
+                
+                outputs = self.pipeline.create_text_outputs(reports)
+                if incremental_result:
+                    # PDFs of documents unchanged since the agreement's last bill
+                    outputs.update(incremental_result.reused_pdfs)
+                results[file_key] = {
+                    'filename': uploaded_file.name,
+                    'reports': reports,
+                    'outputs': outputs,
+                    'cache_key': loaded.cache_key,
+                    'incremental': incremental_result
+                }
+                st.success(f"✅ Successfully processed {uploaded_file.name}")
                     
             except Exception as e:
                 st.error(f"❌ Error processing {uploaded_file.name}: {str(e)}")
@@ -116,126 +229,278 @@ class BillGeneratorApp:
         
         progress_bar.progress(1.0)
         status_text.text("Processing complete!")
-        
-        if all_outputs:
-            self.provide_download_options(all_outputs)
     
-    def create_file_outputs(self, reports, filename):
-        """Create downloadable outputs for a single file"""
-        outputs = {}
+    def get_file_key(self, uploaded_file):
+        """Identify an upload across reruns"""
+        file_id = getattr(uploaded_file, 'file_id', None)
+        return file_id or f"{uploaded_file.name}:{uploaded_file.size}"
+    
+    def get_session_batch(self, uploaded_files):
+        """Get this session's processed results for the current uploads, keyed by filename
         
-        # Generate PDFs
-        outputs['first_page.pdf'] = self.pdf_generator.generate_pdf(
-            reports['first_page_html'], 'first_page'
-        )
-        outputs['deviation_statement.pdf'] = self.pdf_generator.generate_pdf(
-            reports['deviation_statement_html'], 'deviation_statement'
-        )
-        outputs['note_sheet.pdf'] = self.pdf_generator.generate_pdf(
-            reports['note_sheet_html'], 'note_sheet'
-        )
-        outputs['certificate_ii.pdf'] = self.pdf_generator.generate_pdf(
-            reports['certificate_ii_html'], 'certificate_ii'
-        )
-        outputs['certificate_iii.pdf'] = self.pdf_generator.generate_pdf(
-            reports['certificate_iii_html'], 'certificate_iii'
-        )
+        Results are kept in st.session_state so the reruns triggered by
+        download buttons reuse them instead of reprocessing. Results of files
+        that are no longer uploaded are dropped.
+        """
+        results = st.session_state.setdefault('bill_results', {})
+        file_keys = [self.get_file_key(uploaded_file) for uploaded_file in uploaded_files]
         
-        if reports.get('extra_items_html'):
-            outputs['extra_items.pdf'] = self.pdf_generator.generate_pdf(
-                reports['extra_items_html'], 'extra_items'
-            )
+        for file_key in list(results):
+            if file_key not in file_keys:
+                del results[file_key]
         
-        # Generate combined PDF
-        outputs['combined_report.pdf'] = self.pdf_generator.create_combined_pdf([
-            outputs['first_page.pdf'],
-            outputs['deviation_statement.pdf'],
-            outputs['note_sheet.pdf'],
-            outputs['certificate_ii.pdf'],
-            outputs['certificate_iii.pdf']
-        ] + ([outputs['extra_items.pdf']] if 'extra_items.pdf' in outputs else []))
-        
-        # Generate HTML files
-        outputs['first_page.html'] = reports['first_page_html'].encode()
-        outputs['deviation_statement.html'] = reports['deviation_statement_html'].encode()
-        outputs['note_sheet.html'] = reports['note_sheet_html'].encode()
-        outputs['certificate_ii.html'] = reports['certificate_ii_html'].encode()
-        outputs['certificate_iii.html'] = reports['certificate_iii_html'].encode()
-        
-        if reports.get('extra_items_html'):
-            outputs['extra_items.html'] = reports['extra_items_html'].encode()
-        
-        # Generate DOCX files (simplified implementation)
-        # Note: Full DOCX generation would require python-docx library
-        outputs['summary.txt'] = self.create_summary_text(reports).encode()
-        
-        return outputs
+        return {results[file_key]['filename']: results[file_key] for file_key in file_keys if file_key in results}
     
-    def create_summary_text(self, reports):
-        """Create a text summary of the reports"""
-        summary = f"""
-BILL PROCESSING SUMMARY
-Generated on: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
-
-Reports Generated:
-- First Page Report
-- Deviation Statement
-- Note Sheet
-- Certificate II
-- Certificate III
-"""
-        if reports.get('extra_items_html'):
-            summary += "- Extra Items Report\n"
-        
-        summary += "\nAll reports have been generated successfully with proper formatting and calculations."
-        
-        return summary
+    def get_output_names(self, entry):
+        """List the outputs of a processed file, in download order"""
+        if entry['reports'] is None:
+            return list(entry['outputs'])
+        return self.pipeline.get_output_names(entry['reports'])
+    
+    def store_completed_outputs(self, entry):
+        """Save a file's outputs to the output cache (and incremental state) once every one has been rendered"""
+        names = self.get_output_names(entry)
+        if not all(name in entry['outputs'] for name in names):
+            return
+        if entry['cache_key'] and entry['reports'] is not None:
+            self.pipeline.store_cached_outputs(
+                entry['cache_key'], {name: entry['outputs'][name] for name in names}, entry['reports']
+            )
+        if entry.get('incremental'):
+            self.incremental_builder.save(entry['incremental'], entry['outputs'])
+            entry['incremental'] = None
     
-    def provide_download_options(self, all_outputs):
-        """Provide download options for all processed files"""
+    def render_all_outputs(self, batch):
+        """Render every output not yet rendered, for the whole batch in one pool pass"""
+        pending = {filename: entry['reports'] for filename, entry in batch.items() if entry['reports'] is not None}
+        batch_pdfs = self.pipeline.render_batch_pdfs(
+            pending,
+            {filename: batch[filename]['outputs'] for filename in pending}
+        )
+        
+        for filename, pdfs in batch_pdfs.items():
+            batch[filename]['outputs'].update(pdfs)
+            self.store_completed_outputs(batch[filename])
+    
+    def provide_download_options(self, batch):
+        """Provide download options for all processed files, rendering PDFs on request"""
         st.markdown("---")
         st.header("📥 Download Reports")
         
-        # Create master ZIP file
-        master_zip = io.BytesIO()
-        with zipfile.ZipFile(master_zip, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for filename, outputs in all_outputs.items():
-                # Create individual ZIP for each file
-                file_zip = io.BytesIO()
-                with zipfile.ZipFile(file_zip, 'w', zipfile.ZIP_DEFLATED) as file_zf:
-                    for output_name, output_data in outputs.items():
-                        file_zf.writestr(output_name, output_data)
+        zip_files = (tuple(batch), self.flat_zip_layout)
+        batch_zip = st.session_state.get('bill_batch_zip')
+        
+        if batch_zip and batch_zip['files'] == zip_files:
+            # Provide master download straight from the archive file on disk
+            st.download_button(
+                label="📦 Download All Reports (ZIP)",
+                data=batch_zip['file'],
+                file_name=f"bill_reports_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                mime="application/zip"
+            )
+        elif st.button("📦 Prepare All Reports (ZIP)", key="prepare_zip_btn"):
+            with st.spinner('Rendering all reports...'):
+                self.render_all_outputs(batch)
                 
-                # Add individual ZIP to master ZIP
-                clean_filename = filename.replace('.xlsx', '').replace('.xls', '')
-                zf.writestr(f"{clean_filename}_reports.zip", file_zip.getvalue())
-        
-        master_zip.seek(0)
-        
-        # Provide master download
-        st.download_button(
-            label="📦 Download All Reports (ZIP)",
-            data=master_zip.getvalue(),
-            file_name=f"bill_reports_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
-            mime="application/zip"
-        )
+                # Create master ZIP file, streaming each entry into a temporary file;
+                # the session keeps a reader on that file rather than a copy of its bytes
+                with instrumentation.stage('zip', detail=f"{len(batch)} workbooks") as record:
+                    with ReportArchive(layout='flat' if self.flat_zip_layout else 'nested') as archive:
+                        for filename, entry in batch.items():
+                            archive.add_workbook(filename, {name: entry['outputs'][name] for name in self.get_output_names(entry)})
+                    record.bytes_out = archive.size
+                if batch_zip:
+                    batch_zip['file'].close()
+                st.session_state['bill_batch_zip'] = {'files': zip_files, 'file': archive.reader()}
+            st.rerun()
         
-        # Individual file downloads
-        for filename, outputs in all_outputs.items():
+        self.provide_file_downloads(batch)
+    
+    def provide_file_downloads(self, batch):
+        """Provide the individual downloads of each processed file"""
+        for filename, entry in batch.items():
             with st.expander(f"📄 {filename} - Individual Downloads"):
                 cols = st.columns(3)
-                col_idx = 0
                 
-                for output_name, output_data in outputs.items():
+                for col_idx, output_name in enumerate(self.get_output_names(entry)):
                     with cols[col_idx % 3]:
-                        mime_type = self.get_mime_type(output_name)
-                        st.download_button(
-                            label=f"⬇️ {output_name}",
-                            data=output_data,
-                            file_name=output_name,
-                            mime=mime_type
-                        )
-                    col_idx += 1
+                        output_data = entry['outputs'].get(output_name)
+                        
+                        if output_data is None:
+                            # Render this document only when it is first requested
+                            if st.button(f"⚙️ Prepare {output_name}", key=f"prepare_{filename}_{output_name}"):
+                                with st.spinner(f'Rendering {output_name}...'), instrumentation.workbook(filename):
+                                    entry['outputs'][output_name] = self.pipeline.render_output(entry['reports'], output_name)
+                                    self.store_completed_outputs(entry)
+                                st.rerun()
+                        else:
+                            mime_type = self.get_mime_type(output_name)
+                            st.download_button(
+                                label=f"⬇️ {output_name}",
+                                data=output_data,
+                                file_name=output_name,
+                                mime=mime_type,
+                                key=f"download_{filename}_{output_name}"
+                            )
+    
+    def get_job_options(self):
+        """Settings a background job is processed with"""
+        return {
+            'use_cache': self.use_output_cache,
+            'max_workers': self.pipeline.max_workers,
+            'pdf_engine': self.pipeline.pdf_engine,
+            'incremental': self.pipeline.incremental is not None,
+            'ledger': self.pipeline.ledger is not None,
+            'parallel_workbooks': self.parallel_workbooks
+        }
+    
+    def submit_job(self, uploaded_files):
+        """Queue the uploads as a background job and keep its id in the page URL"""
+        if not self.validate_uploads(uploaded_files):
+            return
+        
+        job_id = self.job_queue.submit(
+            [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files],
+            self.get_job_options()
+        )
+        st.query_params['job'] = job_id
+        st.session_state.pop('bill_batch_zip', None)
+        st.success(f"✅ Queued {len(uploaded_files)} file(s). You can close this page and reopen its link later.")
+    
+    def show_job(self, job_id):
+        """Show a background job: live progress and the files finished so far while it runs, every download once it has finished"""
+        job = self.job_queue.store.get_job(job_id)
+        if job is None:
+            st.warning("This processing job no longer exists.")
+            if st.button("Dismiss", key="dismiss_job_btn"):
+                del st.query_params['job']
+                st.rerun()
+            return
+        
+        if job['status'] in (QUEUED, RUNNING):
+            st.markdown("---")
+            st.header("⏳ Processing")
+            batch = self.get_job_batch(job)
+            self.show_job_progress(job_id, len(batch))
+            if batch:
+                # Files already done can be downloaded while the rest render
+                st.subheader("📥 Finished so far")
+                self.provide_file_downloads(batch)
+            return
+        
+        self.merge_job_performance(job)
+        for file in job['files']:
+            if file['status'] == FAILED:
+                st.error(f"❌ Failed to process {file['filename']}: {file['error']}")
+        if job['status'] == FAILED:
+            st.error(f"❌ Processing failed: {job['error']}")
+        
+        batch = self.get_job_batch(job)
+        if batch:
+            self.provide_download_options(batch)
+        
+        if st.button("🧹 Dismiss Results", key="dismiss_job_btn"):
+            del st.query_params['job']
+            st.session_state.pop('bill_batch_zip', None)
+            st.session_state.pop('bill_job_batch', None)
+            st.rerun()
+    
+    @st.fragment(run_every=1.0)
+    def show_job_progress(self, job_id, files_shown=0):
+        """Poll a running job once a second, rerunning the whole page when it finishes or another file is done"""
+        job = self.job_queue.store.get_job(job_id)
+        if job is None or job['status'] not in (QUEUED, RUNNING):
+            st.rerun()
+        if sum(1 for file in job['files'] if file['status'] == DONE) != files_shown:
+            st.rerun()
+        
+        files = job['files']
+        finished = sum(1 for file in files if file['status'] in (DONE, FAILED))
+        documents_done = sum(file['documents_done'] for file in files)
+        documents_total = sum(file['documents_total'] for file in files)
+        st.progress(
+            sum(
+                1.0 if file['status'] in (DONE, FAILED) else
+                file['documents_done'] / file['documents_total'] if file['documents_total'] else 0.0
+                for file in files
+            ) / max(len(files), 1),
+            text=f"{finished} of {len(files)} file(s) done, {documents_done} of {documents_total or '?'} documents rendered"
+        )
+        
+        for file in files:
+            if file['status'] == DONE:
+                st.write(f"✅ {file['filename']}")
+            elif file['status'] == FAILED:
+                st.write(f"❌ {file['filename']}: {file['error']}")
+            elif file['status'] == RUNNING:
+                step = "generating reports" if file['current'] == 'reports' else f"rendered {file['current']}"
+                st.write(f"⚙️ {file['filename']}: {step} ({file['documents_done']}/{file['documents_total'] or '?'})")
+            else:
+                st.write(f"🕒 {file['filename']}: waiting")
+    
+    def get_job_batch(self, job):
+        """Load the outputs of a job's finished files, keyed by filename, each once per session"""
+        cached = st.session_state.get('bill_job_batch')
+        if not cached or cached['job_id'] != job['id']:
+            cached = st.session_state['bill_job_batch'] = {'job_id': job['id'], 'batch': {}}
+        
+        loaded = cached['batch']
+        batch = {}
+        for file in job['files']:
+            if file['status'] != DONE:
+                continue
+            if file['filename'] not in loaded:
+                loaded[file['filename']] = {
+                    'filename': file['filename'],
+                    'reports': None,
+                    'outputs': self.job_queue.store.load_outputs(job['id'], file['position']),
+                    'cache_key': None
+                }
+            batch[file['filename']] = loaded[file['filename']]
+        return batch
+    
+    def merge_job_performance(self, job):
+        """Add a finished job's stage records to this session's performance run, once"""
+        merged = st.session_state.setdefault('bill_merged_jobs', set())
+        if job['id'] not in merged:
+            merged.add(job['id'])
+            self.get_performance_run().extend(self.job_queue.store.load_performance(job['id']))
+    
+    def get_performance_run(self):
+        """Get this session's performance run, which every stage records into"""
+        if 'bill_performance' not in st.session_state:
+            st.session_state['bill_performance'] = instrumentation.PerformanceRun()
+        return st.session_state['bill_performance']
+    
+    def show_performance_details(self):
+        """Show per-stage timings of this session, with JSON and Prometheus exports"""
+        run = self.get_performance_run()
+        summary = run.summary()
+        
+        with st.expander("⏱️ Performance"):
+            if not summary:
+                st.info("No stages recorded yet. Process some files to see timings.")
+                return
+            
+            st.dataframe(pd.DataFrame(summary), use_container_width=True, hide_index=True)
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button(
+                    label="⬇️ Performance report (JSON)",
+                    data=run.to_json(),
+                    file_name="performance.json",
+                    mime="application/json",
+                    key="performance_json"
+                )
+            with col2:
+                st.download_button(
+                    label="⬇️ Performance metrics (Prometheus)",
+                    data=run.to_prometheus(),
+                    file_name="performance.prom",
+                    mime="text/plain",
+                    key="performance_prometheus"
+                )
     
     def get_mime_type(self, filename):
         """Get appropriate MIME type for file"""
@@ -255,7 +520,64 @@ Reports Generated:
         self.render_header()
         
         st.markdown("---")
-        
+
+        # Rendering settings
+        with st.sidebar:
+            st.header("⚙️ Settings")
+            self.pipeline.max_workers = st.number_input(
+                "PDF rendering workers",
+                min_value=1,
+                max_value=max(os.cpu_count() or 1, self.pdf_generator.max_workers),
+                value=self.pdf_generator.max_workers,
+                help="Number of processes used to render PDFs in parallel (1 renders serially)"
+            )
+            self.pipeline.pdf_engine = st.selectbox(
+                "PDF engine",
+                PDF_ENGINES,
+                index=PDF_ENGINES.index(self.pdf_generator.engine),
+                help="ReportLab draws the first page, deviation statement and extra items directly as tables, "
+                     "much faster than WeasyPrint on bills with thousands of items"
+            )
+            self.use_output_cache = st.checkbox(
+                "Reuse results for re-uploaded files",
+                value=True,
+                help="Return the saved reports instantly when an identical workbook is uploaded again"
+            )
+            self.flat_zip_layout = st.checkbox(
+                "One folder per workbook in ZIP",
+                value=False,
+                help="Put each workbook's reports in a folder instead of a separate ZIP inside the download"
+            )
+            incremental = st.checkbox(
+                "Incremental regeneration",
+                value=False,
+                help="For a new bill of an agreement processed before, recompute only the changed items and reuse unchanged documents"
+            )
+            self.pipeline.incremental = self.incremental_builder if incremental else None
+            running_bills = st.checkbox(
+                "Running bill ledger",
+                value=False,
+                help="Record each bill and show the amount paid vide the last bill and the quantities since it for the next bill of the same agreement"
+            )
+            self.pipeline.ledger = self.ledger if running_bills else None
+            self.run_in_background = st.checkbox(
+                "Process in background",
+                value=True,
+                help="Process as a background job with live progress; the page can be closed and its link reopened later"
+            )
+            self.parallel_workbooks = st.checkbox(
+                "Process workbooks in parallel",
+                value=True,
+                disabled=not self.run_in_background,
+                help="Background jobs of several workbooks process up to the PDF worker count of them at once, "
+                     "one per CPU core; running bill ledger jobs always go one bill at a time"
+            )
+            self.show_performance = st.checkbox(
+                "Show performance details",
+                value=False,
+                help="Show how long parsing, rendering and PDF generation took for each workbook"
+            )
+
         # File upload section
         st.header("📁 Upload Excel Files")
         st.markdown("Upload up to 10 Excel files for batch processing")
@@ -268,32 +590,57 @@ Reports Generated:
             help="Upload Excel files containing Title, Work Order, Bill Quantity, and optionally Extra Items sheets"
         )
         
-        if uploaded_files:
-            st.success(f"📊 {len(uploaded_files)} file(s) uploaded successfully!")
-            
-            # Display file information
-            with st.expander("📋 File Information"):
-                for file in uploaded_files:
-                    file_size_mb = file.size / (1024 * 1024)
-                    st.write(f"• **{file.name}** ({file_size_mb:.2f} MB)")
-                    if file_size_mb > 50:
-                        st.error(f"⚠️ File {file.name} exceeds 50MB limit")
-            
-            # Show processing options
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                if st.button("🚀 Process Files", type="primary", key="process_btn"):
-                    try:
-                        with st.spinner('Processing files...'):
-                            self.process_files(uploaded_files)
-                    except Exception as e:
-                        st.error(f"Error processing files: {str(e)}")
-                        st.error(traceback.format_exc())
+        # Background job of this page, kept in the URL so the page can be closed and reopened
+        job_id = st.query_params.get('job')
+        
+        # Stages run during this rerun are added to the session's performance run
+        with instrumentation.recording(self.get_performance_run()):
+            if uploaded_files:
+                st.success(f"📊 {len(uploaded_files)} file(s) uploaded successfully!")
+                
+                # Display file information
+                with st.expander("📋 File Information"):
+                    for file in uploaded_files:
+                        file_size_mb = file.size / (1024 * 1024)
+                        st.write(f"• **{file.name}** ({file_size_mb:.2f} MB)")
+                        if file_size_mb > 50:
+                            st.error(f"⚠️ File {file.name} exceeds 50MB limit")
+                
+                # Show processing options
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    if st.button("🚀 Process Files", type="primary", key="process_btn"):
+                        try:
+                            if self.run_in_background:
+                                self.submit_job(uploaded_files)
+                                job_id = st.query_params['job']
+                            else:
+                                with st.spinner('Processing files...'):
+                                    self.process_files(uploaded_files)
+                        except Exception as e:
+                            st.error(f"Error processing files: {str(e)}")
+                            st.error(traceback.format_exc())
+                
+                with col2:
+                    if st.button("🔄 Clear Files", key="clear_btn"):
+                        st.session_state.pop('bill_results', None)
+                        st.session_state.pop('bill_batch_zip', None)
+                        st.session_state.pop('bill_performance', None)
+                        st.session_state.pop('bill_job_batch', None)
+                        st.query_params.pop('job', None)
+                        st.rerun()
+                
+                # Results survive reruns, so downloads never trigger reprocessing
+                batch = self.get_session_batch(uploaded_files)
+                if batch and not job_id:
+                    self.provide_download_options(batch)
             
-            with col2:
-                if st.button("🔄 Clear Files", key="clear_btn"):
-                    st.rerun()
+            if job_id:
+                self.show_job(job_id)
+        
+        if self.show_performance:
+            self.show_performance_details()
         
         # Footer with best wishes
         st.markdown("---")
@@ -0,0 +1,147 @@
+"""Headless batch generation of bill reports.
+
+Processes every workbook found in the given directories, glob patterns or
+file paths and writes the reports of each one to its own folder under the
+output directory, along with a manifest.json listing per-file results.
+
+    python batch_generate.py bills/ "archive/*.xlsx" -o out --workers 4
+
+Per-stage timings are recorded in the manifest; --metrics also writes them
+in the Prometheus text format.
+
+Exits with status 1 if any workbook failed and 2 if no workbooks were found.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from utils import batch_scheduler, instrumentation
+from utils.batch_scheduler import BatchScheduler
+from utils.ledger import DEFAULT_LEDGER_PATH
+from utils.pdf_generator import PDF_ENGINES, DEFAULT_PDF_ENGINE
+
+WORKBOOK_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+
+def collect_workbooks(inputs):
+    """Expand directories, glob patterns and file paths into a sorted list of workbooks"""
+    workbooks = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            candidates = [str(path) for path in Path(entry).iterdir()]
+        else:
+            candidates = glob.glob(entry) or [entry]
+
+        for candidate in candidates:
+            path = Path(candidate)
+            if path.is_file() and path.suffix.lower() in WORKBOOK_EXTENSIONS and not path.name.startswith('~$'):
+                workbooks.append(path.resolve())
+
+    return sorted(set(workbooks))
+
+def assign_output_dirs(workbooks, output_dir):
+    """Give each workbook its own output folder, keeping same-named workbooks apart"""
+    assigned = {}
+    used = set()
+    for workbook in workbooks:
+        folder = workbook.stem
+        suffix = 2
+        while folder in used:
+            folder = f"{workbook.stem}_{suffix}"
+            suffix += 1
+        used.add(folder)
+        assigned[workbook] = Path(output_dir) / folder
+    return assigned
+
+def process_workbook(workbook_path, target_dir, use_cache=True, incremental=False, ledger=None, pdf_engine=None):
+    """Generate and write the reports of one workbook in this process, returning its manifest entry"""
+    options = {'use_cache': use_cache, 'incremental': incremental, 'ledger': ledger, 'pdf_engine': pdf_engine}
+    return batch_scheduler.process_workbook(workbook_path, options, target_dir)
+
+def run_batch(workbooks, output_dir, workers=1, use_cache=True, incremental=False, ledger=None, pdf_engine=None):
+    """Process workbooks on a pool of warmed worker processes, yielding manifest entries as they finish
+
+    With a ledger (its path) the workbooks are processed one at a time in
+    order, so each running bill follows the one before it.
+    """
+    targets = assign_output_dirs(workbooks, output_dir)
+
+    if workers <= 1 or len(workbooks) <= 1 or ledger:
+        for workbook in workbooks:
+            yield process_workbook(workbook, targets[workbook], use_cache, incremental, ledger, pdf_engine)
+        return
+
+    options = {'use_cache': use_cache, 'incremental': incremental, 'pdf_engine': pdf_engine}
+    with BatchScheduler(min(workers, len(workbooks))) as scheduler:
+        for _, entry in scheduler.run(workbooks, options, targets):
+            yield entry
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate bill reports for many workbooks without the web UI")
+    parser.add_argument('inputs', nargs='+', help="Workbook files, directories or glob patterns")
+    parser.add_argument('-o', '--output-dir', required=True, help="Directory to write the reports to")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help="Number of workbooks processed in parallel (default: CPU count)")
+    parser.add_argument('--no-cache', action='store_true', help="Always regenerate, ignoring cached outputs")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Regenerate from each agreement's previous run, redoing only changed items and documents")
+    parser.add_argument('--ledger', nargs='?', const=str(DEFAULT_LEDGER_PATH),
+                        help="Record each bill in this running bill ledger (default: %(const)s) and show it against "
+                             "the agreement's previous bill; workbooks are then processed one at a time in name order")
+    parser.add_argument('--pdf-engine', choices=PDF_ENGINES, default=DEFAULT_PDF_ENGINE,
+                        help="Engine for the first page, deviation statement and extra items PDFs; reportlab draws "
+                             "them directly as tables, much faster on large bills (default: %(default)s)")
+    parser.add_argument('--metrics', help="Also write per-stage metrics to this file in the Prometheus text format")
+    args = parser.parse_args(argv)
+
+    workbooks = collect_workbooks(args.inputs)
+    if not workbooks:
+        print("No workbooks found.", file=sys.stderr)
+        return 2
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    started = datetime.now()
+    print(f"Processing {len(workbooks)} workbook(s) with {args.workers} worker(s)...")
+
+    entries = []
+    for entry in run_batch(workbooks, output_dir, args.workers, not args.no_cache, args.incremental, args.ledger,
+                           args.pdf_engine):
+        entries.append(entry)
+        if entry['status'] == 'ok':
+            print(f"[ok]     {entry['file']} ({entry['seconds']}s)")
+        else:
+            print(f"[failed] {entry['file']}: {entry['error']}", file=sys.stderr)
+
+    # Manifest in input order, whatever order the workers finished in
+    order = {str(workbook): idx for idx, workbook in enumerate(workbooks)}
+    entries.sort(key=lambda entry: order.get(entry['file'], len(order)))
+    failed = sum(1 for entry in entries if entry['status'] != 'ok')
+
+    manifest = {
+        'started': started.isoformat(timespec='seconds'),
+        'finished': datetime.now().isoformat(timespec='seconds'),
+        'total': len(entries),
+        'succeeded': len(entries) - failed,
+        'failed': failed,
+        'files': entries
+    }
+    with open(output_dir / 'manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    if args.metrics:
+        batch_run = instrumentation.PerformanceRun()
+        for entry in entries:
+            batch_run.extend(entry.get('performance', {}).get('records', []))
+        with open(args.metrics, 'w') as f:
+            f.write(batch_run.to_prometheus())
+
+    print(f"Done: {len(entries) - failed} succeeded, {failed} failed. Manifest: {output_dir / 'manifest.json'}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,361 @@
+"""Benchmark the bill pipeline stage by stage.
+
+Runs ingest -> report -> PDF -> ZIP separately on the sample workbooks in
+attached_assets/ and on synthetic workbooks of 100, 1,000 and 10,000 items,
+reporting wall time, peak RSS and throughput for each stage.
+
+    python benchmarks/bench_pipeline.py --save benchmarks/results/baseline.json
+    python benchmarks/bench_pipeline.py --compare benchmarks/results/baseline.json
+
+--compare exits with status 1 when any stage is slower than the baseline by
+more than --tolerance (default 20%).
+
+The tabular documents (first page, deviation statement, extra items) are
+also rendered with each PDF engine in turn, as table_pdfs_<engine> stages,
+and the engines compared per workbook:
+
+    python benchmarks/bench_pipeline.py --no-samples --sizes 1000 10000 --engines weasyprint reportlab
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from utils.archive_writer import ReportArchive
+from utils.excel_processor import ExcelProcessor
+from utils.report_generator import ReportGenerator
+from utils.sheet_cache import SheetCache
+
+DEFAULT_SIZES = [100, 1000, 10000]
+
+# Mirrors utils.pdf_generator.PDF_ENGINES, which cannot be imported without WeasyPrint
+DEFAULT_ENGINES = ['weasyprint', 'reportlab']
+
+class MemoryWorkbook:
+    """In-memory workbook with the interface of a Streamlit upload"""
+
+    def __init__(self, name, content):
+        self.name = name
+        self.size = len(content)
+        self._buffer = io.BytesIO(content)
+
+    def read(self, *args):
+        return self._buffer.read(*args)
+
+    def seek(self, *args):
+        return self._buffer.seek(*args)
+
+    def getvalue(self):
+        return self._buffer.getvalue()
+
+class RssSampler:
+    """Samples resident set size in a background thread to find a stage's peak"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current_rss():
+        """Current RSS in bytes, or the process peak where /proc is unavailable"""
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError):
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == 'darwin' else peak * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current_rss())
+
+def build_synthetic_workbook(items):
+    """Create a workbook with the given number of Work Order / Bill Quantity items"""
+    from openpyxl import Workbook
+
+    workbook = Workbook()
+    title = workbook.active
+    title.title = 'Title'
+    title.append(['FOR CONTRACTORS & SUPPLIERS ONLY', None])
+    for key, value in [
+        ('Agreement No.', f'BENCH/{items}'),
+        ('Name of Work', f'Synthetic benchmark work with {items} items'),
+        ('Name of Contractor or supplier', 'M/s. Benchmark Builders'),
+        ('Date of Commencement', '01/04/2024'),
+        ('Date of Completion', '31/03/2025'),
+        ('Date of measurement', '15/03/2025'),
+    ]:
+        title.append([key, value])
+
+    header = ['Item', 'Description', 'Unit', 'Quantity', 'Rate', 'Amount', 'BSR']
+    work_order = workbook.create_sheet('Work Order')
+    bill_quantity = workbook.create_sheet('Bill Quantity')
+    work_order.append(header)
+    bill_quantity.append(header)
+    for idx in range(1, items + 1):
+        quantity = float(idx % 50 + 1)
+        rate = round(100 + (idx * 37) % 900 + 0.25, 2)
+        executed = quantity + (idx % 7) - 3
+        description = f'Item {idx}: supply and fixing of material as per specification'
+        work_order.append([idx, description, 'Nos', quantity, rate, round(quantity * rate, 2), f'BSR-{idx}'])
+        bill_quantity.append([idx, description, 'Nos', executed, rate, 0, f'BSR-{idx}'])
+
+    extra_items = workbook.create_sheet('Extra Items')
+    extra_items.append(['S.No.', 'Particulars', 'Unit', 'Qty.', 'Rate', 'Amount', 'Remark'])
+    for idx in range(1, max(1, items // 10) + 1):
+        extra_items.append([f'E{idx}', f'Extra item {idx}', 'Nos', 2.0, 150.0, 300.0, 'Extra Item'])
+
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+def load_workbooks(sizes, include_samples=True):
+    """Sample and synthetic workbooks as (name, bytes) pairs"""
+    workbooks = []
+    if include_samples:
+        for path in sorted(glob.glob(str(ROOT / 'attached_assets' / '*.xls*'))):
+            workbooks.append((Path(path).name, Path(path).read_bytes()))
+    for size in sizes:
+        workbooks.append((f'synthetic_{size}.xlsx', build_synthetic_workbook(size)))
+    return workbooks
+
+def measure(stage, workbook, items, func, repeat=1):
+    """Run a stage, returning its result and a result record (best wall time, peak RSS)"""
+    best = None
+    result = None
+    with RssSampler() as sampler:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+
+    record = {
+        'workbook': workbook,
+        'stage': stage,
+        'items': items,
+        'seconds': round(best, 6),
+        'peak_rss_mb': round(sampler.peak / (1024 * 1024), 2),
+        'items_per_second': round(items / best, 1) if best > 0 else None,
+    }
+    return result, record
+
+def load_pipeline(excel_processor, report_generator):
+    """Pipeline rendering PDFs serially, or None when WeasyPrint cannot load"""
+    try:
+        from utils.bill_pipeline import BillPipeline
+        from utils.pdf_generator import PDFGenerator
+    except (ImportError, OSError) as e:
+        print(f"PDF stages skipped, WeasyPrint unavailable: {e}", file=sys.stderr)
+        return None
+    return BillPipeline(excel_processor, report_generator, PDFGenerator(max_workers=1))
+
+def run_benchmarks(workbooks, repeat=1, include_pdf=True, engines=DEFAULT_ENGINES):
+    """Benchmark every stage on every workbook"""
+    records = []
+    # Ingest is measured cold; ingest_sheet_cache re-reads a workbook whose sheets are all cached
+    excel_processor = ExcelProcessor(sheet_cache=SheetCache(max_entries=0))
+    cached_processor = ExcelProcessor(sheet_cache=SheetCache())
+    report_generator = ReportGenerator()
+    pipeline = load_pipeline(excel_processor, report_generator) if include_pdf else None
+    pdf_generator = pipeline.pdf_generator if pipeline else None
+    if pipeline is not None:
+        # The section and combined stages stay on WeasyPrint, comparable with older baselines
+        pipeline.pdf_engine = 'weasyprint'
+
+    for name, content in workbooks:
+        try:
+            file_data, record = measure(
+                'ingest', name, 0,
+                lambda: excel_processor.read_workbook(MemoryWorkbook(name, content)),
+                repeat
+            )
+        except Exception as e:
+            print(f"Skipping {name}: {str(e)}", file=sys.stderr)
+            continue
+
+        items = len(file_data['work_order_data']['items']) + len(file_data['bill_quantity_data']['items'])
+        record['items'] = items
+        record['items_per_second'] = round(items / record['seconds'], 1) if record['seconds'] else None
+        record['bytes_in'] = len(content)
+        records.append(record)
+
+        cached_processor.process_excel_file(MemoryWorkbook(name, content))
+        _, record = measure('ingest_sheet_cache', name, items,
+                            lambda: cached_processor.process_excel_file(MemoryWorkbook(name, content)), repeat)
+        records.append(record)
+
+        _, record = measure('prepare_report_data', name, items,
+                            lambda: report_generator.prepare_report_data(file_data), repeat)
+        records.append(record)
+
+        reports, record = measure('generate_all_reports', name, items,
+                                  lambda: report_generator.generate_all_reports(file_data), repeat)
+        record['bytes_out'] = sum(len(html) for html in reports.values())
+        records.append(record)
+
+        if pipeline is None:
+            continue
+
+        jobs = pipeline.get_pdf_jobs(reports)
+        section_jobs = [(html, document_type) for output_name, html, document_type in jobs
+                        if output_name != 'combined_report.pdf']
+
+        pdfs, record = measure(
+            'generate_pdf', name, items,
+            lambda: [pdf_generator.generate_pdf(html, document_type) for html, document_type in section_jobs],
+            repeat
+        )
+        record['bytes_out'] = sum(len(pdf) for pdf in pdfs)
+        records.append(record)
+
+        combined, record = measure('generate_combined_pdf', name, items,
+                                   lambda: pdf_generator.generate_combined_pdf(section_jobs), repeat)
+        record['bytes_out'] = len(combined)
+        records.append(record)
+
+        _, record = measure('create_combined_pdf', name, items,
+                            lambda: pdf_generator.create_combined_pdf(pdfs), repeat)
+        records.append(record)
+
+        for engine in engines:
+            pipeline.pdf_engine = engine
+            table_jobs = [(content, document_type) for _, content, document_type in pipeline.get_pdf_jobs(reports)
+                          if document_type in ('first_page', 'deviation_statement', 'extra_items')]
+            table_pdfs, record = measure(f'table_pdfs_{engine}', name, items,
+                                         lambda: [pdf_generator.render_job(job) for job in table_jobs], repeat)
+            record['bytes_out'] = sum(len(pdf) for pdf in table_pdfs)
+            records.append(record)
+        pipeline.pdf_engine = 'weasyprint'
+
+        outputs = pipeline.create_file_outputs(reports, name)
+
+        def build_zip():
+            archive = ReportArchive()
+            archive.add_workbook(name, outputs)
+            return archive.getvalue()
+
+        archive_bytes, record = measure('zip', name, items, build_zip, repeat)
+        record['bytes_in'] = sum(len(data) for data in outputs.values())
+        record['bytes_out'] = len(archive_bytes)
+        records.append(record)
+
+    return records
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_table(records):
+    print(f"{'workbook':<45} {'stage':<22} {'items':>7} {'seconds':>10} {'peak MB':>9} {'items/s':>12}")
+    for record in records:
+        print(f"{record['workbook'][:45]:<45} {record['stage']:<22} {record['items']:>7} "
+              f"{record['seconds']:>10.4f} {record['peak_rss_mb']:>9.1f} {record['items_per_second'] or 0:>12.1f}")
+
+def print_engine_comparison(records, engines):
+    """Print each workbook's tabular document time per PDF engine, relative to the first engine"""
+    by_workbook = {}
+    for record in records:
+        if record['stage'].startswith('table_pdfs_'):
+            by_workbook.setdefault(record['workbook'], {})[record['stage'][len('table_pdfs_'):]] = record['seconds']
+    if not by_workbook:
+        return
+
+    print(f"\nPDF engines (first page, deviation statement, extra items), relative to {engines[0]}:")
+    for workbook, seconds in by_workbook.items():
+        reference = seconds.get(engines[0])
+        timings = '  '.join(
+            f"{engine} {seconds[engine]:.4f}s" + (f" (x{reference / seconds[engine]:.1f})" if reference and seconds[engine] else '')
+            for engine in engines if engine in seconds
+        )
+        print(f"  {workbook[:45]:<45} {timings}")
+
+def compare(records, baseline_path, tolerance):
+    """Print per-stage changes against a saved baseline; return True when there are regressions"""
+    with open(baseline_path) as f:
+        baseline = {(r['workbook'], r['stage']): r for r in json.load(f)['results']}
+
+    regressions = []
+    print(f"\nComparison with {baseline_path} (tolerance {tolerance:.0%}):")
+    for record in records:
+        previous = baseline.get((record['workbook'], record['stage']))
+        if not previous or not previous['seconds']:
+            continue
+        change = record['seconds'] / previous['seconds'] - 1
+        flag = 'REGRESSION' if change > tolerance else ''
+        if flag:
+            regressions.append(record)
+        print(f"  {record['workbook'][:45]:<45} {record['stage']:<22} "
+              f"{previous['seconds']:>9.4f}s -> {record['seconds']:>9.4f}s ({change:+.1%}) {flag}")
+
+    return bool(regressions)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the bill pipeline stage by stage")
+    parser.add_argument('--sizes', type=int, nargs='*', default=DEFAULT_SIZES,
+                        help="Item counts of the synthetic workbooks (default: 100 1000 10000)")
+    parser.add_argument('--no-samples', action='store_true', help="Skip the workbooks in attached_assets/")
+    parser.add_argument('--skip-pdf', action='store_true', help="Skip PDF and ZIP stages")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per stage; the best time is reported")
+    parser.add_argument('--engines', nargs='*', choices=DEFAULT_ENGINES, default=DEFAULT_ENGINES,
+                        help="PDF engines to render the tabular documents with (default: both)")
+    parser.add_argument('--save', help="Write results as a JSON baseline")
+    parser.add_argument('--compare', help="Compare against a JSON baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown before flagging a regression")
+    args = parser.parse_args(argv)
+
+    workbooks = load_workbooks(args.sizes, not args.no_samples)
+    records = run_benchmarks(workbooks, args.repeat, not args.skip_pdf, args.engines)
+    print_table(records)
+    if args.engines:
+        print_engine_comparison(records, args.engines)
+
+    if args.save:
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump({
+                'meta': {
+                    'commit': get_git_commit(),
+                    'timestamp': datetime.now().isoformat(timespec='seconds'),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'cpu_count': os.cpu_count(),
+                },
+                'results': records,
+            }, f, indent=2)
+        print(f"\nSaved baseline to {args.save}")
+
+    if args.compare and compare(records, args.compare, args.tolerance):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
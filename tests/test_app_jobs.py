@@ -0,0 +1,36 @@
+from streamlit.testing.v1 import AppTest
+
+from utils.job_queue import DONE, RUNNING, JobStore
+
+def show_job_page(job_dir, job_id):
+    """Show one job on a page, with an app whose job queue reads from job_dir"""
+    from types import SimpleNamespace
+
+    from app import BillGeneratorApp
+    from utils.job_queue import JobStore
+
+    app = BillGeneratorApp.__new__(BillGeneratorApp)
+    app.job_queue = SimpleNamespace(store=JobStore(job_dir))
+    app.flat_zip_layout = False
+    app.show_job(job_id)
+
+def test_running_job_offers_downloads_of_finished_files(tmp_path):
+    store = JobStore(tmp_path)
+    job_id = store.create_job([('first.xlsx', b'1'), ('second.xlsx', b'2')], {})
+    store.update_job(job_id, RUNNING)
+    store.save_outputs(job_id, 0, {'first_page.pdf': b'%PDF first', 'summary.txt': b'summary'})
+    store.update_file(job_id, 0, status=DONE)
+    store.update_file(job_id, 1, status=RUNNING, current='reports')
+
+    page = AppTest.from_function(show_job_page, args=(str(tmp_path), job_id)).run()
+
+    assert not page.exception
+    assert [header.value for header in page.header] == ['⏳ Processing']
+    labels = [button.proto.label for button in page.get('download_button')]
+    assert labels == ['⬇️ first_page.pdf', '⬇️ summary.txt']
+
+    # The second file's downloads appear once it is done
+    store.save_outputs(job_id, 1, {'first_page.pdf': b'%PDF second'})
+    store.update_file(job_id, 1, status=DONE)
+    page.run()
+    assert len(page.get('download_button')) == 3
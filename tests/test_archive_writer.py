@@ -0,0 +1,51 @@
+import zipfile
+
+import pytest
+
+from utils.archive_writer import ReportArchive
+
+OUTPUTS = {'first_page.pdf': b'%PDF-1.4 first', 'summary.txt': b'summary ' * 100}
+
+@pytest.mark.parametrize('layout', ['nested', 'flat'])
+def test_with_block_finishes_the_archive(layout):
+    with ReportArchive(layout=layout, spool_size=64) as archive:
+        archive.add_workbook('bill.xlsx', OUTPUTS)
+
+    assert archive.file.tell() == 0
+    data = archive.file.read()
+    assert len(data) == archive.size
+    with zipfile.ZipFile(archive.file) as outer:
+        if layout == 'flat':
+            assert {name: outer.read(name) for name in outer.namelist()} == {
+                f"bill/{name}": content for name, content in OUTPUTS.items()
+            }
+        else:
+            with zipfile.ZipFile(outer.open('bill_reports.zip')) as inner:
+                assert {name: inner.read(name) for name in inner.namelist()} == OUTPUTS
+
+def test_error_discards_the_archive():
+    with pytest.raises(RuntimeError):
+        with ReportArchive() as archive:
+            archive.add('a.txt', b'a')
+            raise RuntimeError('stop')
+    assert archive.file.closed
+
+def test_close_can_be_repeated():
+    archive = ReportArchive()
+    archive.add('a.txt', b'a')
+    archive.close()
+    with zipfile.ZipFile(archive.close()) as finished:
+        assert finished.read('a.txt') == b'a'
+
+def test_reader_outlives_the_archive():
+    archive = ReportArchive()
+    archive.add('a.txt', b'a')
+    reader = archive.reader()
+    archive.file.close()
+
+    data = reader.read()
+    assert len(data) == archive.size
+    reader.seek(0)
+    with zipfile.ZipFile(reader) as finished:
+        assert finished.read('a.txt') == b'a'
+    reader.close()
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from utils import batch_scheduler
+from utils.batch_scheduler import BatchScheduler
+
+def fake_process_workbook(workbook, options, target_dir=None, progress_queue=None):
+    """Kills its worker for 'crash' workbooks; 'crash-once' only on the first attempt"""
+    marker = os.path.join(options['marker_dir'], os.path.basename(workbook))
+    if workbook.endswith('crash') or (workbook.endswith('crash-once') and not os.path.exists(marker)):
+        open(marker, 'w').close()
+        os._exit(1)
+    return {'file': workbook, 'status': 'ok', 'pid': os.getpid()}
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    # Pool workers are forked, so they see the patched module
+    monkeypatch.setattr(batch_scheduler, 'process_workbook', fake_process_workbook)
+    monkeypatch.setattr(batch_scheduler, 'init_worker', lambda: None)
+    scheduler = BatchScheduler(max_workers=2)
+    yield scheduler
+    scheduler.shutdown()
+
+def run(scheduler, workbooks, tmp_path):
+    return dict(scheduler.run(workbooks, {'marker_dir': str(tmp_path)}))
+
+def test_workbooks_interrupted_by_a_dead_worker_run_again(scheduler, tmp_path):
+    workbooks = ['a', 'b', 'crash-once', 'c', 'd']
+    entries = run(scheduler, workbooks, tmp_path)
+    assert {workbook: entry['status'] for workbook, entry in entries.items()} == dict.fromkeys(workbooks, 'ok')
+
+def test_workbook_that_keeps_killing_its_worker_fails_alone(scheduler, tmp_path):
+    workbooks = ['a', 'crash', 'b', 'c']
+    entries = run(scheduler, workbooks, tmp_path)
+    assert {workbook: entry['status'] for workbook, entry in entries.items()} == {
+        'a': 'ok', 'crash': 'failed', 'b': 'ok', 'c': 'ok'
+    }
+
+    # The scheduler keeps working on a fresh pool
+    assert run(scheduler, ['e'], tmp_path)['e']['status'] == 'ok'
@@ -0,0 +1,158 @@
+import datetime
+import io
+import glob
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import ROOT
+from utils.excel_processor import ExcelProcessor
+from utils.sheet_cache import SheetCache
+
+SAMPLE_WORKBOOKS = sorted(glob.glob(str(ROOT / 'attached_assets' / '*.xlsx')))
+
+# Sheet name -> (parser method, quantity key, amount key, skip zero quantity) of the iterrows reference
+ITEM_SHEETS = {
+    'Work Order': ('process_work_order_sheet', 'quantity', 'amount', False),
+    'Bill Quantity': ('process_bill_quantity_sheet', 'quantity_bill', 'amount_bill', True),
+    'Extra Items': ('process_extra_items_sheet', 'quantity', 'amount', True),
+}
+
+def reference_parse_items(df, quantity_key, amount_key, skip_zero_quantity):
+    """The row-by-row iterrows parser the column-wise parse_item_rows replaced"""
+    processor = ExcelProcessor()
+    if df is None:
+        return {'items': [], 'total': 0}
+
+    items = []
+    df.columns = [str(col).strip() for col in df.columns]
+
+    for idx, row in df.iterrows():
+        if pd.isna(row.iloc[0]) or 'serial' in str(row.iloc[0]).lower():
+            continue
+
+        quantity = processor.safe_float(row.iloc[3]) if len(row) > 3 else 0
+        if skip_zero_quantity and quantity <= 0:
+            continue
+
+        serial_val = row.iloc[0] if pd.notna(row.iloc[0]) else ''
+        serial_no = str(serial_val).strip() if serial_val and str(serial_val).strip() and str(serial_val).strip() != 'nan' else ''
+
+        item = {
+            'serial_no': serial_no,
+            'description': str(row.iloc[1]).strip() if len(row) > 1 and pd.notna(row.iloc[1]) else '',
+            'unit': str(row.iloc[2]).strip() if len(row) > 2 and pd.notna(row.iloc[2]) else '',
+            quantity_key: quantity,
+            'rate': processor.safe_float(row.iloc[4]) if len(row) > 4 else 0,
+            amount_key: processor.safe_float(row.iloc[5]) if len(row) > 5 else 0,
+            'remark': str(row.iloc[6]).strip() if len(row) > 6 and pd.notna(row.iloc[6]) else ''
+        }
+
+        if item[amount_key] == 0 and item[quantity_key] > 0 and item['rate'] > 0:
+            item[amount_key] = item[quantity_key] * item['rate']
+
+        items.append(item)
+
+    return {'items': items, 'total': sum(item[amount_key] for item in items)}
+
+def parse_both(df, sheet_name):
+    method, quantity_key, amount_key, skip_zero_quantity = ITEM_SHEETS[sheet_name]
+    expected = reference_parse_items(df.copy(), quantity_key, amount_key, skip_zero_quantity)
+    actual = getattr(ExcelProcessor(), method)(df.copy())
+    return expected, actual
+
+def assert_same_rows(expected, actual):
+    assert len(actual['items']) == len(expected['items'])
+    for row, (expected_item, actual_item) in enumerate(zip(expected['items'], actual['items'])):
+        assert actual_item.to_dict() == expected_item, f"row {row} differs"
+    assert actual['total'] == pytest.approx(expected['total'])
+
+def read_sample_sheets(path):
+    with open(path, 'rb') as f:
+        content = f.read()
+    processor = ExcelProcessor(sheet_cache=SheetCache(max_entries=0))
+    excel_data, _ = processor.read_sheets(content)
+    return excel_data
+
+@pytest.mark.parametrize('path', SAMPLE_WORKBOOKS, ids=lambda path: path.rsplit('/', 1)[-1])
+def test_sample_workbooks_match_reference(path):
+    excel_data = read_sample_sheets(path)
+    compared = 0
+    for sheet_name in ITEM_SHEETS:
+        if sheet_name in excel_data:
+            assert_same_rows(*parse_both(excel_data[sheet_name], sheet_name))
+            compared += 1
+    assert compared >= 2
+
+def mixed_frame():
+    """Object columns mixing header rows, blanks, padded numbers, booleans, dates and zero amounts"""
+    return pd.DataFrame({
+        'Serial No.': ['Serial No.', 1, '2', ' 3 ', None, np.nan, 'nan', 0, 4.5, 'A-1', 6, 7],
+        'Description': ['Description', 'Earth work', None, '  Brick work ', 'Orphan', 'x', 'y', 'zero', 'half', 'alpha',
+                        datetime.datetime(2024, 1, 2), 12],
+        'Unit': ['Unit', 'cum', 'sqm', None, 'no', 'no', 'no', 'no', 'kg', ' m ', 'no', 'no'],
+        'Quantity': ['Qty', 10, ' 12.5 ', 0, 3, 1, 2, 5, True, '-1', 4, np.nan],
+        'Rate': ['Rate', 100.5, '20', 30, 'bad', 5, 6, 7, 8, 9, datetime.datetime(2024, 1, 3), 11],
+        'Amount': ['Amount', 0, None, 0, 4, '', 0, 35, 0, 0, 44, 0],
+        'Remark': ['Remark', None, 'ok', ' padded ', 1.5, None, None, None, None, None, None, 'last'],
+    }, dtype=object)
+
+@pytest.mark.parametrize('sheet_name', list(ITEM_SHEETS))
+def test_mixed_type_frame_matches_reference(sheet_name):
+    assert_same_rows(*parse_both(mixed_frame(), sheet_name))
+
+@pytest.mark.parametrize('sheet_name', list(ITEM_SHEETS))
+def test_short_frame_matches_reference(sheet_name):
+    # Sheets with fewer than seven columns fill the missing fields with blanks and zeros
+    df = pd.DataFrame({'Serial': ['Serial', 1, 2], 'Description': ['Desc', 'a', 'b'], 'Unit': ['Unit', 'm', None],
+                       'Quantity': ['Qty', 2, 0]}, dtype=object)
+    assert_same_rows(*parse_both(df, sheet_name))
+
+def test_frame_without_columns_returns_no_items():
+    # Known difference: the iterrows parser raised on rows without cells
+    df = pd.DataFrame(index=range(3))
+    with pytest.raises(IndexError):
+        reference_parse_items(df.copy(), 'quantity', 'amount', False)
+    assert ExcelProcessor().process_work_order_sheet(df.copy()) == {'items': [], 'total': 0}
+
+def test_all_numeric_sheet_keeps_integer_serials():
+    # Known difference: iterrows upcast every cell of an all-numeric row to float,
+    # so integer serials read "1.0"; the column-wise parser keeps "1"
+    df = pd.DataFrame({'Serial': [1, 2], 'Description': [0.5, 1.5], 'Unit': [1.0, 2.0],
+                       'Quantity': [2.0, 3.0], 'Rate': [10.0, 20.0], 'Amount': [0.0, 0.0]})
+    expected, actual = parse_both(df, 'Work Order')
+    assert [item['serial_no'] for item in expected['items']] == ['1.0', '2.0']
+    assert [item.serial_no for item in actual['items']] == ['1', '2']
+
+    # Everything else about the rows is unchanged
+    for expected_item, actual_item in zip(expected['items'], actual['items']):
+        values = actual_item.to_dict()
+        values['serial_no'] = expected_item['serial_no']
+        assert values == expected_item
+
+class MemoryUpload:
+    """Minimal stand-in for a Streamlit upload"""
+
+    def __init__(self, name, content):
+        self.name = name
+        self.size = len(content)
+        self._file = io.BytesIO(content)
+
+    def read(self):
+        return self._file.read()
+
+    def seek(self, position):
+        self._file.seek(position)
+
+def test_read_workbook_raises_its_own_error():
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        pd.DataFrame({'a': [1]}).to_excel(writer, sheet_name='Title', index=False)
+    processor = ExcelProcessor(sheet_cache=SheetCache(max_entries=0))
+
+    with pytest.raises(ValueError, match='Missing required sheets'):
+        processor.read_workbook(MemoryUpload('title_only.xlsx', buffer.getvalue()))
+    with pytest.raises(ValueError, match='Empty file provided'):
+        processor.read_workbook(MemoryUpload('empty.xlsx', b''))
+    assert processor.process_excel_file(MemoryUpload('empty.xlsx', b'')) is None
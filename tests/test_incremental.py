@@ -0,0 +1,66 @@
+import json
+
+import numpy as np
+
+from utils.incremental import STATE_FORMAT_VERSION, IncrementalStore, digest
+from utils.items import BillQuantityItem, DeviationItem, MergedItem, WorkOrderItem
+
+def sample_state():
+    billed = MergedItem(WorkOrderItem('1', 'Earth work', 'cum', 10, 100.5, 1005.0),
+                        BillQuantityItem('1', 'Earth work', 'cum', 12, 100.5, 1206.0))
+    unbilled = MergedItem(WorkOrderItem('2', 'Brick work', 'sqm', 3, 20, 60))
+    return {
+        'version': STATE_FORMAT_VERSION,
+        'environment': 'env',
+        'rows': {
+            ('a', 'b'): (billed, DeviationItem(billed)),
+            ('c', ''): (unbilled, DeviationItem(unbilled)),
+        },
+        'documents': {'first_page_html': {'inputs': 'i', 'html': '<p>x</p>', 'pdf': b'%PDF-1.4\x00\xff'}},
+        'combined_pdf': None
+    }
+
+def test_state_round_trips_through_json(tmp_path):
+    store = IncrementalStore(tmp_path)
+    store.save('agreement', sample_state())
+
+    # Stored as plain JSON, nothing that loading could execute
+    assert json.loads((tmp_path / 'agreement.json').read_text())['version'] == STATE_FORMAT_VERSION
+
+    state = store.load('agreement')
+    expected = sample_state()
+    assert state['rows'].keys() == expected['rows'].keys()
+    for row_key, (merged_item, deviation_item) in expected['rows'].items():
+        assert state['rows'][row_key][0] == merged_item
+        assert state['rows'][row_key][1] == deviation_item
+    assert state['rows'][('c', '')][0].bill is None
+    assert state['documents'] == expected['documents']
+    assert state['combined_pdf'] is None
+
+def test_unusable_state_is_ignored(tmp_path):
+    store = IncrementalStore(tmp_path)
+    (tmp_path / 'old.json').write_text(json.dumps({'version': '0'}))
+    (tmp_path / 'broken.json').write_text('{not json')
+    assert store.load('old') is None
+    assert store.load('broken') is None
+    assert store.load('missing') is None
+
+    store.clear()
+    assert not list(tmp_path.glob('*.json'))
+
+def test_failed_save_leaves_no_temp_file(tmp_path):
+    state = sample_state()
+    state['documents']['first_page_html']['html'] = object()
+
+    IncrementalStore(tmp_path).save('agreement', state)
+    assert list(tmp_path.iterdir()) == []
+
+def test_digest_depends_only_on_values():
+    item = WorkOrderItem('1', 'Earth work', 'cum', 10, 100.5, 1005.0)
+    copy = WorkOrderItem('1', 'Earth work', 'cum', 10, 100.5, 1005.0)
+
+    # Pickle bytes differ when one object appears twice rather than two equal ones
+    assert digest([item, item]) == digest([item, copy])
+    assert digest({'b': 1, 'a': [item]}) == digest({'a': [copy], 'b': 1})
+    assert digest({'total': np.int64(5)}) == digest({'total': 5})
+    assert digest(item) != digest(WorkOrderItem('1', 'Earth work', 'cum', 11, 100.5, 1105.5))
@@ -0,0 +1,32 @@
+from utils import instrumentation
+from utils.instrumentation import instrumented
+
+class Renderer:
+    @instrumented('render', detail=lambda result, self, name, *args, **kwargs: name,
+                  rows=lambda result, self, name, rows=0, *args, **kwargs: rows)
+    def render(self, name, rows=0):
+        return f"{name}:{rows}"
+
+    @instrumented('broken', detail=lambda result, self, name, *args, **kwargs: name.missing,
+                  rows=lambda result, *args, **kwargs: len(result))
+    def broken_hook(self, name):
+        return name
+
+def recorded(call):
+    with instrumentation.recording() as run:
+        result = call()
+    return result, run.to_dict()['records']
+
+def test_hooks_see_keyword_arguments():
+    result, records = recorded(lambda: Renderer().render(name='page', rows=3))
+    assert result == 'page:3'
+    assert [(record['stage'], record['detail'], record['rows']) for record in records] == [('render', 'page', 3)]
+
+def test_failing_hook_leaves_field_unset():
+    result, records = recorded(lambda: Renderer().broken_hook(name='page'))
+    assert result == 'page'
+    assert records[0]['detail'] is None
+    assert records[0]['rows'] == 4
+
+def test_nothing_recorded_outside_a_run():
+    assert Renderer().render('page') == 'page:0'
@@ -0,0 +1,92 @@
+from contextlib import closing
+from datetime import datetime, timedelta
+
+from utils.job_queue import DONE, FAILED, QUEUED, RUNNING, JobQueue, JobStore
+
+FILES = [('first.xlsx', b'first workbook'), ('dir/second.xlsx', b'second workbook')]
+
+def age_job(store, job_id, days):
+    with closing(store.connect()) as connection, connection:
+        connection.execute('UPDATE jobs SET updated_at = ? WHERE id = ?',
+                           ((datetime.now() - timedelta(days=days)).isoformat(timespec='seconds'), job_id))
+
+def test_create_job_stores_workbooks_and_queues_files(tmp_path):
+    store = JobStore(tmp_path)
+    job_id = store.create_job(FILES, {'use_cache': False})
+
+    job = store.get_job(job_id)
+    assert job['status'] == QUEUED
+    assert job['options'] == {'use_cache': False}
+    assert [(file['position'], file['filename'], file['status']) for file in job['files']] == [
+        (0, 'first.xlsx', QUEUED), (1, 'second.xlsx', QUEUED)
+    ]
+    assert store.get_input_path(job_id, 1, 'second.xlsx').read_bytes() == b'second workbook'
+    assert store.get_job('unknown') is None
+
+def test_update_file_records_progress(tmp_path):
+    store = JobStore(tmp_path)
+    job_id = store.create_job(FILES, {})
+
+    store.update_file(job_id, 1, status=RUNNING, current='first_page.pdf', documents_done=2, documents_total=6,
+                      not_a_field='ignored')
+    first, second = store.get_job(job_id)['files']
+    assert first['status'] == QUEUED
+    assert (second['status'], second['current'], second['documents_done'], second['documents_total']) == (
+        RUNNING, 'first_page.pdf', 2, 6
+    )
+
+    store.save_outputs(job_id, 1, {'b.pdf': b'2', 'a.pdf': b'1'})
+    assert list(store.load_outputs(job_id, 1).items()) == [('b.pdf', b'2'), ('a.pdf', b'1')]
+    assert store.load_outputs(job_id, 0) == {}
+
+class FakePipeline:
+    """Stands in for BillPipeline, recording the workbooks a job renders"""
+
+    def __init__(self, processed):
+        self.processed = processed
+
+    def load_ahead(self, uploads, use_cache=True):
+        return iter(uploads)
+
+    def finish_workbook(self, loaded, progress=None):
+        self.processed.append(loaded.name)
+        if progress:
+            progress('report.pdf', 1, 1)
+        return {'report.pdf': loaded.read()}
+
+def test_resume_runs_only_files_not_done(tmp_path):
+    store = JobStore(tmp_path)
+    job_id = store.create_job(FILES, {})
+    store.update_job(job_id, RUNNING)
+    store.update_file(job_id, 0, status=DONE)
+    assert store.get_unfinished_jobs() == [job_id]
+
+    processed = []
+    queue = JobQueue(lambda options: FakePipeline(processed), store=store, max_workers=1)
+    queue.resume_unfinished()
+    queue.executor.shutdown(wait=True)
+
+    assert processed == ['second.xlsx']
+    job = store.get_job(job_id)
+    assert job['status'] == DONE
+    assert [file['status'] for file in job['files']] == [DONE, DONE]
+    assert store.load_outputs(job_id, 1) == {'report.pdf': b'second workbook'}
+    assert store.get_unfinished_jobs() == []
+
+def test_purge_deletes_old_finished_jobs_only(tmp_path):
+    store = JobStore(tmp_path)
+    old_done, old_failed, old_running, recent_done = (store.create_job(FILES, {}) for _ in range(4))
+    store.update_job(old_done, DONE)
+    store.update_job(old_failed, FAILED, 'broken')
+    store.update_job(old_running, RUNNING)
+    store.update_job(recent_done, DONE)
+    for job_id in (old_done, old_failed, old_running):
+        age_job(store, job_id, 10)
+
+    store.purge(timedelta(days=7))
+
+    assert store.get_job(old_done) is None and not store.get_job_path(old_done).exists()
+    assert store.get_job(old_failed) is None and not store.get_job_path(old_failed).exists()
+    assert store.get_job(old_running)['status'] == RUNNING
+    assert store.get_job(recent_done)['status'] == DONE
+    assert store.get_job_path(recent_done).exists()
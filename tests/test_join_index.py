@@ -0,0 +1,69 @@
+import pytest
+
+from utils.items import BillQuantityItem, WorkOrderItem
+from utils.join_index import join_by_serial, normalize_serial, pair_with_previous, warning_lines
+
+@pytest.mark.parametrize('serial_no, expected', [
+    ('1', '1'),
+    ('1.0', '1'),
+    (1.0, '1'),
+    (1, '1'),
+    ('  1.00 ', '1'),
+    ('-0.0', '0'),
+    ('1.5', '1.5'),
+    ('10', '10'),
+    (' A  1 ', 'a 1'),
+    ('', ''),
+    ('   ', ''),
+    (None, ''),
+    ('nan', ''),
+    ('NaN', ''),
+    (float('nan'), ''),
+    ('None', ''),
+])
+def test_normalize_serial(serial_no, expected):
+    assert normalize_serial(serial_no) == expected
+
+def work_order(*serials):
+    return [WorkOrderItem(serial_no=serial_no, description=f'row {position}') for position, serial_no in enumerate(serials)]
+
+def bill_quantity(*serials):
+    return [BillQuantityItem(serial_no=serial_no, quantity_bill=position + 1) for position, serial_no in enumerate(serials)]
+
+def test_rows_match_across_serial_spellings():
+    bill_items = bill_quantity('1.0', ' 2 ', 'b')
+    matches, diagnostics = join_by_serial(work_order('1', '2.0', 'B', '4'), bill_items)
+    assert matches == [bill_items[0], bill_items[1], bill_items[2], None]
+    assert diagnostics.unmatched == [3]
+    assert not diagnostics.has_warnings
+
+def test_duplicate_serials_pair_up_in_order():
+    bill_items = bill_quantity('1', '2', '1.0')
+    matches, diagnostics = join_by_serial(work_order('1', '1', '2', '1'), bill_items)
+    assert matches == [bill_items[0], bill_items[2], bill_items[1], None]
+    assert diagnostics.unmatched == [3]
+    assert diagnostics.duplicates == [
+        {'sheet': 'Work Order', 'serial_no': '1', 'positions': [0, 1, 3]},
+        {'sheet': 'Bill Quantity', 'serial_no': '1', 'positions': [0, 2]},
+    ]
+
+def test_orphaned_bill_rows_carry_their_reason():
+    bill_items = bill_quantity('1', '', '9', '1', 'nan')
+    matches, diagnostics = join_by_serial(work_order('1', ''), bill_items)
+    assert matches == [bill_items[0], None]
+    assert diagnostics.unmatched == [1]
+    assert diagnostics.orphaned == [
+        {'position': 1, 'serial_no': '', 'reason': 'blank serial number'},
+        {'position': 2, 'serial_no': '9', 'reason': 'no Work Order row'},
+        {'position': 3, 'serial_no': '1', 'reason': 'more rows than the Work Order has'},
+        {'position': 4, 'serial_no': 'nan', 'reason': 'blank serial number'},
+    ]
+    assert diagnostics.has_warnings
+    assert warning_lines(diagnostics.to_dict())[1] == (
+        "Bill Quantity row 3 (9): no Work Order row, not included in the reports"
+    )
+
+def test_pair_with_previous_bill_rows():
+    first, second, other = {'quantity': 1}, {'quantity': 2}, {'quantity': 5}
+    previous = pair_with_previous(bill_quantity('1.0', '', '1', '1', '3'), {'1': [first, second], '3': [other]})
+    assert previous == [first, None, second, None, other]
@@ -0,0 +1,129 @@
+import sqlite3
+
+import pytest
+
+from utils.items import BillQuantityItem
+from utils.ledger import SCHEMA_VERSION, BillLedger
+
+AGREEMENT = '48/2024-25'
+
+@pytest.fixture
+def ledger(tmp_path):
+    return BillLedger(tmp_path / 'ledger.sqlite3')
+
+def bill(measurement_date, quantities, payable=1000.0):
+    """file_data and report_data of a bill whose rows carry the given (serial, quantity) pairs"""
+    file_data = {
+        'filename': f'{measurement_date}.xlsx',
+        'title_data': {'agreement_no': AGREEMENT, 'measurement_date': measurement_date}
+    }
+    report_data = {
+        'bill_items': [BillQuantityItem(serial_no=serial_no, quantity_bill=quantity, rate=10.0, amount_bill=quantity * 10)
+                       for serial_no, quantity in quantities],
+        'extra_items': [],
+        'bill_grand_total': payable,
+        'extra_items_sum': 0.0,
+        'totals': {'net_payable': payable}
+    }
+    return file_data, report_data
+
+def test_first_bill_has_no_previous_bill(ledger):
+    ledger.record_bill(*bill('01/01/2025', [('1', 1)]))
+    assert ledger.get_previous_bill(AGREEMENT, '01/01/2025') is None
+
+def test_previous_bill_follows_measurement_dates_not_processing_order(ledger):
+    # The third bill is processed before the second
+    ledger.record_bill(*bill('01/01/2025', [('1', 1)], payable=100.0))
+    ledger.record_bill(*bill('01/03/2025', [('1', 3)], payable=300.0))
+    ledger.record_bill(*bill('01/02/2025', [('1', 2)], payable=200.0))
+
+    second = ledger.get_previous_bill(AGREEMENT, '01/02/2025')
+    assert (second['bill_key'], second['bill_number'], second['payable_amount']) == ('01/01/2025', 1, 100.0)
+    third = ledger.get_previous_bill(AGREEMENT, '01/03/2025')
+    assert (third['bill_key'], third['bill_date'], third['bill_number']) == ('01/02/2025', '2025-02-01', 2)
+
+    # A bill not recorded yet follows the latest one before its date
+    fourth = ledger.get_previous_bill(AGREEMENT, '2025-04-01 00:00:00')
+    assert (fourth['bill_key'], fourth['bill_number']) == ('01/03/2025', 3)
+
+    history = ledger.get_item_history(AGREEMENT, '1')
+    assert [entry['quantity'] for entry in history] == [1, 2, 3]
+
+def test_regenerating_a_bill_replaces_its_entry(ledger):
+    ledger.record_bill(*bill('01/01/2025', [('1', 1)]))
+    ledger.record_bill(*bill('01/02/2025', [('1', 2)]))
+    ledger.record_bill(*bill('01/01/2025', [('1', 5)]))
+
+    previous = ledger.get_previous_bill(AGREEMENT, '01/02/2025')
+    assert previous['items']['1'] == [{'quantity': 5, 'amount': 50.0}]
+    assert ledger.get_previous_bill(AGREEMENT, '01/01/2025') is None
+
+def test_rows_sharing_a_serial_number_are_all_kept(ledger):
+    ledger.record_bill(*bill('01/01/2025', [('1', 1), ('2', 4), ('1', 2)]))
+    with sqlite3.connect(ledger.path) as connection:
+        rows = connection.execute('SELECT position, serial_no, quantity FROM bill_items ORDER BY position').fetchall()
+    assert rows == [(0, '1', 1.0), (1, '2', 4.0), (2, '1', 2.0)]
+
+def test_items_are_looked_up_by_normalized_serial(ledger):
+    ledger.record_bill(*bill('01/01/2025', [('1.0', 1), (' A-1 ', 2), ('1', 3), ('', 9)]))
+    previous = ledger.get_previous_bill(AGREEMENT, '01/02/2025')
+    # Blank serials never match, so they are left out
+    assert previous['items'] == {
+        '1': [{'quantity': 1.0, 'amount': 10.0}, {'quantity': 3.0, 'amount': 30.0}],
+        'a-1': [{'quantity': 2.0, 'amount': 20.0}]
+    }
+    assert [entry['quantity'] for entry in ledger.get_item_history(AGREEMENT, '1')] == [1.0, 3.0]
+
+def test_version_2_ledger_gets_serial_keys(tmp_path):
+    path = tmp_path / 'ledger.sqlite3'
+    with sqlite3.connect(path) as connection:
+        connection.executescript("""
+            CREATE TABLE bills (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, agreement_no TEXT NOT NULL, bill_key TEXT NOT NULL,
+                bill_date TEXT, recorded_at TEXT NOT NULL, payable_paise INTEGER NOT NULL,
+                net_payable_paise INTEGER NOT NULL, UNIQUE (agreement_no, bill_key)
+            );
+            CREATE TABLE bill_items (
+                bill_id INTEGER NOT NULL REFERENCES bills (id) ON DELETE CASCADE, agreement_no TEXT NOT NULL,
+                kind TEXT NOT NULL, position INTEGER NOT NULL, serial_no TEXT NOT NULL, quantity REAL NOT NULL,
+                amount_paise INTEGER NOT NULL, PRIMARY KEY (bill_id, kind, position)
+            ) WITHOUT ROWID;
+            CREATE INDEX idx_bill_items_agreement_serial ON bill_items (agreement_no, serial_no, bill_id);
+            INSERT INTO bills VALUES (1, '48/2024-25', '01/01/2025', '2025-01-01', '2025-01-01T10:00:00', 100, 90);
+            INSERT INTO bill_items VALUES (1, '48/2024-25', 'bill', 0, '2.0', 3, 3000);
+            PRAGMA user_version = 2;
+        """)
+
+    previous = BillLedger(path).get_previous_bill(AGREEMENT, '01/02/2025')
+    assert previous['items'] == {'2': [{'quantity': 3.0, 'amount': 30.0}]}
+
+def test_version_1_ledger_is_migrated(tmp_path):
+    path = tmp_path / 'ledger.sqlite3'
+    with sqlite3.connect(path) as connection:
+        connection.executescript("""
+            CREATE TABLE bills (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, agreement_no TEXT NOT NULL, bill_key TEXT NOT NULL,
+                recorded_at TEXT NOT NULL, payable_paise INTEGER NOT NULL, net_payable_paise INTEGER NOT NULL,
+                UNIQUE (agreement_no, bill_key)
+            );
+            CREATE TABLE bill_items (
+                bill_id INTEGER NOT NULL REFERENCES bills (id) ON DELETE CASCADE, agreement_no TEXT NOT NULL,
+                kind TEXT NOT NULL, serial_no TEXT NOT NULL, quantity REAL NOT NULL, amount_paise INTEGER NOT NULL,
+                PRIMARY KEY (bill_id, kind, serial_no)
+            ) WITHOUT ROWID;
+            CREATE INDEX idx_bill_items_agreement_serial ON bill_items (agreement_no, serial_no, bill_id);
+            INSERT INTO bills VALUES (1, '48/2024-25', '01/03/2025', '2025-03-01T10:00:00', 30000, 27000);
+            INSERT INTO bills VALUES (2, '48/2024-25', '01/02/2025', '2025-03-01T11:00:00', 20000, 18000);
+            INSERT INTO bill_items VALUES (1, '48/2024-25', 'bill', '1', 3, 3000);
+            INSERT INTO bill_items VALUES (1, '48/2024-25', 'bill', '2', 1, 1000);
+        """)
+
+    ledger = BillLedger(path)
+    previous = ledger.get_previous_bill(AGREEMENT, '01/03/2025')
+    assert (previous['bill_key'], previous['bill_number']) == ('01/02/2025', 1)
+    assert ledger.get_previous_bill(AGREEMENT, '2025-04-01')['items'] == {
+        '1': [{'quantity': 3.0, 'amount': 30.0}],
+        '2': [{'quantity': 1.0, 'amount': 10.0}]
+    }
+    with sqlite3.connect(path) as connection:
+        assert connection.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
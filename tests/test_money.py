@@ -0,0 +1,86 @@
+from decimal import Decimal
+
+import pytest
+
+from conftest import ROOT
+from test_excel_processor import MemoryUpload
+from utils.excel_processor import ExcelProcessor
+from utils.report_generator import ReportGenerator
+from utils.sheet_cache import SheetCache
+from utils.money import (
+    SECURITY_DEPOSIT_RATE, apply_rate, calculate_totals, round_up_to_even_rupees, to_paise
+)
+
+@pytest.mark.parametrize('paise, rate, expected', [
+    (15, '0.1', 2),               # 1.5 paise rounds half up
+    (14, '0.1', 1),
+    (-15, '0.1', -2),             # and half away from zero below it
+    (1018150, SECURITY_DEPOSIT_RATE, 101815),
+    (25, Decimal('0.02'), 1),     # 0.5 paise
+    (24, Decimal('0.02'), 0),
+    (12345, 5, 61725),
+    (100, 2.5, 250),              # float rates are read as written
+])
+def test_apply_rate_rounds_half_up_to_the_paisa(paise, rate, expected):
+    assert apply_rate(paise, rate) == expected
+
+@pytest.mark.parametrize('paise, expected', [
+    (0, 0),
+    (1, 200),                     # any paisa starts a rupee
+    (100, 200),                   # odd rupees go up to the next even one
+    (199, 200),
+    (200, 200),                   # even rupees stay
+    (201, 400),
+    (300, 400),
+    (400, 400),
+    (-150, 0),
+])
+def test_round_up_to_even_rupees_boundaries(paise, expected):
+    assert round_up_to_even_rupees(paise) == expected
+
+def test_to_paise_reads_amounts_as_written():
+    assert to_paise([2.675, -2.675, 0.005, float('nan'), 1e-3]).tolist() == [268, -268, 1, 0, 0]
+
+def deviation_items(amounts):
+    return [{'amt_wo': 0, 'amt_bill': amount, 'excess_amt': 0, 'saving_amt': 0} for amount in amounts]
+
+def test_security_deposit_on_a_half_rupee_boundary():
+    # These amounts add up to 101815.00, which float sums as 101814.99999999997,
+    # putting an SD of 10181.4999... one rupee short once rounded
+    amounts = [36718.56, 45020.02, 6646.18, 3497.51, 9932.73]
+    assert round(sum(amounts) * 0.1) == 10181
+
+    totals = calculate_totals(deviation_items(amounts), [], 0)['totals']
+    assert totals['grand_total'] == 101815.0
+    assert totals['sd_amount'] == 10181.5
+    assert round(totals['sd_amount']) == 10182
+
+def test_deductions_and_net_payable():
+    result = calculate_totals(deviation_items([1000.0, 234.56]), [{'amount': 100.0}], 0.05)
+    totals = result['totals']
+    # 1234.56 + 5% (61.728 -> 61.73) and 100 + 5%
+    assert result['bill_grand_total'] == 1296.29
+    assert result['extra_items_sum'] == 105.0
+    assert totals['grand_total'] == 1401.29
+    # Deductions stay exact; the templates round them to the rupee once
+    assert totals['sd_amount'] == 140.129
+    assert totals['it_amount'] == 28.0258
+    # 2% is 28.0258, rounded up to an even 30 rupees
+    assert totals['gst_amount'] == 30.0
+    assert totals['lc_amount'] == 14.0129
+    assert totals['total_deductions'] == pytest.approx(212.1677)
+    assert totals['net_payable'] == pytest.approx(1189.1223)
+
+def test_deductions_are_rounded_to_the_rupee_once():
+    # The grand total 101814.96 puts the exact SD at 10181.496; rounding it
+    # to the paisa first (10181.50) would print 10182
+    path = ROOT / 'attached_assets' / '3rdRunningNoExtra_1752800156600.xlsx'
+    processor = ExcelProcessor(sheet_cache=SheetCache(max_entries=0))
+    file_data = processor.read_workbook(MemoryUpload(path.name, path.read_bytes()))
+    reports = ReportGenerator().generate_all_reports(file_data)
+
+    totals = reports.context['totals']
+    assert totals['grand_total'] == 101814.96
+    assert totals['sd_amount'] == pytest.approx(10181.496)
+    assert '<td>S.D.II</td><td>10181</td>' in reports['note_sheet_html']
+    assert '<td>Cheque</td><td>86541</td>' in reports['note_sheet_html']
@@ -0,0 +1,20 @@
+from utils.output_cache import OutputCache
+
+def test_put_and_get_round_trip(tmp_path):
+    cache = OutputCache(tmp_path)
+    key = cache.make_key(b'workbook', 'v1')
+    outputs = {'first_page.pdf': b'%PDF first', 'summary.txt': b'summary'}
+
+    cache.put(key, outputs)
+    assert cache.get(key) == outputs
+    assert cache.get(cache.make_key(b'workbook', 'v2')) is None
+
+def test_failed_write_leaves_no_temp_file(tmp_path):
+    cache = OutputCache(tmp_path)
+    key = cache.make_key(b'workbook')
+
+    # writestr rejects a value that is neither bytes nor str
+    cache.put(key, {'first_page.pdf': b'%PDF first', 'broken.pdf': object()})
+
+    assert cache.get(key) is None
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,43 @@
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.pdf_generator import PDFGenerator
+
+class BreakingPool:
+    """Stands in for the rendering pool: renders the first jobs, then dies"""
+
+    def __init__(self, finished):
+        self.finished = finished
+        self.shut_down = False
+
+    def map(self, func, jobs):
+        for content, document_type, record in jobs[:self.finished]:
+            yield f"pool:{content}".encode(), []
+        raise BrokenProcessPool('worker died')
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+def test_broken_pool_renders_only_the_unfinished_jobs_serially(monkeypatch):
+    generator = PDFGenerator(max_workers=2)
+    pool = BreakingPool(finished=2)
+    monkeypatch.setattr(generator, 'get_executor', lambda workers: pool)
+    serial = []
+    monkeypatch.setattr(generator, 'render_job', lambda job, layouts=None: serial.append(job[0]) or f"serial:{job[0]}".encode())
+
+    reported = []
+    jobs = [(name, 'note_sheet') for name in ('a', 'b', 'c', 'd')]
+    results = generator.generate_pdfs(jobs, on_rendered=reported.append)
+
+    assert results == [b'pool:a', b'pool:b', b'serial:c', b'serial:d']
+    assert serial == ['c', 'd']
+    assert reported == [0, 1, 2, 3]
+    assert pool.shut_down
+
+def test_rendering_pool_is_reused_across_batches():
+    generator = PDFGenerator(max_workers=2)
+    try:
+        executor = generator.get_executor(2)
+        assert generator.get_executor(2) is executor
+        assert generator.get_executor(3) is not executor
+    finally:
+        generator.shutdown()
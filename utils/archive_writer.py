@@ -0,0 +1,94 @@
+import io
+import os
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict
+
+# Formats that are already compressed and gain nothing from deflate
+STORED_EXTENSIONS = ('.pdf', '.zip', '.png', '.jpg', '.jpeg')
+
+# Archives up to this size stay in memory, larger ones spill to a temporary file
+DEFAULT_SPOOL_SIZE = 16 * 1024 * 1024
+
+class ReportArchive:
+    """ZIP archive of report outputs, written entry by entry into a spooled temporary file
+
+    The 'nested' layout keeps one <workbook>_reports.zip per workbook, streamed
+    straight into the outer archive; the 'flat' layout uses one folder per
+    workbook instead.
+    """
+
+    def __init__(self, layout: str = 'nested', spool_size: int = DEFAULT_SPOOL_SIZE):
+        if layout not in ('nested', 'flat'):
+            raise ValueError(f"Unknown archive layout: {layout}")
+        self.layout = layout
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        self.zip = zipfile.ZipFile(self.file, 'w', zipfile.ZIP_DEFLATED)
+        # Size of the finished archive in bytes, set by close
+        self.size = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        """Finish the archive; on an error, discard it"""
+        self.close()
+        if exc_type is not None:
+            self.file.close()
+
+    def get_compression(self, name: str) -> int:
+        """Store already-compressed formats, deflate the rest"""
+        return zipfile.ZIP_STORED if name.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+
+    def get_workbook_folder(self, filename: str) -> str:
+        """Folder (or inner archive) name for a workbook's reports"""
+        return Path(filename).stem
+
+    def add(self, arcname: str, data: bytes):
+        """Add a single entry"""
+        self.zip.writestr(arcname, data, compress_type=self.get_compression(arcname))
+
+    def add_workbook(self, filename: str, outputs: Dict[str, bytes]):
+        """Add every output of one workbook"""
+        folder = self.get_workbook_folder(filename)
+
+        if self.layout == 'flat':
+            for output_name, output_data in outputs.items():
+                self.add(f"{folder}/{output_name}", output_data)
+            return
+
+        # Write the inner archive directly into its entry stream, without an intermediate copy
+        entry_info = zipfile.ZipInfo(f"{folder}_reports.zip", date_time=time.localtime()[:6])
+        entry_info.compress_type = zipfile.ZIP_STORED
+        with self.zip.open(entry_info, 'w', force_zip64=True) as entry:
+            with zipfile.ZipFile(entry, 'w', zipfile.ZIP_DEFLATED) as inner_zip:
+                for output_name, output_data in outputs.items():
+                    inner_zip.writestr(output_name, output_data, compress_type=self.get_compression(output_name))
+
+    def close(self):
+        """Finish the archive and return the underlying file, rewound for reading"""
+        if self.size is None:
+            self.zip.close()
+            self.size = self.file.tell()
+        self.file.seek(0)
+        return self.file
+
+    def reader(self) -> io.RawIOBase:
+        """Finish the archive and open an unbuffered reader on it, for consumers that take a file
+
+        The archive is moved to disk if it is still in memory. The reader has
+        its own descriptor, so it keeps the data readable after the archive
+        itself is closed or collected.
+        """
+        archive_file = self.close()
+        return io.FileIO(os.dup(archive_file.fileno()), 'rb')
+
+    def getvalue(self) -> bytes:
+        """Finish the archive and return its bytes"""
+        archive_file = self.close()
+        try:
+            return archive_file.read()
+        finally:
+            archive_file.close()
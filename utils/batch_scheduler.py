@@ -0,0 +1,253 @@
+import functools
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait as wait_for_futures
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from .bill_pipeline import BillPipeline, WorkbookFile
+from .excel_processor import ExcelProcessor
+from .report_generator import ReportGenerator
+from .pdf_generator import PDFGenerator
+from .template_renderer import get_shared_renderer
+from .output_cache import OutputCache
+from .incremental import IncrementalReportBuilder
+from .ledger import BillLedger
+from . import instrumentation
+
+# Workbooks processed at once (BILL_BATCH_WORKERS overrides the CPU count)
+DEFAULT_BATCH_WORKERS = int(os.environ.get('BILL_BATCH_WORKERS', os.cpu_count() or 1))
+
+# How often run forwards the document progress of its workers, in seconds
+PROGRESS_INTERVAL = 0.25
+
+# Times a workbook interrupted by a dead worker is submitted again to a fresh pool
+POOL_RETRIES = 1
+
+# Processing objects of a batch worker process, built (and warmed) by init_worker
+_worker_components = None
+
+# Pipelines of this process keyed by their options; workers reuse them across workbooks
+_worker_pipelines = {}
+
+def init_worker():
+    """Pool initializer: build the processing objects and pay the start-up costs once per worker
+
+    Importing the PDF generator has already imported WeasyPrint; the
+    templates are compiled and the page stylesheets and font configuration
+    built here, so the first workbook of each worker runs as fast as the rest.
+    """
+    global _worker_components
+    if _worker_components is not None:
+        return
+    renderer = get_shared_renderer()
+    renderer.warm()
+    pdf_generator = PDFGenerator(max_workers=1)
+    pdf_generator.warm()
+    _worker_components = {
+        'excel_processor': ExcelProcessor(),
+        'report_generator': ReportGenerator(),
+        'pdf_generators': {pdf_generator.engine: pdf_generator}
+    }
+
+def get_options_key(options: Dict[str, Any]) -> Tuple:
+    return (bool(options.get('use_cache', True)), bool(options.get('incremental')),
+            options.get('pdf_engine'), options.get('ledger'))
+
+def get_worker_pipeline(options: Dict[str, Any]) -> BillPipeline:
+    """This process's pipeline for a set of batch options, rendering PDFs serially inside the worker
+
+    Options are use_cache, incremental, pdf_engine and ledger (a ledger path).
+    """
+    init_worker()
+    key = get_options_key(options)
+    if key not in _worker_pipelines:
+        use_cache, incremental, pdf_engine, ledger = key
+        pdf_generators = _worker_components['pdf_generators']
+        pdf_generator = pdf_generators.get(pdf_engine) if pdf_engine else next(iter(pdf_generators.values()))
+        if pdf_generator is None:
+            pdf_generator = pdf_generators[pdf_engine] = PDFGenerator(max_workers=1, engine=pdf_engine)
+
+        pipeline = BillPipeline(
+            _worker_components['excel_processor'],
+            _worker_components['report_generator'],
+            pdf_generator,
+            OutputCache() if use_cache else None
+        )
+        pipeline.pdf_engine = pdf_engine
+        if incremental:
+            pipeline.incremental = IncrementalReportBuilder(pipeline.report_generator)
+        if ledger:
+            pipeline.ledger = BillLedger(ledger)
+        _worker_pipelines[key] = pipeline
+    return _worker_pipelines[key]
+
+def put_progress(progress_queue, workbook: str, output_name: str, rendered: int, total: int):
+    progress_queue.put((workbook, output_name, rendered, total))
+
+def process_workbook(workbook_path, options: Dict[str, Any], target_dir=None,
+                     progress_queue=None) -> Dict[str, Any]:
+    """Run one workbook from parsing to outputs, returning its result entry
+
+    With a target_dir the outputs are written there; otherwise they are
+    returned under 'output_data'. The entry also carries the status, output
+    names, any error and the workbook's performance records. With a
+    progress_queue, each rendered document is put on it as
+    (workbook, output name, rendered, total).
+    """
+    progress = functools.partial(put_progress, progress_queue, str(workbook_path)) if progress_queue is not None else None
+
+    started = time.perf_counter()
+    entry = {'file': str(workbook_path)}
+    if target_dir is not None:
+        entry['output_dir'] = str(target_dir)
+
+    with instrumentation.recording() as run:
+        try:
+            pipeline = get_worker_pipeline(options)
+            outputs = pipeline.process_file(WorkbookFile(workbook_path), options.get('use_cache', True), progress)
+
+            if target_dir is not None:
+                target_dir = Path(target_dir)
+                target_dir.mkdir(parents=True, exist_ok=True)
+                for output_name, output_data in outputs.items():
+                    (target_dir / output_name).write_bytes(output_data)
+            else:
+                entry['output_data'] = outputs
+
+            entry.update({'status': 'ok', 'outputs': list(outputs)})
+        except Exception as e:
+            entry.update({'status': 'failed', 'error': str(e), 'traceback': traceback.format_exc()})
+
+    entry['seconds'] = round(time.perf_counter() - started, 3)
+    entry['performance'] = run.to_dict()
+    return entry
+
+class BatchScheduler:
+    """Runs whole workbooks, parse to outputs, on a pool of warmed worker processes
+
+    Each worker renders its workbook's PDFs serially, so a batch scales with
+    the number of workers rather than the documents of one bill. The pool is
+    started on first use and kept, so later batches skip the worker start-up.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max(1, max_workers or DEFAULT_BATCH_WORKERS)
+        self._executor = None
+        self._manager = None
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_worker)
+        return self._executor
+
+    def discard_executor(self, executor: ProcessPoolExecutor):
+        """Shut down a pool whose worker died; the next batch starts a fresh one"""
+        executor.shutdown(wait=False, cancel_futures=True)
+        if self._executor is executor:
+            self._executor = None
+
+    def get_progress_queue(self):
+        """Queue the workers put their document progress on, served by a manager process started on first use"""
+        if self._manager is None:
+            self._manager = multiprocessing.Manager()
+        return self._manager.Queue()
+
+    def run(self, workbooks: Iterable, options: Optional[Dict[str, Any]] = None,
+            targets: Optional[Dict[Any, Any]] = None, max_in_flight: Optional[int] = None,
+            progress: Optional[Callable[[Any, str, int, int], None]] = None) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+        """Process workbook paths, yielding (workbook, entry) pairs as each one finishes
+
+        targets optionally maps a workbook to the directory its outputs are
+        written to. max_in_flight caps the workbooks processed at once below
+        the pool size. progress, if given, is called on the caller's thread
+        as progress(workbook, output_name, rendered, total) for each document
+        the workers render. Workbooks interrupted by a worker dying run
+        again, one at a time, on a fresh pool. Bills are independent here; a
+        ledger needs them in order, so ledger batches should run through
+        process_workbook one at a time.
+        """
+        options = dict(options or {})
+        targets = targets or {}
+        queued = deque(workbooks)
+        limit = max(1, max_in_flight or len(queued))
+        names = {str(workbook): workbook for workbook in queued}
+        progress_queue = self.get_progress_queue() if progress else None
+        retries = {}
+        futures = {}
+        try:
+            while queued or futures:
+                while queued and len(futures) < limit:
+                    # Retried workbooks run alone, so one that kills its worker again takes no other with it
+                    if futures and (queued[0] in retries or any(running in retries for running, _ in futures.values())):
+                        break
+                    workbook = queued.popleft()
+                    executor = self.get_executor()
+                    try:
+                        future = executor.submit(process_workbook, workbook, options, targets.get(workbook), progress_queue)
+                        futures[future] = (workbook, executor)
+                    except (BrokenProcessPool, RuntimeError) as e:
+                        # The pool broke since the last submit; the workbook goes to a fresh one
+                        self.discard_executor(executor)
+                        if not self.retry(workbook, retries, queued):
+                            yield workbook, {'file': str(workbook), 'status': 'failed', 'error': str(e)}
+                if not futures:
+                    continue
+
+                done, _ = wait_for_futures(futures, timeout=PROGRESS_INTERVAL if progress else None, return_when=FIRST_COMPLETED)
+                if progress:
+                    self.forward_progress(progress_queue, names, progress)
+                for future in done:
+                    workbook, executor = futures.pop(future)
+                    try:
+                        yield workbook, future.result()
+                    except BrokenProcessPool as e:
+                        # A worker died, taking every workbook in flight on its pool with it
+                        self.discard_executor(executor)
+                        if not self.retry(workbook, retries, queued):
+                            yield workbook, {'file': str(workbook), 'status': 'failed', 'error': str(e)}
+                    except Exception as e:
+                        yield workbook, {'file': str(workbook), 'status': 'failed', 'error': str(e)}
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def retry(self, workbook, retries: Dict[Any, int], queued: deque) -> bool:
+        """Queue a workbook interrupted by a broken pool again, up to POOL_RETRIES times
+
+        A workbook that keeps killing its worker then fails on its own.
+        """
+        attempts = retries.get(workbook, 0)
+        if attempts >= POOL_RETRIES:
+            return False
+        retries[workbook] = attempts + 1
+        queued.appendleft(workbook)
+        return True
+
+    def forward_progress(self, progress_queue, names: Dict[str, Any], progress: Callable[[Any, str, int, int], None]):
+        """Hand the document progress the workers have reported so far to the progress callback"""
+        while True:
+            try:
+                name, output_name, rendered, total = progress_queue.get_nowait()
+            except queue.Empty:
+                return
+            progress(names.get(name, name), output_name, rendered, total)
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
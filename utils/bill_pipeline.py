@@ -0,0 +1,423 @@
+import contextvars
+import json
+import os
+import queue
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from .excel_processor import ExcelProcessor
+from .join_index import warning_lines
+from .report_generator import ReportGenerator
+from .pdf_generator import PDFGenerator, COMBINED_DOCUMENT
+from .output_cache import OutputCache
+from .incremental import IncrementalReportBuilder
+from .ledger import BillLedger
+from . import instrumentation
+
+class WorkbookFile:
+    """File-like wrapper giving a workbook on disk the interface of a Streamlit upload"""
+    
+    def __init__(self, path):
+        self.path = Path(path)
+        self.name = self.path.name
+        self._content = self.path.read_bytes()
+        self.size = len(self._content)
+        self._position = 0
+    
+    def read(self, size: int = -1) -> bytes:
+        """Read bytes from the current position"""
+        end = self.size if size is None or size < 0 else min(self.size, self._position + size)
+        data = self._content[self._position:end]
+        self._position = end
+        return data
+    
+    def seek(self, position: int, whence: int = 0) -> int:
+        """Move the read position"""
+        base = {0: 0, 1: self._position, 2: self.size}[whence]
+        self._position = max(0, base + position)
+        return self._position
+    
+    def getvalue(self) -> bytes:
+        """Get the whole file content"""
+        return self._content
+
+# Parsed workbooks load_ahead keeps waiting for the render stage
+DEFAULT_MAX_PENDING = int(os.environ.get('BILL_PARSE_AHEAD', 2))
+
+# Marks the end of the workbooks load_ahead's parse thread produces
+_END_OF_WORKBOOKS = object()
+
+# Output cache entry holding what summary.txt is rebuilt from on a cache hit
+SUMMARY_DETAILS = 'summary_details.json'
+
+class LoadedWorkbook:
+    """A workbook after the parse stage: its cached outputs, or its parsed data, or the error it failed with"""
+    
+    def __init__(self, uploaded_file, cache_key: Optional[str] = None, outputs: Optional[Dict[str, bytes]] = None,
+                 file_data: Optional[Dict[str, Any]] = None, error: Optional[Exception] = None):
+        self.uploaded_file = uploaded_file
+        self.cache_key = cache_key
+        self.outputs = outputs
+        self.file_data = file_data
+        self.error = error
+
+class BillPipeline:
+    """Turns processed workbooks into downloadable report outputs, independent of the UI"""
+    
+    def __init__(self, excel_processor: Optional[ExcelProcessor] = None,
+                 report_generator: Optional[ReportGenerator] = None,
+                 pdf_generator: Optional[PDFGenerator] = None,
+                 output_cache: Optional[OutputCache] = None,
+                 incremental: Optional[IncrementalReportBuilder] = None,
+                 ledger: Optional[BillLedger] = None):
+        self.excel_processor = excel_processor or ExcelProcessor()
+        self.report_generator = report_generator or ReportGenerator()
+        self.pdf_generator = pdf_generator or PDFGenerator()
+        self.output_cache = output_cache
+        # When set, reports are regenerated from the previous run of the same agreement
+        self.incremental = incremental
+        # When set, each bill is recorded and shown against the agreement's previous bill
+        self.ledger = ledger
+        # Rendering pool size for this pipeline; None uses the PDF generator's default
+        self.max_workers = None
+        # Parsed workbooks load_ahead holds while earlier ones render; 0 parses in turn
+        self.max_pending = DEFAULT_MAX_PENDING
+        # PDF engine for this pipeline; None uses the PDF generator's
+        self.pdf_engine = None
+    
+    def process_file(self, uploaded_file, use_cache: bool = True,
+                     progress: Optional[Callable[[str, int, int], None]] = None) -> Dict[str, bytes]:
+        """Run a single workbook through parsing, report generation and PDF rendering
+        
+        progress, if given, is called as progress(output_name, rendered, total)
+        as each PDF of the workbook becomes available.
+        """
+        return self.finish_workbook(self.load_workbook(uploaded_file, use_cache), progress)
+    
+    def load_workbook(self, uploaded_file, use_cache: bool = True) -> LoadedWorkbook:
+        """Parse stage: look the workbook up in the output cache, or parse it
+        
+        Never raises; a failure is returned as the LoadedWorkbook's error.
+        """
+        with instrumentation.workbook(uploaded_file.name):
+            try:
+                cache_key = None
+                if use_cache and self.can_use_output_cache():
+                    cache_key = self.get_cache_key(uploaded_file.getvalue())
+                    with instrumentation.stage('output_cache_get') as record:
+                        outputs = self.load_cached_outputs(cache_key)
+                        record.bytes_out = sum(len(data) for data in outputs.values()) if outputs else 0
+                    if outputs:
+                        return LoadedWorkbook(uploaded_file, cache_key, outputs=outputs)
+                
+                try:
+                    file_data = self.excel_processor.read_workbook(uploaded_file)
+                except Exception as e:
+                    raise ValueError(f"Failed to process {uploaded_file.name}: {str(e)}") from e
+                
+                return LoadedWorkbook(uploaded_file, cache_key, file_data=file_data)
+            except Exception as e:
+                return LoadedWorkbook(uploaded_file, error=e)
+    
+    def finish_workbook(self, loaded: LoadedWorkbook,
+                        progress: Optional[Callable[[str, int, int], None]] = None) -> Dict[str, bytes]:
+        """Render stage: generate the reports and PDFs of a loaded workbook, raising its parse error if it failed"""
+        if loaded.error is not None:
+            raise loaded.error
+        if loaded.outputs:
+            return loaded.outputs
+        
+        with instrumentation.workbook(loaded.uploaded_file.name):
+            reports, incremental_result = self.generate_reports(loaded.file_data)
+            outputs = self.create_file_outputs(
+                reports,
+                loaded.uploaded_file.name,
+                incremental_result.reused_pdfs if incremental_result else None,
+                progress
+            )
+            
+            if incremental_result:
+                self.incremental.save(incremental_result, outputs)
+            
+            self.record_bill(loaded.file_data, reports)
+            
+            if loaded.cache_key:
+                self.store_cached_outputs(loaded.cache_key, outputs, reports)
+            
+            return outputs
+    
+    def load_ahead(self, uploaded_files: Iterable, use_cache: bool = True,
+                   max_pending: Optional[int] = None) -> Iterator[LoadedWorkbook]:
+        """Run the parse stage on a background thread, yielding loaded workbooks in order
+        
+        The caller renders each workbook while the following ones are
+        parsed. A workbook is only parsed once fewer than max_pending parsed
+        workbooks are waiting for the caller, so memory stays capped however
+        many workbooks there are. Stage records of the parse thread go to the
+        caller's performance run.
+        """
+        max_pending = self.max_pending if max_pending is None else max_pending
+        if max_pending < 1:
+            for uploaded_file in uploaded_files:
+                yield self.load_workbook(uploaded_file, use_cache)
+            return
+        
+        loaded = queue.Queue()
+        free_slots = threading.Semaphore(max_pending)
+        stop = threading.Event()
+        
+        def parse_all():
+            try:
+                for uploaded_file in uploaded_files:
+                    # Wait for room, giving up once the caller has stopped reading
+                    while not free_slots.acquire(timeout=0.1):
+                        if stop.is_set():
+                            return
+                    if stop.is_set():
+                        return
+                    loaded.put(self.load_workbook(uploaded_file, use_cache))
+            except Exception as e:
+                loaded.put(e)
+            loaded.put(_END_OF_WORKBOOKS)
+        
+        parser = threading.Thread(target=contextvars.copy_context().run, args=(parse_all,),
+                                  name='bill-parse', daemon=True)
+        parser.start()
+        try:
+            while True:
+                item = loaded.get()
+                if item is _END_OF_WORKBOOKS:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                free_slots.release()
+                yield item
+        finally:
+            stop.set()
+            parser.join()
+    
+    def generate_reports(self, file_data):
+        """Generate a workbook's reports, incrementally when enabled
+        
+        Returns the reports and, in incremental mode, the IncrementalResult
+        carrying the PDFs reused from the previous run. With a ledger, the
+        agreement's previous bill is looked up first; record_bill records
+        this one once its outputs exist.
+        """
+        if self.ledger is None:
+            if self.incremental is None:
+                return self.report_generator.generate_all_reports(file_data), None
+            
+            result = self.incremental.generate(file_data, self.pdf_generator.config_version(self.get_pdf_engine()))
+            return result.reports, result
+        
+        file_data = self.ledger.with_previous_bill(file_data)
+        if self.incremental is None:
+            return self.report_generator.render_reports(self.report_generator.prepare_report_data(file_data)), None
+        
+        result = self.incremental.generate(file_data, self.pdf_generator.config_version(self.get_pdf_engine()))
+        return result.reports, result
+    
+    def record_bill(self, file_data, reports):
+        """Record a bill in the ledger, if there is one, after its outputs have been produced"""
+        if self.ledger is not None:
+            self.ledger.record_bill(file_data, reports.context)
+    
+    def can_use_output_cache(self):
+        """Outputs can be cached by workbook content only when they do not depend on the ledger's history"""
+        return self.output_cache is not None and self.ledger is None
+    
+    def get_cache_key(self, file_bytes):
+        """Build the output cache key for an uploaded workbook"""
+        return self.output_cache.make_key(
+            file_bytes,
+            self.report_generator.template_renderer.template_version(),
+            self.report_generator.config_version(),
+            self.pdf_generator.config_version(self.get_pdf_engine())
+        )
+    
+    def load_cached_outputs(self, cache_key):
+        """Load a workbook's outputs from the output cache, with a freshly generated summary.txt"""
+        outputs = self.output_cache.get(cache_key)
+        if not outputs or SUMMARY_DETAILS not in outputs:
+            return None
+        details = json.loads(outputs.pop(SUMMARY_DETAILS))
+        outputs['summary.txt'] = self.format_summary_text(**details).encode()
+        return outputs
+    
+    def store_cached_outputs(self, cache_key, outputs, reports):
+        """Save a workbook's outputs to the output cache
+        
+        summary.txt carries the time it was generated, so only the details it
+        is built from are stored and load_cached_outputs writes it anew.
+        """
+        cached = {name: data for name, data in outputs.items() if name != 'summary.txt'}
+        cached[SUMMARY_DETAILS] = json.dumps(self.get_summary_details(reports)).encode()
+        self.output_cache.put(cache_key, cached)
+    
+    def get_pdf_engine(self):
+        """PDF engine the pipeline renders with"""
+        return self.pdf_engine or self.pdf_generator.engine
+    
+    def get_pdf_jobs(self, reports):
+        """List the (output name, content, document type) PDF jobs for a single file
+        
+        The content is the report's HTML, or what get_job_content puts in
+        its place: the report context for the tabular documents on the
+        ReportLab engine, the blocks of a long deviation statement otherwise.
+        """
+        context = getattr(reports, 'context', None)
+        engine = self.get_pdf_engine()
+        jobs = [
+            (f"{document_type}.pdf",
+             self.pdf_generator.get_job_content(reports[f"{document_type}_html"], context, document_type, engine),
+             document_type)
+            for document_type in ('first_page', 'deviation_statement', 'note_sheet', 'certificate_ii', 'certificate_iii')
+        ]
+        
+        if reports.get('extra_items_html'):
+            jobs.append(('extra_items.pdf',
+                         self.pdf_generator.get_job_content(reports['extra_items_html'], context, 'extra_items', engine),
+                         'extra_items'))
+        
+        # Combined report is laid out from the same sections in a single pass
+        jobs.append(('combined_report.pdf', [(html, document_type) for _, html, document_type in jobs], COMBINED_DOCUMENT))
+        
+        return jobs
+    
+    def render_batch_pdfs(self, all_reports, rendered_outputs=None):
+        """Render the PDFs of every file in the batch in one pool pass
+        
+        rendered_outputs maps filenames to outputs that already exist; those
+        PDFs are not rendered again.
+        """
+        rendered_outputs = rendered_outputs or {}
+        batch_jobs = [
+            (filename, output_name, html, document_type)
+            for filename, reports in all_reports.items()
+            for output_name, html, document_type in self.get_pdf_jobs(reports)
+            if output_name not in rendered_outputs.get(filename, {})
+        ]
+        
+        rendered = self.pdf_generator.generate_pdfs(
+            [(html, document_type) for _, _, html, document_type in batch_jobs],
+            self.max_workers,
+            [filename for filename, _, _, _ in batch_jobs]
+        )
+        
+        batch_pdfs = {filename: {} for filename in all_reports}
+        for (filename, output_name, _, _), pdf_bytes in zip(batch_jobs, rendered):
+            batch_pdfs[filename][output_name] = pdf_bytes
+        
+        return batch_pdfs
+    
+    def get_output_names(self, reports):
+        """List the outputs create_file_outputs produces for a file, in order"""
+        pdf_names = [output_name for output_name, _, _ in self.get_pdf_jobs(reports)]
+        html_names = [
+            output_name.replace('.pdf', '.html')
+            for output_name in pdf_names
+            if output_name != 'combined_report.pdf'
+        ]
+        return pdf_names + html_names + ['summary.txt']
+    
+    def render_output(self, reports, output_name):
+        """Render a single output on demand"""
+        for job_name, content, document_type in self.get_pdf_jobs(reports):
+            if job_name == output_name:
+                return self.pdf_generator.render_job((content, document_type))
+        
+        return self.create_text_outputs(reports)[output_name]
+    
+    def create_file_outputs(self, reports, filename, pdfs=None, progress=None):
+        """Create downloadable outputs for a single file
+        
+        pdfs holds PDFs already rendered (as part of a batch, or reused by an
+        incremental run); only the missing ones are rendered. progress is
+        reported as in process_file.
+        """
+        outputs = {}
+        pdfs = dict(pdfs or {})
+        
+        # Generate PDFs and the combined report
+        all_jobs = self.get_pdf_jobs(reports)
+        jobs = [job for job in all_jobs if job[0] not in pdfs]
+        done = len(all_jobs) - len(jobs)
+        if progress:
+            for output_name, _, _ in all_jobs:
+                if output_name in pdfs:
+                    progress(output_name, done, len(all_jobs))
+        if jobs:
+            def on_rendered(index):
+                progress(jobs[index][0], done + index + 1, len(all_jobs))
+            
+            rendered = self.pdf_generator.generate_pdfs(
+                [(html, document_type) for _, html, document_type in jobs],
+                self.max_workers,
+                on_rendered=on_rendered if progress else None
+            )
+            pdfs.update({output_name: pdf_bytes for (output_name, _, _), pdf_bytes in zip(jobs, rendered)})
+        
+        outputs.update({output_name: pdfs[output_name] for output_name, _, _ in all_jobs})
+        outputs.update(self.create_text_outputs(reports))
+        
+        return outputs
+    
+    def create_text_outputs(self, reports):
+        """Create the HTML and summary outputs, which need no PDF rendering"""
+        outputs = {}
+        
+        # Generate HTML files
+        outputs['first_page.html'] = reports['first_page_html'].encode()
+        outputs['deviation_statement.html'] = reports['deviation_statement_html'].encode()
+        outputs['note_sheet.html'] = reports['note_sheet_html'].encode()
+        outputs['certificate_ii.html'] = reports['certificate_ii_html'].encode()
+        outputs['certificate_iii.html'] = reports['certificate_iii_html'].encode()
+        
+        if reports.get('extra_items_html'):
+            outputs['extra_items.html'] = reports['extra_items_html'].encode()
+        
+        # Generate DOCX files (simplified implementation)
+        # Note: Full DOCX generation would require python-docx library
+        outputs['summary.txt'] = self.create_summary_text(reports).encode()
+        
+        return outputs
+    
+    def get_summary_details(self, reports):
+        """What the summary of a file's reports says, without the time it was generated"""
+        join_diagnostics = (getattr(reports, 'context', None) or {}).get('join_diagnostics') or {}
+        return {
+            'extra_items': bool(reports.get('extra_items_html')),
+            'join_warnings': warning_lines(join_diagnostics) if join_diagnostics.get('has_warnings') else []
+        }
+    
+    def create_summary_text(self, reports):
+        """Create a text summary of the reports"""
+        return self.format_summary_text(**self.get_summary_details(reports))
+    
+    def format_summary_text(self, extra_items, join_warnings):
+        """Write the text summary, stamped with the current time"""
+        summary = f"""
+BILL PROCESSING SUMMARY
+Generated on: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
+
+Reports Generated:
+- First Page Report
+- Deviation Statement
+- Note Sheet
+- Certificate II
+- Certificate III
+"""
+        if extra_items:
+            summary += "- Extra Items Report\n"
+        
+        summary += "\nAll reports have been generated successfully with proper formatting and calculations."
+        
+        # Bill Quantity rows left out of the reports and repeated serial numbers
+        if join_warnings:
+            summary += "\n\nSerial Number Matching Warnings:\n"
+            summary += ''.join(f"- {line}\n" for line in join_warnings)
+        
+        return summary
@@ -0,0 +1,85 @@
+import os
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+
+from .money import DEVIATION_COLUMNS, amount_columns, to_rupees
+from .template_renderer import TemplateRenderer, get_shared_renderer
+
+# Item rows per block of a chunked deviation statement; 0 never chunks
+DEFAULT_CHUNK_ROWS = int(os.environ.get('BILL_CHUNK_ROWS', 300))
+
+# Subtotal keys of the brought / carried forward rows, one per amount column
+SUBTOTAL_KEYS = ('work_order_total', 'executed_total', 'overall_excess', 'overall_saving')
+
+def count_deviation_rows(report_data) -> int:
+    return len(report_data.get('deviation_items') or ()) + len(report_data.get('extra_items_for_deviation') or ())
+
+class ChunkedDeviationStatement:
+    """Deviation statement of a large bill, rendered as blocks of chunk_rows item rows
+
+    Each block is a complete HTML document with the table header, the
+    subtotals brought forward from the blocks before it and, except for
+    the last, the subtotals carried forward; the last block ends with the
+    statement's summary rows. Blocks are rendered one at a time, so the PDF
+    stage only ever holds and lays out one block; within a block the HTML is
+    a single string, since WeasyPrint parses a whole document. The object
+    holds just the report context and is sent to rendering pool workers as is.
+    """
+
+    template_name = 'deviation_statement.html'
+
+    def __init__(self, report_data, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        self.report_data = report_data
+        self.chunk_rows = max(1, chunk_rows)
+
+    def __len__(self) -> int:
+        """Number of blocks"""
+        return max(1, -(-count_deviation_rows(self.report_data) // self.chunk_rows))
+
+    def get_subtotals(self, cumulative: np.ndarray, rows: int) -> Dict[str, float]:
+        """Amount column totals of the first rows item rows"""
+        paise = cumulative[rows - 1] if rows else np.zeros(len(SUBTOTAL_KEYS), dtype=np.int64)
+        return {key: to_rupees(total) for key, total in zip(SUBTOTAL_KEYS, paise)}
+
+    def get_chunks(self) -> Iterator[Dict[str, Any]]:
+        """Template variables of each block, in order"""
+        deviation_items = self.report_data.get('deviation_items') or ()
+        extra_items = self.report_data.get('extra_items_for_deviation') or ()
+        total = len(deviation_items) + len(extra_items)
+
+        # Running totals in exact paise, the same arithmetic as the statement's grand totals
+        cumulative = np.cumsum(
+            np.concatenate([amount_columns(deviation_items, DEVIATION_COLUMNS),
+                            amount_columns(extra_items, DEVIATION_COLUMNS)]),
+            axis=0
+        )
+
+        for start in range(0, max(total, 1), self.chunk_rows):
+            end = min(start + self.chunk_rows, total)
+            split = len(deviation_items)
+            yield {
+                'first': start == 0,
+                'last': end >= total,
+                'deviation_items': deviation_items[start:min(end, split)],
+                'extra_items': extra_items[max(start - split, 0):max(end - split, 0)],
+                'extra_header': start <= split < end,
+                'brought_forward': self.get_subtotals(cumulative, start) if start else None,
+                'carried_forward': self.get_subtotals(cumulative, end) if end < total else None
+            }
+
+    def iter_html(self, renderer: Optional[TemplateRenderer] = None) -> Iterator[str]:
+        """HTML of each block, rendered only when the previous one has been consumed
+
+        The template's output is joined into one string per block; the
+        statement is streamed block by block, not within a block.
+        """
+        renderer = renderer or get_shared_renderer()
+        for chunk in self.get_chunks():
+            yield ''.join(renderer.generate_template(self.template_name, self.report_data, chunk=chunk))
+
+def chunk_deviation_statement(report_data, chunk_rows: int) -> Optional[ChunkedDeviationStatement]:
+    """A chunked deviation statement when the bill has more item rows than one block, else None"""
+    if report_data is None or chunk_rows <= 0 or count_deviation_rows(report_data) <= chunk_rows:
+        return None
+    return ChunkedDeviationStatement(report_data, chunk_rows)
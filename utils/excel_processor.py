@@ -1,54 +1,198 @@
 import pandas as pd
+from pandas.api.types import is_numeric_dtype, is_object_dtype
+from pandas.io.parsers import TextParser
 import io
-from typing import Dict, Any, Optional
+import zipfile
+from typing import Dict, Any, List, Optional, Tuple
 import traceback
 
+from . import instrumentation
+from .instrumentation import instrumented
+from .items import WorkOrderItem, BillQuantityItem, ExtraItem
+from .sheet_cache import DEFAULT_SHEET_CACHE, SheetCache, get_sheet_digests
+
+def count_parsed_rows(result, *args, **kwargs) -> int:
+    """Number of item rows in the result of process_excel_file"""
+    if not result:
+        return 0
+    return sum(
+        len((result.get(key) or {}).get('items', []))
+        for key in ('work_order_data', 'bill_quantity_data', 'extra_items_data')
+    )
+
 class ExcelProcessor:
     """Class to handle Excel file processing and data extraction"""
     
-    def __init__(self):
+    def __init__(self, engine: str = 'streaming', sheet_cache: Optional[SheetCache] = None):
         self.required_sheets = ['Title', 'Work Order', 'Bill Quantity']
         self.optional_sheets = ['Extra Items']
+        # 'streaming' reads only the needed sheets with openpyxl; 'pandas' loads every sheet
+        self.engine = engine
+        # Processed sheets by content digest, so unchanged sheets are not parsed again
+        self.sheet_cache = sheet_cache if sheet_cache is not None else DEFAULT_SHEET_CACHE
+        self.sheet_processors = {
+            'Title': self.process_title_sheet,
+            'Work Order': self.process_work_order_sheet,
+            'Bill Quantity': self.process_bill_quantity_sheet,
+            'Extra Items': self.process_extra_items_sheet
+        }
     
     def process_excel_file(self, uploaded_file) -> Optional[Dict[str, Any]]:
         """Process an uploaded Excel file and extract data from all sheets"""
         try:
-            # Validate file before processing
-            if not uploaded_file:
-                raise ValueError("No file provided")
-                
-            if uploaded_file.size == 0:
-                raise ValueError("Empty file provided")
-                
-            # Read file content into bytes first
-            file_content = uploaded_file.read()
-            uploaded_file.seek(0)  # Reset file pointer
-            
-            # Read all sheets using BytesIO
-            excel_data = pd.read_excel(io.BytesIO(file_content), sheet_name=None, engine='openpyxl')
-            
-            # Validate required sheets
-            available_sheets = list(excel_data.keys())
-            missing_sheets = [sheet for sheet in self.required_sheets if sheet not in available_sheets]
-            if missing_sheets:
-                raise ValueError(f"Missing required sheets: {missing_sheets}. Available sheets: {available_sheets}")
-            
-            # Extract data from each sheet
-            processed_data = {
-                'filename': uploaded_file.name,
-                'title_data': self.process_title_sheet(excel_data.get('Title')),
-                'work_order_data': self.process_work_order_sheet(excel_data.get('Work Order')),
-                'bill_quantity_data': self.process_bill_quantity_sheet(excel_data.get('Bill Quantity')),
-                'extra_items_data': self.process_extra_items_sheet(excel_data.get('Extra Items')) if 'Extra Items' in excel_data else None
-            }
-            
-            return processed_data
-            
+            return self.read_workbook(uploaded_file)
         except Exception as e:
             print(f"Error processing Excel file {uploaded_file.name if uploaded_file else 'Unknown'}: {str(e)}")
             print(traceback.format_exc())
             return None
     
+    @instrumented('process_excel_file',
+                  bytes_in=lambda result, self, uploaded_file, *args, **kwargs: getattr(uploaded_file, 'size', None),
+                  rows=count_parsed_rows)
+    def read_workbook(self, uploaded_file) -> Dict[str, Any]:
+        """Process an uploaded Excel file like process_excel_file, raising on failure
+        
+        The error travels with the call, so a processor shared by sessions
+        and threads never reports another upload's failure.
+        """
+        # Validate file before processing
+        if not uploaded_file:
+            raise ValueError("No file provided")
+            
+        if uploaded_file.size == 0:
+            raise ValueError("Empty file provided")
+            
+        # Read file content into bytes first
+        file_content = uploaded_file.read()
+        uploaded_file.seek(0)  # Reset file pointer
+        
+        # Sheets unchanged since an earlier workbook are taken from the sheet cache
+        digests = self.get_sheet_digests(file_content)
+        cached = self.get_cached_sheets(digests)
+        
+        # Read the remaining sheets using BytesIO
+        excel_data, available_sheets = self.read_sheets(file_content, skip_sheets=cached)
+        
+        # Validate required sheets
+        missing_sheets = [sheet for sheet in self.required_sheets if sheet not in available_sheets]
+        if missing_sheets:
+            raise ValueError(f"Missing required sheets: {missing_sheets}. Available sheets: {available_sheets}")
+        
+        # Extract data from each sheet
+        sheets = {
+            sheet_name: self.process_sheet(sheet_name, excel_data, cached, digests)
+            for sheet_name in self.required_sheets + self.optional_sheets
+            if sheet_name in available_sheets
+        }
+        return {
+            'filename': uploaded_file.name,
+            'title_data': sheets['Title'],
+            'work_order_data': sheets['Work Order'],
+            'bill_quantity_data': sheets['Bill Quantity'],
+            'extra_items_data': sheets.get('Extra Items')
+        }
+    
+    def get_sheet_digests(self, file_content: bytes) -> Dict[str, str]:
+        """Content digests of the needed sheets of an xlsx workbook; empty for other formats"""
+        if not zipfile.is_zipfile(io.BytesIO(file_content)):
+            return {}
+        try:
+            return get_sheet_digests(file_content, self.required_sheets + self.optional_sheets)
+        except Exception as e:
+            print(f"Error hashing workbook sheets: {str(e)}")
+            return {}
+    
+    def get_sheet_cache_key(self, sheet_name: str, digest: str) -> Tuple[str, str, str]:
+        return (self.engine, sheet_name, digest)
+    
+    def get_cached_sheets(self, digests: Dict[str, str]) -> Dict[str, Any]:
+        """Processed results of the sheets found in the sheet cache, by sheet name"""
+        cached = {}
+        for sheet_name, digest in digests.items():
+            result = self.sheet_cache.get(self.get_sheet_cache_key(sheet_name, digest))
+            if result is not None:
+                cached[sheet_name] = result
+        return cached
+    
+    def process_sheet(self, sheet_name: str, excel_data: Dict[str, pd.DataFrame],
+                      cached: Dict[str, Any], digests: Dict[str, str]) -> Any:
+        """Process one sheet, or reuse its cached result, storing fresh results in the sheet cache"""
+        if sheet_name in cached:
+            with instrumentation.stage('sheet_cache_hit', detail=sheet_name) as record:
+                result = cached[sheet_name]
+                record.rows = len(result['items']) if 'items' in result else None
+            return result
+        
+        result = self.sheet_processors[sheet_name](excel_data.get(sheet_name))
+        if sheet_name in digests:
+            self.sheet_cache.put(self.get_sheet_cache_key(sheet_name, digests[sheet_name]), result)
+        return result
+    
+    def read_sheets(self, file_content: bytes, skip_sheets=()) -> Tuple[Dict[str, pd.DataFrame], List[str]]:
+        """Read workbook sheets into DataFrames, returning them with all available sheet names
+        
+        With the streaming engine, sheets named in skip_sheets are not read.
+        """
+        if self.engine == 'streaming' and zipfile.is_zipfile(io.BytesIO(file_content)):
+            return self.read_sheets_streaming(file_content, skip_sheets)
+        
+        excel_data = pd.read_excel(io.BytesIO(file_content), sheet_name=None, engine='openpyxl')
+        return excel_data, list(excel_data.keys())
+    
+    def read_sheets_streaming(self, file_content: bytes, skip_sheets=()) -> Tuple[Dict[str, pd.DataFrame], List[str]]:
+        """Stream only the required and optional sheets with openpyxl in read-only mode"""
+        from openpyxl import load_workbook
+        
+        workbook = load_workbook(io.BytesIO(file_content), read_only=True, data_only=True, keep_links=False)
+        try:
+            available_sheets = list(workbook.sheetnames)
+            excel_data = {
+                sheet_name: self.sheet_to_dataframe(workbook[sheet_name])
+                for sheet_name in self.required_sheets + self.optional_sheets
+                if sheet_name in available_sheets and sheet_name not in skip_sheets
+            }
+        finally:
+            workbook.close()
+        
+        return excel_data, available_sheets
+    
+    def sheet_to_dataframe(self, sheet) -> pd.DataFrame:
+        """Convert a read-only worksheet to a DataFrame the way pd.read_excel does"""
+        from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+        
+        # Read-only sheets may carry stale dimensions; let openpyxl find the real extent
+        sheet.reset_dimensions()
+        
+        rows = []
+        last_row_with_data = -1
+        for row_number, row in enumerate(sheet.iter_rows()):
+            values = []
+            for cell in row:
+                value = cell.value
+                if value is None:
+                    value = ""
+                elif cell.data_type == TYPE_ERROR:
+                    value = float('nan')
+                elif cell.data_type == TYPE_NUMERIC and int(value) == value:
+                    value = int(value)
+                values.append(value)
+            
+            # Trim trailing empty cells and remember the last row with data
+            while values and values[-1] == "":
+                values.pop()
+            if values:
+                last_row_with_data = row_number
+            rows.append(values)
+        
+        rows = rows[:last_row_with_data + 1]
+        if not rows:
+            return pd.DataFrame()
+        
+        width = max(len(row) for row in rows)
+        rows = [row + [""] * (width - len(row)) for row in rows]
+        
+        return TextParser(rows, header=0, skip_blank_lines=False).read()
+    
     def process_title_sheet(self, df: pd.DataFrame) -> Dict[str, Any]:
         """Extract title and header information"""
         if df is None:
@@ -81,136 +225,99 @@ class ExcelProcessor:
     
     def process_work_order_sheet(self, df: pd.DataFrame) -> Dict[str, Any]:
         """Process work order data"""
+        return self.parse_item_rows(df, WorkOrderItem, skip_zero_quantity=False)
+    
+    def process_bill_quantity_sheet(self, df: pd.DataFrame) -> Dict[str, Any]:
+        """Process bill quantity data"""
+        return self.parse_item_rows(df, BillQuantityItem, skip_zero_quantity=True)
+    
+    def process_extra_items_sheet(self, df: pd.DataFrame) -> Dict[str, Any]:
+        """Process extra items data"""
+        return self.parse_item_rows(df, ExtraItem, skip_zero_quantity=True)
+    
+    def parse_item_rows(self, df: pd.DataFrame, record_class: type,
+                        skip_zero_quantity: bool) -> Dict[str, Any]:
+        """Parse item rows column-wise into compact item records of record_class
+        
+        Columns are serial no, description, unit, quantity, rate, amount and
+        remark. Header rows (blank serial or containing 'serial') are skipped,
+        as are rows without a positive quantity when skip_zero_quantity is set.
+        A zero amount is replaced by quantity x rate.
+        """
         if df is None:
             return {'items': [], 'total': 0}
         
-        items = []
-        
         # Clean column names
         df.columns = [str(col).strip() for col in df.columns]
         
-        # Process each row
-        for idx, row in df.iterrows():
-            # Skip header rows and empty rows
-            if pd.isna(row.iloc[0]) or 'serial' in str(row.iloc[0]).lower():
-                continue
-            
-            # Only include serial number if it exists and is not empty/blank
-            serial_val = row.iloc[0] if pd.notna(row.iloc[0]) else ''
-            serial_no = str(serial_val).strip() if serial_val and str(serial_val).strip() and str(serial_val).strip() != 'nan' else ''
-            
-            item = {
-                'serial_no': serial_no,
-                'description': str(row.iloc[1]).strip() if len(row) > 1 and pd.notna(row.iloc[1]) else '',
-                'unit': str(row.iloc[2]).strip() if len(row) > 2 and pd.notna(row.iloc[2]) else '',
-                'quantity': self.safe_float(row.iloc[3]) if len(row) > 3 else 0,
-                'rate': self.safe_float(row.iloc[4]) if len(row) > 4 else 0,
-                'amount': self.safe_float(row.iloc[5]) if len(row) > 5 else 0,
-                'remark': str(row.iloc[6]).strip() if len(row) > 6 and pd.notna(row.iloc[6]) else ''
-            }
-            
-            # Calculate amount if not provided
-            if item['amount'] == 0 and item['quantity'] > 0 and item['rate'] > 0:
-                item['amount'] = item['quantity'] * item['rate']
-            
-            items.append(item)
+        if df.empty or len(df.columns) == 0:
+            return {'items': [], 'total': 0}
         
-        # Calculate total
-        total = sum(item['amount'] for item in items)
+        serial_col = df.iloc[:, 0]
+        serial_text = serial_col.astype(object).astype(str)
         
-        return {'items': items, 'total': total}
-    
-    def process_bill_quantity_sheet(self, df: pd.DataFrame) -> Dict[str, Any]:
-        """Process bill quantity data"""
-        if df is None:
-            return {'items': [], 'total': 0}
+        # Skip header rows and empty rows
+        keep = serial_col.notna() & ~serial_text.str.lower().str.contains('serial', regex=False)
         
-        items = []
+        quantity = self.float_column(df, 3)
+        rate = self.float_column(df, 4)
+        amount = self.float_column(df, 5)
         
-        # Clean column names
-        df.columns = [str(col).strip() for col in df.columns]
+        # Only process rows with non-zero quantities
+        if skip_zero_quantity:
+            keep &= ~(quantity <= 0)
         
-        # Process each row
-        for idx, row in df.iterrows():
-            # Skip header rows and empty rows
-            if pd.isna(row.iloc[0]) or 'serial' in str(row.iloc[0]).lower():
-                continue
-            
-            # Only process rows with non-zero quantities
-            quantity = self.safe_float(row.iloc[3]) if len(row) > 3 else 0
-            if quantity <= 0:
-                continue
-            
-            # Only include serial number if it exists and is not empty/blank
-            serial_val = row.iloc[0] if pd.notna(row.iloc[0]) else ''
-            serial_no = str(serial_val).strip() if serial_val and str(serial_val).strip() and str(serial_val).strip() != 'nan' else ''
-            
-            item = {
-                'serial_no': serial_no,
-                'description': str(row.iloc[1]).strip() if len(row) > 1 and pd.notna(row.iloc[1]) else '',
-                'unit': str(row.iloc[2]).strip() if len(row) > 2 and pd.notna(row.iloc[2]) else '',
-                'quantity_bill': quantity,
-                'rate': self.safe_float(row.iloc[4]) if len(row) > 4 else 0,
-                'amount_bill': self.safe_float(row.iloc[5]) if len(row) > 5 else 0,
-                'remark': str(row.iloc[6]).strip() if len(row) > 6 and pd.notna(row.iloc[6]) else ''
-            }
-            
-            # Calculate amount if not provided
-            if item['amount_bill'] == 0 and item['quantity_bill'] > 0 and item['rate'] > 0:
-                item['amount_bill'] = item['quantity_bill'] * item['rate']
-            
-            items.append(item)
+        # Calculate amount if not provided
+        amount = amount.mask((amount == 0) & (quantity > 0) & (rate > 0), quantity * rate)
+        
+        # Only include serial number if it exists and is not empty/blank
+        serial_text = serial_text.str.strip()
+        serial_no = serial_text.where(serial_col.ne(0) & (serial_text != '') & (serial_text != 'nan'), '')
+        
+        columns = [
+            serial_no[keep].tolist(),
+            self.text_column(df, 1)[keep].tolist(),
+            self.text_column(df, 2)[keep].tolist(),
+            quantity[keep].tolist(),
+            rate[keep].tolist(),
+            amount[keep].tolist(),
+            self.text_column(df, 6)[keep].tolist()
+        ]
+        
+        items = list(map(record_class, *columns))
         
         # Calculate total
-        total = sum(item['amount_bill'] for item in items)
+        total = sum(columns[5])
         
         return {'items': items, 'total': total}
     
-    def process_extra_items_sheet(self, df: pd.DataFrame) -> Dict[str, Any]:
-        """Process extra items data"""
-        if df is None:
-            return {'items': [], 'total': 0}
+    def text_column(self, df: pd.DataFrame, position: int) -> pd.Series:
+        """Get a stripped text column, with blanks for missing cells or columns"""
+        if len(df.columns) <= position:
+            return pd.Series('', index=df.index, dtype=object)
         
-        items = []
+        column = df.iloc[:, position]
+        # Go through object dtype so dates format exactly like str()
+        return column.astype(object).astype(str).str.strip().where(column.notna(), '')
+    
+    def float_column(self, df: pd.DataFrame, position: int) -> pd.Series:
+        """Get a numeric column with the same conversion rules as safe_float"""
+        if len(df.columns) <= position:
+            return pd.Series(0.0, index=df.index)
         
-        # Clean column names
-        df.columns = [str(col).strip() for col in df.columns]
+        column = df.iloc[:, position]
+        if not (is_numeric_dtype(column) or is_object_dtype(column)):
+            # Dates and other typed columns are never numeric for safe_float
+            return column.map(self.safe_float).astype(float)
         
-        # Process each row
-        for idx, row in df.iterrows():
-            # Skip header rows and empty rows
-            if pd.isna(row.iloc[0]) or 'serial' in str(row.iloc[0]).lower():
-                continue
-            
-            # Only process rows with non-zero quantities
-            quantity = self.safe_float(row.iloc[3]) if len(row) > 3 else 0
-            if quantity <= 0:
-                continue
-            
-            # Only include serial number if it exists and is not empty/blank
-            serial_val = row.iloc[0] if pd.notna(row.iloc[0]) else ''
-            serial_no = str(serial_val).strip() if serial_val and str(serial_val).strip() and str(serial_val).strip() != 'nan' else ''
-            
-            item = {
-                'serial_no': serial_no,
-                'description': str(row.iloc[1]).strip() if len(row) > 1 and pd.notna(row.iloc[1]) else '',
-                'unit': str(row.iloc[2]).strip() if len(row) > 2 and pd.notna(row.iloc[2]) else '',
-                'quantity': quantity,
-                'rate': self.safe_float(row.iloc[4]) if len(row) > 4 else 0,
-                'amount': self.safe_float(row.iloc[5]) if len(row) > 5 else 0,
-                'remark': str(row.iloc[6]).strip() if len(row) > 6 and pd.notna(row.iloc[6]) else ''
-            }
-            
-            # Calculate amount if not provided
-            if item['amount'] == 0 and item['quantity'] > 0 and item['rate'] > 0:
-                item['amount'] = item['quantity'] * item['rate']
-            
-            items.append(item)
+        values = pd.to_numeric(column, errors='coerce').astype(float)
         
-        # Calculate total
-        total = sum(item['amount'] for item in items)
+        # Cells to_numeric cannot read (padded numbers, booleans) go through safe_float
+        unresolved = values.isna() & column.notna()
+        if unresolved.any():
+            values[unresolved] = column[unresolved].map(self.safe_float)
         
-        return {'items': items, 'total': total}
+        return values.where(column.notna(), 0.0)
     
     def safe_float(self, value) -> float:
         """Safely convert value to float"""
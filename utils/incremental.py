@@ -0,0 +1,284 @@
+import base64
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .report_generator import ReportGenerator
+from .report_context import GeneratedReports
+from .join_index import JoinedItems, join_by_serial
+from .items import BillQuantityItem, DeviationItem, MergedItem, WorkOrderItem
+from . import instrumentation
+
+# Bump when the layout of the stored state changes
+STATE_FORMAT_VERSION = '3'
+
+DEFAULT_STATE_DIR = Path(os.environ.get(
+    'BILL_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache')
+)) / 'incremental'
+
+# Fields the fallback page of a failed render shows, whatever its template reads
+FALLBACK_FIELDS = ('agreement_no', 'name_of_work', 'name_of_firm')
+
+def canonical(value: Any) -> Any:
+    """JSON form of values json cannot encode itself: records as dicts, numpy values as Python ones, the rest as text"""
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    return str(value)
+
+def digest(value: Any) -> str:
+    """Stable digest of parsed or derived data
+
+    Equal values hash the same whatever objects they are built from, which
+    pickle bytes (shaped by object identity and sharing) do not guarantee.
+    """
+    serialized = json.dumps(value, sort_keys=True, default=canonical, separators=(',', ':'))
+    return hashlib.blake2b(serialized.encode(), digest_size=16).hexdigest()
+
+def encode_pdf(content: Optional[bytes]) -> Optional[str]:
+    return base64.b64encode(content).decode('ascii') if content is not None else None
+
+def decode_pdf(content: Optional[str]) -> Optional[bytes]:
+    return base64.b64decode(content) if content is not None else None
+
+def encode_state(state: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON form of a run's state: rows as their source records, PDFs as base64"""
+    return {
+        'version': state['version'],
+        'environment': state['environment'],
+        'rows': [
+            {
+                'key': list(row_key),
+                'work_order': merged_item.work_order.to_dict(),
+                'bill': merged_item.bill.to_dict() if merged_item.bill is not None else None
+            }
+            for row_key, (merged_item, _) in state['rows'].items()
+        ],
+        'documents': {
+            report_key: dict(document, pdf=encode_pdf(document.get('pdf')))
+            for report_key, document in state['documents'].items()
+        },
+        'combined_pdf': encode_pdf(state.get('combined_pdf'))
+    }
+
+def decode_state(stored: Dict[str, Any]) -> Dict[str, Any]:
+    """Rebuild the state encode_state stored; merged and deviation rows are views over the source records"""
+    rows = {}
+    for row in stored['rows']:
+        bill = BillQuantityItem.from_dict(row['bill']) if row['bill'] is not None else None
+        merged_item = MergedItem(WorkOrderItem.from_dict(row['work_order']), bill)
+        rows[tuple(row['key'])] = (merged_item, DeviationItem(merged_item))
+    return {
+        'version': stored['version'],
+        'environment': stored['environment'],
+        'rows': rows,
+        'documents': {
+            report_key: dict(document, pdf=decode_pdf(document.get('pdf')))
+            for report_key, document in stored['documents'].items()
+        },
+        'combined_pdf': decode_pdf(stored.get('combined_pdf'))
+    }
+
+class IncrementalStore:
+    """On-disk store of each agreement's last run: row hashes, derived rows and rendered documents
+
+    The state is kept as JSON, so reading a state file never runs code from
+    the shared cache directory.
+    """
+
+    def __init__(self, state_dir: Optional[Path] = None):
+        self.state_dir = Path(state_dir) if state_dir else DEFAULT_STATE_DIR
+
+    def get_key(self, file_data: Dict[str, Any]) -> str:
+        """Successive bills of a work share the agreement number; fall back to the file name"""
+        title_data = file_data.get('title_data') or {}
+        identity = str(title_data.get('agreement_no') or '').strip() or file_data.get('filename', '')
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    def get_path(self, key: str) -> Path:
+        return self.state_dir / f"{key}.json"
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        """Load an agreement's stored state, or None if there is none or it is unusable"""
+        try:
+            with open(self.get_path(key), 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            return decode_state(stored) if stored.get('version') == STATE_FORMAT_VERSION else None
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading incremental state {key}: {str(e)}")
+            return None
+
+    def save(self, key: str, state: Dict[str, Any]):
+        tmp_path = None
+        try:
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+            path = self.get_path(key)
+            tmp_path = path.with_name(f"{key}.{uuid.uuid4().hex}.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(encode_state(state), f)
+            os.replace(tmp_path, path)
+            tmp_path = None
+        except Exception as e:
+            print(f"Error writing incremental state {key}: {str(e)}")
+        finally:
+            # A failed write leaves no partial state behind
+            if tmp_path is not None:
+                tmp_path.unlink(missing_ok=True)
+
+    def clear(self):
+        for path in self.state_dir.glob('*.json'):
+            path.unlink(missing_ok=True)
+
+class IncrementalResult:
+    """Reports of one incremental run, the PDFs it could reuse and the state to store once rendered"""
+
+    def __init__(self, key: str, reports: Dict[str, str], reused_pdfs: Dict[str, bytes],
+                 state: Dict[str, Any], stats: Dict[str, int], report_data=None):
+        self.key = key
+        self.reports = reports
+        self.report_data = report_data
+        self.reused_pdfs = reused_pdfs
+        self.state = state
+        self.stats = stats
+
+class IncrementalReportBuilder:
+    """Regenerates reports from the previous run of the same agreement, redoing only what changed
+
+    Merged and deviation rows are reused for every work order row whose own
+    and matching bill quantity row hashes are unchanged; totals are always
+    recomputed. A document is rendered again only if the context fields its
+    template reads have changed, and its PDF is reused otherwise.
+    """
+
+    def __init__(self, report_generator: ReportGenerator, store: Optional[IncrementalStore] = None):
+        self.report_generator = report_generator
+        self.store = store or IncrementalStore()
+
+    def get_environment_version(self, pdf_config: Optional[str] = None) -> str:
+        """Templates, settings and PDF settings (engine, ...) the stored documents were rendered with"""
+        return digest((
+            self.report_generator.template_renderer.template_version(),
+            self.report_generator.config_version(),
+            pdf_config
+        ))
+
+    def build_rows(self, data: Dict[str, Any], previous_rows: Dict[Tuple[str, str], Tuple]) -> Tuple[List, List, Dict, int]:
+        """Merge work order and bill rows, reusing previous results of unchanged row pairs"""
+        work_order_items = (data.get('work_order_data') or {}).get('items', [])
+        bill_items = (data.get('bill_quantity_data') or {}).get('items', [])
+
+        # Same join as merge_work_order_and_bill_data
+        matches, diagnostics = join_by_serial(work_order_items, bill_items)
+
+        merged_items = JoinedItems(diagnostics=diagnostics)
+        deviation_items = []
+        rows = {}
+        recomputed = 0
+        for wo_item, bill_item in zip(work_order_items, matches):
+            row_key = (digest(wo_item), digest(bill_item) if bill_item is not None else '')
+
+            if row_key in rows:
+                merged_item, deviation_item = rows[row_key]
+            elif row_key in previous_rows:
+                merged_item, deviation_item = previous_rows[row_key]
+            else:
+                merged_item = self.report_generator.merge_work_order_and_bill_data(
+                    [wo_item], [bill_item] if bill_item is not None else []
+                )[0]
+                deviation_item = self.report_generator.prepare_deviation_items([merged_item])[0]
+                recomputed += 1
+
+            rows[row_key] = (merged_item, deviation_item)
+            merged_items.append(merged_item)
+            deviation_items.append(deviation_item)
+
+        return merged_items, deviation_items, rows, recomputed
+
+    def get_document_inputs(self, report_data, template_name: str) -> str:
+        """Digest of the context fields a template reads"""
+        fields = self.report_generator.template_renderer.context_fields(template_name)
+        if fields is None:
+            return digest(sorted(report_data.items()))
+        fields = sorted(set(fields) | set(FALLBACK_FIELDS))
+        return digest([(field, report_data.get(field)) for field in fields])
+
+    def generate(self, file_data: Dict[str, Any], pdf_config: Optional[str] = None) -> IncrementalResult:
+        """Generate every report, reusing rows, HTML and PDFs of the agreement's previous run
+
+        Stored PDFs are only reused when they were rendered with the same pdf_config.
+        """
+        with instrumentation.stage('incremental_reports') as record:
+            result = self.build_result(file_data, pdf_config)
+            record.rows = result.stats['rows_recomputed']
+            record.detail = (f"{result.stats['rows_recomputed']}/{result.stats['rows_total']} rows recomputed, "
+                             f"{result.stats['documents_rendered']}/{result.stats['documents_total']} documents rendered, "
+                             f"{result.stats['pdfs_reused']} PDFs reused")
+        return result
+
+    def build_result(self, file_data: Dict[str, Any], pdf_config: Optional[str] = None) -> IncrementalResult:
+        key = self.store.get_key(file_data)
+        environment_version = self.get_environment_version(pdf_config)
+        previous = self.store.load(key) or {}
+        previous_rows = previous.get('rows', {})
+        previous_documents = previous.get('documents', {}) if previous.get('environment') == environment_version else {}
+
+        merged_items, deviation_items, rows, recomputed = self.build_rows(file_data, previous_rows)
+        report_data = self.report_generator.build_report_data(file_data, merged_items, deviation_items,
+                                                              merged_items.diagnostics)
+
+        reports = GeneratedReports(context=report_data)
+        reused_pdfs = {}
+        documents = {}
+        rendered = 0
+        for report_key, template_name in self.report_generator.get_report_templates(report_data).items():
+            inputs = self.get_document_inputs(report_data, template_name)
+            stored = previous_documents.get(report_key)
+
+            if stored and stored['inputs'] == inputs:
+                reports[report_key] = stored['html']
+                if stored.get('pdf') is not None:
+                    reused_pdfs[self.get_pdf_name(report_key)] = stored['pdf']
+            else:
+                reports[report_key] = self.report_generator.template_renderer.render_template(template_name, report_data)
+                rendered += 1
+            documents[report_key] = {'inputs': inputs, 'html': reports[report_key], 'pdf': None}
+
+        # The combined report is only reusable when every section is
+        if len(reused_pdfs) == len(reports) and previous.get('combined_pdf') is not None:
+            reused_pdfs['combined_report.pdf'] = previous['combined_pdf']
+
+        state = {
+            'version': STATE_FORMAT_VERSION,
+            'environment': environment_version,
+            'rows': rows,
+            'documents': documents,
+            'combined_pdf': None
+        }
+        stats = {
+            'rows_total': len(merged_items),
+            'rows_recomputed': recomputed,
+            'documents_total': len(reports),
+            'documents_rendered': rendered,
+            'pdfs_reused': len(reused_pdfs)
+        }
+        return IncrementalResult(key, reports, reused_pdfs, state, stats, report_data)
+
+    def get_pdf_name(self, report_key: str) -> str:
+        """PDF output name of a report key, e.g. first_page_html -> first_page.pdf"""
+        return report_key[:-len('_html')] + '.pdf'
+
+    def save(self, result: IncrementalResult, outputs: Dict[str, bytes]):
+        """Store the run's state together with the PDFs rendered for it"""
+        for report_key, document in result.state['documents'].items():
+            document['pdf'] = outputs.get(self.get_pdf_name(report_key))
+        result.state['combined_pdf'] = outputs.get('combined_report.pdf')
+        self.store.save(result.key, result.state)
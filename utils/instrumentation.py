@@ -0,0 +1,238 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+# Run that stages record into, and the workbook they are attributed to.
+# Context variables keep concurrent Streamlit sessions apart.
+_active_run = contextvars.ContextVar('performance_run', default=None)
+_current_workbook = contextvars.ContextVar('performance_workbook', default=None)
+
+def current_rss() -> Optional[int]:
+    """Resident set size of this process in bytes, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class StageRecord:
+    """Timing, size and memory figures of one stage invocation"""
+
+    __slots__ = ('stage', 'workbook', 'detail', 'seconds', 'bytes_in', 'bytes_out', 'rows', 'rss_delta')
+
+    def __init__(self, stage: str, workbook: Optional[str] = None, detail: Optional[str] = None,
+                 bytes_in: Optional[int] = None, rows: Optional[int] = None):
+        self.stage = stage
+        self.workbook = workbook
+        self.detail = detail
+        self.seconds = 0.0
+        self.bytes_in = bytes_in
+        self.bytes_out = None
+        self.rows = rows
+        self.rss_delta = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, values: Dict[str, Any]) -> 'StageRecord':
+        record = cls(values['stage'])
+        for name in cls.__slots__:
+            setattr(record, name, values.get(name))
+        return record
+
+class PerformanceRun:
+    """Stage records collected over one processing run"""
+
+    def __init__(self):
+        self.started = datetime.now()
+        self.records: List[StageRecord] = []
+        self._lock = threading.Lock()
+
+    def add(self, record: StageRecord):
+        with self._lock:
+            self.records.append(record)
+
+    def extend(self, records: List[Dict[str, Any]], workbook: Optional[str] = None):
+        """Add records returned by another process, attributing unlabelled ones to a workbook"""
+        for values in records:
+            record = StageRecord.from_dict(values)
+            record.workbook = record.workbook or workbook
+            self.add(record)
+
+    def clear(self):
+        with self._lock:
+            self.records = []
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Per workbook and stage totals, in the order stages first ran"""
+        totals = {}
+        with self._lock:
+            records = list(self.records)
+
+        for record in records:
+            key = (record.workbook or '', record.stage)
+            total = totals.setdefault(key, {
+                'workbook': record.workbook or '',
+                'stage': record.stage,
+                'calls': 0,
+                'seconds': 0.0,
+                'bytes_in': 0,
+                'bytes_out': 0,
+                'rows': 0,
+                'rss_delta': 0
+            })
+            total['calls'] += 1
+            total['seconds'] += record.seconds
+            for field in ('bytes_in', 'bytes_out', 'rows', 'rss_delta'):
+                total[field] += getattr(record, field) or 0
+
+        for total in totals.values():
+            total['seconds'] = round(total['seconds'], 6)
+        return list(totals.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            records = [record.to_dict() for record in self.records]
+        return {
+            'started': self.started.isoformat(timespec='seconds'),
+            'summary': self.summary(),
+            'records': records
+        }
+
+    def to_json(self, indent: Optional[int] = 2) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_prometheus(self, prefix: str = 'bill_generator') -> str:
+        """Export per workbook and stage totals in the Prometheus text exposition format"""
+        metrics = [
+            ('stage_calls_total', 'calls', 'counter', 'Number of times a stage ran'),
+            ('stage_seconds_total', 'seconds', 'counter', 'Wall time spent in a stage'),
+            ('stage_bytes_in_total', 'bytes_in', 'counter', 'Bytes read by a stage'),
+            ('stage_bytes_out_total', 'bytes_out', 'counter', 'Bytes produced by a stage'),
+            ('stage_rows_total', 'rows', 'counter', 'Rows handled by a stage'),
+            ('stage_rss_delta_bytes', 'rss_delta', 'gauge', 'Change in resident memory over a stage'),
+        ]
+        summary = self.summary()
+
+        lines = []
+        for name, field, metric_type, description in metrics:
+            lines.append(f"# HELP {prefix}_{name} {description}")
+            lines.append(f"# TYPE {prefix}_{name} {metric_type}")
+            for total in summary:
+                labels = f'stage="{self.escape_label(total["stage"])}",workbook="{self.escape_label(total["workbook"])}"'
+                lines.append(f"{prefix}_{name}{{{labels}}} {total[field]}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def escape_label(value: str) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def get_active_run() -> Optional[PerformanceRun]:
+    """Run stages currently record into, if any"""
+    return _active_run.get()
+
+@contextmanager
+def recording(run: Optional[PerformanceRun] = None):
+    """Record the stages run inside the block into a (new or existing) PerformanceRun"""
+    run = run if run is not None else PerformanceRun()
+    token = _active_run.set(run)
+    try:
+        yield run
+    finally:
+        _active_run.reset(token)
+
+def current_workbook() -> Optional[str]:
+    """Workbook stages are currently attributed to, if any"""
+    return _current_workbook.get()
+
+@contextmanager
+def workbook(name: Optional[str]):
+    """Attribute the stages run inside the block to a workbook (None keeps the current one)"""
+    token = _current_workbook.set(name if name is not None else _current_workbook.get())
+    try:
+        yield
+    finally:
+        _current_workbook.reset(token)
+
+@contextmanager
+def stage(name: str, detail: Optional[str] = None, bytes_in: Optional[int] = None, rows: Optional[int] = None):
+    """Time a block as a stage; the yielded record's bytes_out and rows may be filled in
+
+    Nothing is measured unless a run is being recorded.
+    """
+    run = _active_run.get()
+    record = StageRecord(name, _current_workbook.get(), detail, bytes_in, rows)
+    if run is None:
+        yield record
+        return
+
+    rss_before = current_rss()
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.seconds = time.perf_counter() - started
+        rss_after = current_rss()
+        if rss_before is not None and rss_after is not None:
+            record.rss_delta = rss_after - rss_before
+        run.add(record)
+
+def output_size(result) -> Optional[int]:
+    """Size in bytes of a str/bytes result, or of a dict whose values are all str/bytes"""
+    if isinstance(result, (bytes, bytearray)):
+        return len(result)
+    if isinstance(result, str):
+        return len(result.encode())
+    if isinstance(result, dict) and result and all(isinstance(value, (str, bytes, bytearray)) for value in result.values()):
+        return sum(output_size(value) for value in result.values())
+    return None
+
+def call_hook(hook: Callable, result, args, kwargs):
+    """Call a detail/bytes_in/rows hook; a failing hook leaves its field unset rather than failing the call"""
+    try:
+        return hook(result, *args, **kwargs)
+    except Exception:
+        return None
+
+def instrumented(name: str, detail: Optional[Callable] = None, bytes_in: Optional[Callable] = None,
+                 rows: Optional[Callable] = None):
+    """Decorator recording each call as a stage
+
+    detail, bytes_in and rows are called as f(result, *args, **kwargs) once
+    the call returns, with the arguments bound to the function's signature
+    so parameters given by keyword arrive in position too; bytes_out is
+    taken from the size of the result.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active_run.get() is None:
+                return func(*args, **kwargs)
+
+            with stage(name) as record:
+                result = func(*args, **kwargs)
+                record.bytes_out = output_size(result)
+                try:
+                    bound = signature.bind(*args, **kwargs)
+                    args, kwargs = bound.args, bound.kwargs
+                except TypeError:
+                    pass
+                if detail:
+                    record.detail = call_hook(detail, result, args, kwargs)
+                if bytes_in:
+                    record.bytes_in = call_hook(bytes_in, result, args, kwargs)
+                if rows:
+                    record.rows = call_hook(rows, result, args, kwargs)
+                return result
+        return wrapper
+    return decorator
@@ -0,0 +1,251 @@
+from typing import Any, Dict, Iterator, Tuple
+
+class ItemRecord:
+    """Compact item record with __slots__, readable by attribute (templates) or like a dict
+
+    Records are treated as read-only; merged and deviation items are views
+    that derive their values from the parsed rows instead of copying them.
+    """
+
+    __slots__ = ()
+
+    # Field names the record exposes, in dict order
+    fields: Tuple[str, ...] = ()
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.fields:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key) if key in self.fields else default
+
+    def keys(self) -> Tuple[str, ...]:
+        return self.fields
+
+    def values(self):
+        return [getattr(self, field) for field in self.fields]
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in self.fields]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.fields)
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def __contains__(self, key) -> bool:
+        return key in self.fields
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (ItemRecord, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+class WorkOrderItem(ItemRecord):
+    """Parsed row of the Work Order sheet"""
+
+    __slots__ = ('serial_no', 'description', 'unit', 'quantity', 'rate', 'amount', 'remark')
+    fields = __slots__
+
+    def __init__(self, serial_no='', description='', unit='', quantity=0, rate=0, amount=0, remark=''):
+        self.serial_no = serial_no
+        self.description = description
+        self.unit = unit
+        self.quantity = quantity
+        self.rate = rate
+        self.amount = amount
+        self.remark = remark
+
+    @classmethod
+    def from_dict(cls, values: Dict[str, Any]) -> 'ItemRecord':
+        return cls(*(values.get(field, default) for field, default in zip(cls.fields, cls.__init__.__defaults__)))
+
+class ExtraItem(WorkOrderItem):
+    """Parsed row of the Extra Items sheet"""
+
+    __slots__ = ()
+
+class BillQuantityItem(ItemRecord):
+    """Parsed row of the Bill Quantity sheet"""
+
+    __slots__ = ('serial_no', 'description', 'unit', 'quantity_bill', 'rate', 'amount_bill', 'remark')
+    fields = __slots__
+
+    def __init__(self, serial_no='', description='', unit='', quantity_bill=0, rate=0, amount_bill=0, remark=''):
+        self.serial_no = serial_no
+        self.description = description
+        self.unit = unit
+        self.quantity_bill = quantity_bill
+        self.rate = rate
+        self.amount_bill = amount_bill
+        self.remark = remark
+
+    from_dict = WorkOrderItem.__dict__['from_dict']
+
+def as_record(item, record_class):
+    """Use a record as-is, converting plain dicts from older callers"""
+    return item if isinstance(item, ItemRecord) else record_class.from_dict(item)
+
+class MergedItem(ItemRecord):
+    """Work order row joined with its bill quantity row (if any), as a view over both"""
+
+    __slots__ = ('work_order', 'bill')
+    fields = ('serial_no', 'description', 'unit', 'quantity_wo', 'rate', 'amount_wo',
+              'quantity_bill', 'amount_bill', 'remark')
+
+    def __init__(self, work_order: WorkOrderItem, bill: BillQuantityItem = None):
+        self.work_order = work_order
+        self.bill = bill
+
+    def __reduce__(self):
+        return (MergedItem, (self.work_order, self.bill))
+
+    @classmethod
+    def from_dict(cls, values: Dict[str, Any]) -> 'MergedItem':
+        return cls(
+            WorkOrderItem(values.get('serial_no', ''), values.get('description', ''), values.get('unit', ''),
+                          values.get('quantity_wo', 0), values.get('rate', 0), values.get('amount_wo', 0),
+                          values.get('remark', '')),
+            BillQuantityItem(quantity_bill=values.get('quantity_bill', 0), amount_bill=values.get('amount_bill', 0))
+        )
+
+    @property
+    def serial_no(self):
+        return self.work_order.serial_no
+
+    @property
+    def description(self):
+        return self.work_order.description
+
+    @property
+    def unit(self):
+        return self.work_order.unit
+
+    @property
+    def quantity_wo(self):
+        return self.work_order.quantity
+
+    @property
+    def rate(self):
+        return self.work_order.rate
+
+    @property
+    def amount_wo(self):
+        return self.work_order.amount
+
+    @property
+    def quantity_bill(self):
+        return self.bill.quantity_bill if self.bill is not None else 0
+
+    @property
+    def amount_bill(self):
+        return self.bill.amount_bill if self.bill is not None else 0
+
+    @property
+    def remark(self):
+        return self.work_order.remark
+
+class DeviationItem(ItemRecord):
+    """Deviation (excess / saving) of a merged item, derived on access"""
+
+    __slots__ = ('merged',)
+    fields = ('serial_no', 'description', 'unit', 'qty_wo', 'rate', 'amt_wo', 'qty_bill', 'amt_bill',
+              'excess_qty', 'excess_amt', 'saving_qty', 'saving_amt', 'remark')
+
+    def __init__(self, merged: MergedItem):
+        self.merged = merged
+
+    def __reduce__(self):
+        return (DeviationItem, (self.merged,))
+
+    @property
+    def serial_no(self):
+        return self.merged.serial_no
+
+    @property
+    def description(self):
+        return self.merged.description
+
+    @property
+    def unit(self):
+        return self.merged.unit
+
+    @property
+    def qty_wo(self):
+        return self.merged.quantity_wo
+
+    @property
+    def rate(self):
+        return self.merged.rate
+
+    @property
+    def amt_wo(self):
+        return self.merged.amount_wo
+
+    @property
+    def qty_bill(self):
+        return self.merged.quantity_bill
+
+    @property
+    def amt_bill(self):
+        return self.merged.amount_bill
+
+    @property
+    def excess_qty(self):
+        qty_bill, qty_wo = self.merged.quantity_bill, self.merged.quantity_wo
+        return qty_bill - qty_wo if qty_bill > qty_wo else 0
+
+    @property
+    def excess_amt(self):
+        excess_qty = self.excess_qty
+        return excess_qty * self.merged.rate if excess_qty else 0
+
+    @property
+    def saving_qty(self):
+        qty_bill, qty_wo = self.merged.quantity_bill, self.merged.quantity_wo
+        return 0 if qty_bill > qty_wo else qty_wo - qty_bill
+
+    @property
+    def saving_amt(self):
+        qty_bill, qty_wo = self.merged.quantity_bill, self.merged.quantity_wo
+        return 0 if qty_bill > qty_wo else (qty_wo - qty_bill) * self.merged.rate
+
+    @property
+    def remark(self):
+        return self.merged.remark
+
+class ExtraDeviationItem(ItemRecord):
+    """Extra item as a deviation statement row: all of it executed and in excess"""
+
+    __slots__ = ('extra',)
+    fields = DeviationItem.fields
+
+    def __init__(self, extra: ExtraItem):
+        self.extra = extra
+
+    def __reduce__(self):
+        return (ExtraDeviationItem, (self.extra,))
+
+    serial_no = property(lambda self: self.extra.serial_no)
+    description = property(lambda self: self.extra.description)
+    unit = property(lambda self: self.extra.unit)
+    qty_wo = property(lambda self: 0)
+    rate = property(lambda self: self.extra.rate)
+    amt_wo = property(lambda self: 0)
+    qty_bill = property(lambda self: self.extra.quantity)
+    amt_bill = property(lambda self: self.extra.amount)
+    excess_qty = property(lambda self: self.extra.quantity)
+    excess_amt = property(lambda self: self.extra.amount)
+    saving_qty = property(lambda self: 0)
+    saving_amt = property(lambda self: 0)
+    remark = property(lambda self: self.extra.remark)
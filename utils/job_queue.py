@@ -0,0 +1,321 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .bill_pipeline import BillPipeline, LoadedWorkbook, WorkbookFile
+from .batch_scheduler import BatchScheduler
+from . import instrumentation
+
+DEFAULT_JOB_DIR = Path(os.environ.get(
+    'BILL_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache')
+)) / 'jobs'
+
+# Jobs run at once; each renders its PDFs on the pipeline's own process pool
+DEFAULT_JOB_WORKERS = int(os.environ.get('BILL_JOB_WORKERS', 2))
+
+# Finished jobs (and their outputs) are kept this long
+DEFAULT_JOB_RETENTION = timedelta(days=7)
+
+# Job and file states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    options TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status);
+CREATE TABLE IF NOT EXISTS job_files (
+    job_id TEXT NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    current TEXT,
+    documents_done INTEGER NOT NULL DEFAULT 0,
+    documents_total INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (job_id, position)
+);
+"""
+
+FILE_FIELDS = ('position', 'filename', 'status', 'current', 'documents_done', 'documents_total', 'error')
+
+class JobStore:
+    """Job table (SQLite) and the workbooks and outputs of each job on disk"""
+
+    def __init__(self, job_dir: Optional[Path] = None):
+        self.job_dir = Path(job_dir) if job_dir else DEFAULT_JOB_DIR
+        self.path = self.job_dir / 'jobs.sqlite3'
+        self._initialised = False
+
+    def connect(self) -> sqlite3.Connection:
+        """Open a connection; one per call keeps the store safe across the worker threads"""
+        if not self._initialised:
+            self.job_dir.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute('PRAGMA foreign_keys = ON')
+        if not self._initialised:
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.executescript(SCHEMA)
+            self._initialised = True
+        return connection
+
+    def get_job_path(self, job_id: str) -> Path:
+        return self.job_dir / job_id
+
+    def get_input_path(self, job_id: str, position: int, filename: str) -> Path:
+        return self.get_job_path(job_id) / 'input' / str(position) / filename
+
+    def get_output_dir(self, job_id: str, position: int) -> Path:
+        return self.get_job_path(job_id) / 'output' / str(position)
+
+    def create_job(self, files: List[Tuple[str, bytes]], options: Dict[str, Any]) -> str:
+        """Store the workbooks of a new job and queue it; returns the job id"""
+        job_id = uuid.uuid4().hex
+        for position, (filename, content) in enumerate(files):
+            path = self.get_input_path(job_id, position, os.path.basename(filename))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(content)
+
+        now = datetime.now().isoformat(timespec='seconds')
+        with closing(self.connect()) as connection, connection:
+            connection.execute(
+                'INSERT INTO jobs (id, status, options, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (job_id, QUEUED, json.dumps(options), now, now)
+            )
+            connection.executemany(
+                'INSERT INTO job_files (job_id, position, filename, status) VALUES (?, ?, ?, ?)',
+                [(job_id, position, os.path.basename(filename), QUEUED) for position, (filename, _) in enumerate(files)]
+            )
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """A job with its options and the progress of each of its files, or None if unknown"""
+        with closing(self.connect()) as connection:
+            row = connection.execute(
+                'SELECT id, status, options, created_at, updated_at, error FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            files = connection.execute(
+                f"SELECT {', '.join(FILE_FIELDS)} FROM job_files WHERE job_id = ? ORDER BY position", (job_id,)
+            ).fetchall()
+
+        job = dict(zip(('id', 'status', 'options', 'created_at', 'updated_at', 'error'), row))
+        job['options'] = json.loads(job['options'])
+        job['files'] = [dict(zip(FILE_FIELDS, values)) for values in files]
+        return job
+
+    def get_unfinished_jobs(self) -> List[str]:
+        with closing(self.connect()) as connection:
+            rows = connection.execute(
+                'SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created_at', (QUEUED, RUNNING)
+            ).fetchall()
+        return [job_id for job_id, in rows]
+
+    def update_job(self, job_id: str, status: str, error: Optional[str] = None):
+        with closing(self.connect()) as connection, connection:
+            connection.execute(
+                'UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?',
+                (status, error, datetime.now().isoformat(timespec='seconds'), job_id)
+            )
+
+    def update_file(self, job_id: str, position: int, **fields):
+        """Update the progress fields (status, current, documents_done, ...) of one file of a job"""
+        assignments = ', '.join(f"{field} = ?" for field in fields if field in FILE_FIELDS)
+        with closing(self.connect()) as connection, connection:
+            connection.execute(
+                f"UPDATE job_files SET {assignments} WHERE job_id = ? AND position = ?",
+                [value for field, value in fields.items() if field in FILE_FIELDS] + [job_id, position]
+            )
+            connection.execute(
+                'UPDATE jobs SET updated_at = ? WHERE id = ?', (datetime.now().isoformat(timespec='seconds'), job_id)
+            )
+
+    def save_outputs(self, job_id: str, position: int, outputs: Dict[str, bytes]):
+        """Write a file's outputs, with their order, next to the job's workbooks"""
+        output_dir = self.get_output_dir(job_id, position)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for output_name, data in outputs.items():
+            (output_dir / output_name).write_bytes(data)
+        (output_dir / 'outputs.json').write_text(json.dumps(list(outputs)))
+
+    def load_outputs(self, job_id: str, position: int) -> Dict[str, bytes]:
+        output_dir = self.get_output_dir(job_id, position)
+        try:
+            names = json.loads((output_dir / 'outputs.json').read_text())
+            return {output_name: (output_dir / output_name).read_bytes() for output_name in names}
+        except Exception as e:
+            print(f"Error reading outputs of job {job_id}: {str(e)}")
+            return {}
+
+    def save_performance(self, job_id: str, run: instrumentation.PerformanceRun):
+        (self.get_job_path(job_id) / 'performance.json').write_text(run.to_json())
+
+    def load_performance(self, job_id: str) -> List[Dict[str, Any]]:
+        try:
+            return json.loads((self.get_job_path(job_id) / 'performance.json').read_text())['records']
+        except Exception:
+            return []
+
+    def purge(self, retention: timedelta = DEFAULT_JOB_RETENTION):
+        """Delete finished jobs last updated longer ago than retention, with their files"""
+        cutoff = (datetime.now() - retention).isoformat(timespec='seconds')
+        with closing(self.connect()) as connection, connection:
+            job_ids = [job_id for job_id, in connection.execute(
+                'SELECT id FROM jobs WHERE status IN (?, ?) AND updated_at < ?', (DONE, FAILED, cutoff)
+            )]
+            connection.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in job_ids])
+        for job_id in job_ids:
+            shutil.rmtree(self.get_job_path(job_id), ignore_errors=True)
+
+class JobQueue:
+    """Runs submitted batches on a background thread pool, off the Streamlit script thread
+
+    Progress is written to the JobStore per file and per rendered document,
+    so any page can poll a job by its id, and jobs left unfinished by a
+    server restart can be resumed from the files not yet done. With a batch
+    scheduler, jobs of several workbooks run them in parallel on its worker
+    processes instead, which report their rendered documents back the same way.
+    """
+
+    def __init__(self, pipeline_factory: Callable[[Dict[str, Any]], BillPipeline],
+                 store: Optional[JobStore] = None, max_workers: Optional[int] = None,
+                 scheduler: Optional[BatchScheduler] = None):
+        # Builds the pipeline for a job from the options it was submitted with
+        self.pipeline_factory = pipeline_factory
+        self.store = store or JobStore()
+        self.scheduler = scheduler
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or DEFAULT_JOB_WORKERS,
+                                           thread_name_prefix='bill-job')
+        self._active = set()
+        self._lock = threading.Lock()
+
+    def submit(self, files: List[Tuple[str, bytes]], options: Optional[Dict[str, Any]] = None) -> str:
+        """Queue (filename, workbook bytes) files for processing; returns the job id"""
+        job_id = self.store.create_job(files, options or {})
+        self.start(job_id)
+        return job_id
+
+    def start(self, job_id: str):
+        with self._lock:
+            if job_id in self._active:
+                return
+            self._active.add(job_id)
+        self.executor.submit(self.run_job, job_id)
+
+    def resume_unfinished(self):
+        """Queue again the jobs a previous server process left queued or running"""
+        for job_id in self.store.get_unfinished_jobs():
+            self.start(job_id)
+
+    def run_job(self, job_id: str):
+        try:
+            job = self.store.get_job(job_id)
+            if job is None:
+                return
+            self.store.update_job(job_id, RUNNING)
+
+            pending = [file for file in job['files'] if file['status'] != DONE]
+            with instrumentation.recording() as run:
+                if self.can_schedule(job['options'], pending):
+                    self.run_files_scheduled(job_id, pending, job['options'], run)
+                else:
+                    pipeline = self.pipeline_factory(job['options'])
+                    uploads = (
+                        WorkbookFile(self.store.get_input_path(job_id, file['position'], file['filename']))
+                        for file in pending
+                    )
+                    # Upcoming workbooks are parsed while earlier ones render
+                    for loaded, file in zip(pipeline.load_ahead(uploads, job['options'].get('use_cache', True)), pending):
+                        self.run_file(job_id, file, pipeline, loaded)
+            self.store.save_performance(job_id, run)
+
+            files = self.store.get_job(job_id)['files']
+            failed = [file['filename'] for file in files if file['status'] == FAILED]
+            if failed and len(failed) == len(files):
+                self.store.update_job(job_id, FAILED, "Every workbook failed")
+            else:
+                self.store.update_job(job_id, DONE)
+        except Exception as e:
+            print(f"Error running job {job_id}: {str(e)}")
+            self.store.update_job(job_id, FAILED, str(e))
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+
+    def run_file(self, job_id: str, file: Dict[str, Any], pipeline: BillPipeline, loaded: LoadedWorkbook):
+        """Render one parsed workbook of a job, recording each rendered document as progress"""
+        position = file['position']
+        self.store.update_file(job_id, position, status=RUNNING, current='reports', documents_done=0, error=None)
+
+        def progress(output_name, rendered, total):
+            self.store.update_file(job_id, position, current=output_name, documents_done=rendered,
+                                   documents_total=total)
+
+        try:
+            outputs = pipeline.finish_workbook(loaded, progress)
+            self.store.save_outputs(job_id, position, outputs)
+            self.store.update_file(job_id, position, status=DONE, current=None)
+        except Exception as e:
+            self.store.update_file(job_id, position, status=FAILED, current=None, error=str(e))
+
+    def can_schedule(self, options: Dict[str, Any], files: List[Dict[str, Any]]) -> bool:
+        """Whether a job's files can run in parallel on the batch scheduler
+
+        Ledger jobs stay in order, each bill following the one before it.
+        """
+        return (self.scheduler is not None and len(files) > 1 and options.get('parallel_workbooks', True)
+                and not options.get('ledger'))
+
+    def run_files_scheduled(self, job_id: str, files: List[Dict[str, Any]], options: Dict[str, Any],
+                            run: instrumentation.PerformanceRun):
+        """Process files of a job at once on the scheduler's workers, recording their progress and each as it finishes
+
+        The job's max_workers caps how many of its workbooks run at once.
+        """
+        paths = {}
+        for file in files:
+            paths[self.store.get_input_path(job_id, file['position'], file['filename'])] = file
+            self.store.update_file(job_id, file['position'], status=RUNNING, current='reports', documents_done=0,
+                                   error=None)
+
+        scheduler_options = {
+            'use_cache': options.get('use_cache', True),
+            'incremental': options.get('incremental', False),
+            'pdf_engine': options.get('pdf_engine')
+        }
+        def progress(path, output_name, rendered, total):
+            self.store.update_file(job_id, paths[path]['position'], current=output_name, documents_done=rendered,
+                                   documents_total=total)
+
+        for path, entry in self.scheduler.run(paths, scheduler_options, max_in_flight=options.get('max_workers'),
+                                              progress=progress):
+            file = paths[path]
+            run.extend(entry.get('performance', {}).get('records', []), file['filename'])
+            if entry['status'] != 'ok':
+                self.store.update_file(job_id, file['position'], status=FAILED, current=None, error=entry['error'])
+                continue
+            try:
+                self.store.save_outputs(job_id, file['position'], entry['output_data'])
+                documents = sum(1 for output_name in entry['outputs'] if output_name.endswith('.pdf'))
+                self.store.update_file(job_id, file['position'], status=DONE, current=None,
+                                       documents_done=documents, documents_total=documents)
+            except Exception as e:
+                self.store.update_file(job_id, file['position'], status=FAILED, current=None, error=str(e))
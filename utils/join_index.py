@@ -0,0 +1,165 @@
+import re
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Integral serials read as floats ("1.0") match their text form ("1")
+INTEGRAL_SERIAL = re.compile(r'^([+-]?\d+)\.0+$')
+
+# Cell text that stands for an empty serial number
+BLANK_SERIALS = ('', 'nan', 'none')
+
+def normalize_serial(serial_no: Any) -> str:
+    """Join key of a serial number: trimmed, case-folded, with "1.0" read as "1"; '' when blank"""
+    if serial_no is None:
+        return ''
+    key = ' '.join(str(serial_no).split()).casefold()
+    if key in BLANK_SERIALS:
+        return ''
+    if key.endswith('0') and '.' in key:
+        match = INTEGRAL_SERIAL.match(key)
+        if match:
+            key = str(int(match.group(1)))
+    return key
+
+class SerialIndex:
+    """Multi-map from normalized serial number to the positions of the rows carrying it"""
+
+    def __init__(self, items: Sequence):
+        self.positions = defaultdict(list)
+        self.blank = []
+        for position, item in enumerate(items):
+            key = normalize_serial(item.get('serial_no', ''))
+            if key:
+                self.positions[key].append(position)
+            else:
+                self.blank.append(position)
+
+class JoinDiagnostics:
+    """What joining work order rows to bill quantity rows by serial number left unresolved
+
+    Positions are 0-based indexes into the parsed item lists.
+    - unmatched: positions of work order rows without a bill quantity row
+      (not billed yet); kept as bare positions since most rows of a large
+      schedule can be unbilled
+    - orphaned: bill quantity rows without a work order row, which no report shows
+    - duplicates: serial numbers carried by more than one row of a sheet
+    """
+
+    def __init__(self):
+        self.unmatched: List[int] = []
+        self.orphaned: List[Dict[str, Any]] = []
+        self.duplicates: List[Dict[str, Any]] = []
+
+    @property
+    def has_warnings(self) -> bool:
+        """Whether bill rows were dropped or serial numbers repeat; unmatched rows alone are normal"""
+        return bool(self.orphaned or self.duplicates)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'unmatched': self.unmatched,
+            'orphaned': self.orphaned,
+            'duplicates': self.duplicates,
+            'has_warnings': self.has_warnings
+        }
+
+    def summary(self) -> str:
+        """One line per warning, for logs"""
+        return '\n'.join(warning_lines(self.to_dict()))
+
+def warning_lines(diagnostics: Dict[str, Any]) -> List[str]:
+    """Describe the orphaned rows and duplicate serials of join diagnostics (as to_dict returns them)"""
+    lines = []
+    for row in diagnostics.get('orphaned', ()):
+        lines.append(f"Bill Quantity row {row['position'] + 1} ({row['serial_no'] or 'blank'}): "
+                     f"{row['reason']}, not included in the reports")
+    for duplicate in diagnostics.get('duplicates', ()):
+        rows = ', '.join(str(position + 1) for position in duplicate['positions'])
+        lines.append(f"{duplicate['sheet']} serial number {duplicate['serial_no']} repeated in rows {rows}")
+    return lines
+
+class JoinedItems(list):
+    """Merged items returned by merge_work_order_and_bill_data, with the diagnostics of their join"""
+
+    def __init__(self, items=(), diagnostics: Optional[JoinDiagnostics] = None):
+        super().__init__(items)
+        self.diagnostics = diagnostics or JoinDiagnostics()
+
+    def __reduce__(self):
+        return (JoinedItems, (list(self), self.diagnostics))
+
+def pair_with_previous(items: Sequence, previous_rows: Dict[str, List[Any]]) -> List[Optional[Any]]:
+    """Each item's row in an earlier bill, or None
+
+    previous_rows maps normalized serial numbers to the earlier bill's rows
+    in sheet order; rows sharing a serial number pair up in order, as in
+    join_by_serial.
+    """
+    claimed = defaultdict(int)
+    matches = []
+    for item in items:
+        key = normalize_serial(item.get('serial_no', ''))
+        rows = previous_rows.get(key) if key else None
+        occurrence = claimed[key]
+        if rows and occurrence < len(rows):
+            claimed[key] = occurrence + 1
+            matches.append(rows[occurrence])
+        else:
+            matches.append(None)
+    return matches
+
+def join_by_serial(work_order_items: Sequence, bill_items: Sequence) -> Tuple[List[Optional[Any]], JoinDiagnostics]:
+    """Match each work order row with its bill quantity row by normalized serial number
+
+    Both sheets are indexed once, so the join stays linear in the number of
+    rows. Rows sharing a serial number pair up in order: the n-th work
+    order row of a serial gets its n-th bill quantity row. Blank serials
+    never match.
+
+    Returns the matched bill item (or None) for each work order row, in
+    order, and the diagnostics of the join.
+    """
+    bill_index = SerialIndex(bill_items)
+    diagnostics = JoinDiagnostics()
+
+    matches = []
+    claimed = defaultdict(int)
+    work_order_positions = defaultdict(list)
+    bill_positions = bill_index.positions
+    for position, wo_item in enumerate(work_order_items):
+        key = normalize_serial(wo_item.get('serial_no', ''))
+        candidates = bill_positions.get(key) if key else None
+        if key:
+            work_order_positions[key].append(position)
+
+        if candidates:
+            occurrence = claimed[key]
+            if occurrence < len(candidates):
+                claimed[key] = occurrence + 1
+                matches.append(bill_items[candidates[occurrence]])
+                continue
+        matches.append(None)
+        diagnostics.unmatched.append(position)
+
+    orphaned = [(position, 'blank serial number') for position in bill_index.blank]
+    for key, positions in bill_positions.items():
+        used = claimed.get(key, 0)
+        if used < len(positions):
+            reason = 'more rows than the Work Order has' if key in work_order_positions else 'no Work Order row'
+            orphaned.extend((position, reason) for position in positions[used:])
+    diagnostics.orphaned = [
+        {'position': position, 'serial_no': bill_items[position].get('serial_no', ''), 'reason': reason}
+        for position, reason in orphaned
+    ]
+    diagnostics.orphaned.sort(key=lambda row: row['position'])
+
+    for sheet, positions_by_key in (('Work Order', work_order_positions), ('Bill Quantity', bill_positions)):
+        for key, positions in positions_by_key.items():
+            if len(positions) > 1:
+                diagnostics.duplicates.append({
+                    'sheet': sheet,
+                    'serial_no': key,
+                    'positions': positions
+                })
+
+    return matches, diagnostics
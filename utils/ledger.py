@@ -0,0 +1,254 @@
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .join_index import normalize_serial
+from .money import to_paise, to_rupees
+from . import instrumentation
+
+DEFAULT_LEDGER_PATH = Path(os.environ.get(
+    'BILL_LEDGER_PATH',
+    os.path.join(os.environ.get(
+        'BILL_CACHE_DIR',
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache')
+    ), 'ledger.sqlite3')
+))
+
+# Bump with a step in BillLedger.migrate when the tables change
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bills (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    agreement_no TEXT NOT NULL,
+    bill_key TEXT NOT NULL,
+    bill_date TEXT,
+    recorded_at TEXT NOT NULL,
+    payable_paise INTEGER NOT NULL,
+    net_payable_paise INTEGER NOT NULL,
+    UNIQUE (agreement_no, bill_key)
+);
+CREATE INDEX IF NOT EXISTS idx_bills_agreement ON bills (agreement_no, id);
+CREATE TABLE IF NOT EXISTS bill_items (
+    bill_id INTEGER NOT NULL REFERENCES bills (id) ON DELETE CASCADE,
+    agreement_no TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    serial_no TEXT NOT NULL,
+    serial_key TEXT NOT NULL,
+    quantity REAL NOT NULL,
+    amount_paise INTEGER NOT NULL,
+    PRIMARY KEY (bill_id, kind, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_bill_items_agreement_serial_key ON bill_items (agreement_no, serial_key, bill_id);
+"""
+
+# Measurement date formats a bill key is read with to order an agreement's bills
+BILL_DATE_FORMATS = ('%d/%m/%Y', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%d-%m-%Y', '%d.%m.%Y', '%m/%d/%Y')
+
+# Order of an agreement's bills: by measurement date, then by when they were first recorded.
+# Bills without a readable date come before the dated ones.
+BILL_SORT_KEY = "(COALESCE(bill_date, ''), id)"
+
+def parse_bill_date(bill_key: str) -> Optional[str]:
+    """ISO date of a bill key that is a measurement date, or None"""
+    for date_format in BILL_DATE_FORMATS:
+        try:
+            return datetime.strptime(bill_key.strip(), date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+# Item kinds: bill quantity rows and extra items
+BILL_ITEM = 'bill'
+EXTRA_ITEM = 'extra'
+
+class BillLedger:
+    """SQLite ledger of the running bills generated for each agreement
+
+    Every bill records its up-to-date item quantities and amounts and its
+    payable amount, so the next bill of the agreement can show the amount
+    paid vide the last bill and the quantities executed since it without
+    the earlier workbooks. A bill is identified within its agreement by its
+    measurement date (or file name), so regenerating a bill replaces its
+    entry instead of making it its own previous bill. Bills follow each
+    other in measurement date order, whatever order they were processed in.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path) if path else DEFAULT_LEDGER_PATH
+        self._initialised = False
+
+    def connect(self) -> sqlite3.Connection:
+        """Open a connection; one per call keeps the ledger safe across threads and worker processes"""
+        if not self._initialised:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute('PRAGMA foreign_keys = ON')
+        if not self._initialised:
+            connection.execute('PRAGMA journal_mode = WAL')
+            self.migrate(connection)
+            connection.executescript(SCHEMA)
+            connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self._initialised = True
+        return connection
+
+    def migrate(self, connection: sqlite3.Connection):
+        """Bring a ledger written by an earlier version up to the current tables, in one transaction"""
+        connection.create_function('parse_bill_date', 1, parse_bill_date, deterministic=True)
+        connection.create_function('normalize_serial', 1, normalize_serial, deterministic=True)
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+            has_bills = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'bills'").fetchone()
+            if has_bills and version < 2:
+                # Version 1 ordered bills by insertion and keyed items by serial number,
+                # which kept only one of the rows sharing a serial
+                connection.execute('ALTER TABLE bills ADD COLUMN bill_date TEXT')
+                connection.execute('UPDATE bills SET bill_date = parse_bill_date(bill_key)')
+                connection.execute('ALTER TABLE bill_items RENAME TO bill_items_v1')
+                connection.execute('DROP INDEX IF EXISTS idx_bill_items_agreement_serial')
+                for statement in SCHEMA.split(';'):
+                    if statement.strip():
+                        connection.execute(statement)
+                connection.execute(
+                    'INSERT INTO bill_items (bill_id, agreement_no, kind, position, serial_no, serial_key, quantity, amount_paise) '
+                    'SELECT bill_id, agreement_no, kind, '
+                    'ROW_NUMBER() OVER (PARTITION BY bill_id, kind ORDER BY serial_no) - 1, '
+                    'serial_no, normalize_serial(serial_no), quantity, amount_paise FROM bill_items_v1'
+                )
+                connection.execute('DROP TABLE bill_items_v1')
+            elif has_bills and version < 3:
+                # Version 2 matched items across bills by their serial number as written
+                connection.execute("ALTER TABLE bill_items ADD COLUMN serial_key TEXT NOT NULL DEFAULT ''")
+                connection.execute('UPDATE bill_items SET serial_key = normalize_serial(serial_no)')
+                connection.execute('DROP INDEX IF EXISTS idx_bill_items_agreement_serial')
+            connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def get_bill_key(self, file_data: Dict[str, Any]) -> str:
+        """Identify a bill within its agreement: its measurement date, or the file name without one"""
+        title_data = file_data.get('title_data') or {}
+        return str(title_data.get('measurement_date') or '').strip() or file_data.get('filename', '')
+
+    def get_agreement_no(self, file_data: Dict[str, Any]) -> str:
+        return str((file_data.get('title_data') or {}).get('agreement_no') or '').strip()
+
+    def get_previous_bill(self, agreement_no: str, bill_key: str) -> Optional[Dict[str, Any]]:
+        """The agreement's bill before this one in measurement date order
+
+        Besides its items and payable amount, the previous bill carries its
+        number among the agreement's bills and its measurement date. Items
+        map each normalized serial number to its rows in sheet order, so
+        rows sharing a serial pair up in order like the work order join.
+        """
+        if not agreement_no:
+            return None
+
+        with closing(self.connect()) as connection:
+            own = connection.execute(
+                'SELECT id FROM bills WHERE agreement_no = ? AND bill_key = ?', (agreement_no, bill_key)
+            ).fetchone()
+            previous = connection.execute(
+                f'SELECT id, bill_key, bill_date, payable_paise FROM bills WHERE agreement_no = ? '
+                f"AND {BILL_SORT_KEY} < (?, ?) ORDER BY COALESCE(bill_date, '') DESC, id DESC LIMIT 1",
+                (agreement_no, parse_bill_date(bill_key) or '', own[0] if own else 2 ** 63 - 1)
+            ).fetchone()
+            if previous is None:
+                return None
+
+            bill_id, previous_key, bill_date, payable_paise = previous
+            bill_number = connection.execute(
+                f'SELECT COUNT(*) FROM bills WHERE agreement_no = ? AND {BILL_SORT_KEY} <= (?, ?)',
+                (agreement_no, bill_date or '', bill_id)
+            ).fetchone()[0]
+            items = {BILL_ITEM: {}, EXTRA_ITEM: {}}
+            for kind, serial_key, quantity, amount_paise in connection.execute(
+                'SELECT kind, serial_key, quantity, amount_paise FROM bill_items WHERE bill_id = ? ORDER BY kind, position',
+                (bill_id,)
+            ):
+                if serial_key:
+                    items[kind].setdefault(serial_key, []).append({'quantity': quantity, 'amount': to_rupees(amount_paise)})
+
+        return {
+            'bill_key': previous_key,
+            'bill_date': bill_date,
+            'bill_number': bill_number,
+            'payable_amount': to_rupees(payable_paise),
+            'items': items[BILL_ITEM],
+            'extra_items': items[EXTRA_ITEM]
+        }
+
+    def get_item_history(self, agreement_no: str, serial_no: str) -> List[Dict[str, Any]]:
+        """Up-to-date quantity and amount of the rows of one serial number in each recorded bill, earliest bill first"""
+        with closing(self.connect()) as connection:
+            rows = connection.execute(
+                'SELECT bills.bill_key, bill_items.kind, bill_items.quantity, bill_items.amount_paise '
+                'FROM bill_items JOIN bills ON bills.id = bill_items.bill_id '
+                'WHERE bill_items.agreement_no = ? AND bill_items.serial_key = ? '
+                "ORDER BY COALESCE(bills.bill_date, ''), bills.id, bill_items.position",
+                (agreement_no, normalize_serial(serial_no))
+            ).fetchall()
+        return [
+            {'bill_key': bill_key, 'kind': kind, 'quantity': quantity, 'amount': to_rupees(amount_paise)}
+            for bill_key, kind, quantity, amount_paise in rows
+        ]
+
+    def with_previous_bill(self, file_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Processed workbook data with the agreement's previous bill attached for the report generator"""
+        with instrumentation.stage('ledger_lookup') as record:
+            previous_bill = self.get_previous_bill(self.get_agreement_no(file_data), self.get_bill_key(file_data))
+            if previous_bill:
+                record.rows = sum(len(rows) for items in (previous_bill['items'], previous_bill['extra_items'])
+                                  for rows in items.values())
+                record.detail = previous_bill['bill_key']
+        return {**file_data, 'previous_bill': previous_bill}
+
+    def record_bill(self, file_data: Dict[str, Any], report_data) -> Optional[int]:
+        """Record (or replace) a generated bill's up-to-date items and totals; returns the bill id"""
+        agreement_no = self.get_agreement_no(file_data)
+        if not agreement_no:
+            return None
+
+        bill_items = report_data.get('bill_items') or []
+        extra_items = report_data.get('extra_items') or []
+        bill_amounts = to_paise([item.get('amount_bill', 0) or 0 for item in bill_items])
+        extra_amounts = to_paise([item.get('amount', 0) or 0 for item in extra_items])
+        payable_paise, net_payable_paise = (
+            int(paise) for paise in to_paise([
+                report_data['bill_grand_total'] + report_data['extra_items_sum'],
+                report_data['totals']['net_payable']
+            ])
+        )
+
+        with instrumentation.stage('ledger_record', rows=len(bill_items) + len(extra_items)):
+            bill_key = self.get_bill_key(file_data)
+            with closing(self.connect()) as connection, connection:
+                bill_id = connection.execute(
+                    'INSERT INTO bills (agreement_no, bill_key, bill_date, recorded_at, payable_paise, net_payable_paise) '
+                    'VALUES (?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (agreement_no, bill_key) DO UPDATE SET recorded_at = excluded.recorded_at, '
+                    'payable_paise = excluded.payable_paise, net_payable_paise = excluded.net_payable_paise '
+                    'RETURNING id',
+                    (agreement_no, bill_key, parse_bill_date(bill_key), datetime.now().isoformat(timespec='seconds'),
+                     payable_paise, net_payable_paise)
+                ).fetchone()[0]
+                # Rows are kept by their position in the sheet, so repeated serial numbers all stay
+                connection.execute('DELETE FROM bill_items WHERE bill_id = ?', (bill_id,))
+                connection.executemany(
+                    'INSERT INTO bill_items (bill_id, agreement_no, kind, position, serial_no, serial_key, quantity, amount_paise) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(bill_id, agreement_no, BILL_ITEM, position, str(item.get('serial_no', '')),
+                      normalize_serial(item.get('serial_no', '')), item.get('quantity_bill', 0) or 0, int(amount))
+                     for position, (item, amount) in enumerate(zip(bill_items, bill_amounts))] +
+                    [(bill_id, agreement_no, EXTRA_ITEM, position, str(item.get('serial_no', '')),
+                      normalize_serial(item.get('serial_no', '')), item.get('quantity', 0) or 0, int(amount))
+                     for position, (item, amount) in enumerate(zip(extra_items, extra_amounts))]
+                )
+        return bill_id
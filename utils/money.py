@@ -0,0 +1,126 @@
+from decimal import Decimal, ROUND_CEILING, ROUND_HALF_UP
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+
+# Deduction rates applied to the grand total
+SECURITY_DEPOSIT_RATE = Decimal('0.10')
+INCOME_TAX_RATE = Decimal('0.02')
+GST_RATE = Decimal('0.02')
+LABOUR_CESS_RATE = Decimal('0.01')
+
+# Amount columns of a deviation item, in the order they are stored
+DEVIATION_COLUMNS = ('amt_wo', 'amt_bill', 'excess_amt', 'saving_amt')
+
+def to_paise(values: Iterable[Any]) -> np.ndarray:
+    """Convert rupee amounts to whole paise, rounding half away from zero
+
+    A small tolerance absorbs binary float error, so 2.675 (stored as
+    2.67499999...) becomes 268 paise as it reads.
+    """
+    rupees = np.asarray(values, dtype=float)
+    if rupees.size == 0:
+        return np.zeros(rupees.shape, dtype=np.int64)
+    rupees = np.nan_to_num(rupees, nan=0.0, posinf=0.0, neginf=0.0)
+    scaled = np.abs(rupees) * 100
+    return (np.sign(rupees) * np.floor(scaled + 0.5 + 1e-12 * np.maximum(scaled, 1))).astype(np.int64)
+
+def to_rupees(paise) -> float:
+    """Convert paise (whole, or an exact Decimal) back to the rupee float the templates work with"""
+    if isinstance(paise, Decimal):
+        return float(paise / 100)
+    return int(paise) / 100
+
+def exact_rate(paise: int, rate) -> Decimal:
+    """Apply a percentage rate to an amount in paise exactly, keeping any fraction of a paisa"""
+    return Decimal(int(paise)) * Decimal(str(rate))
+
+def apply_rate(paise: int, rate) -> int:
+    """Apply a percentage rate to an amount in paise, rounding to the nearest paisa"""
+    return int(exact_rate(paise, rate).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+def round_up_to_even_rupees(paise) -> int:
+    """Round an amount in paise (whole, or an exact Decimal) up to the next even number of whole rupees"""
+    paise = paise if isinstance(paise, Decimal) else Decimal(int(paise))
+    rupees = int((paise / 100).to_integral_value(rounding=ROUND_CEILING))
+    return (rupees if rupees % 2 == 0 else rupees + 1) * 100
+
+def amount_columns(items: List[Dict[str, Any]], columns) -> np.ndarray:
+    """Columnar (items x columns) paise array of the given amount fields"""
+    if not items:
+        return np.zeros((0, len(columns)), dtype=np.int64)
+    return to_paise(np.column_stack([
+        np.fromiter((item.get(column, 0) or 0 for item in items), dtype=float, count=len(items))
+        for column in columns
+    ]))
+
+def calculate_totals(deviation_items: List[Dict[str, Any]], extra_items: List[Dict[str, Any]],
+                     tender_premium_percent) -> Dict[str, Any]:
+    """Compute every bill total, deduction and deviation aggregate from one columnar pass
+
+    Item amounts are summed as exact integer paise and premiums rounded to
+    the paisa with Decimal, so the first page, note sheet and deviation
+    statement all show the same figures. Deductions stay exact: the
+    templates show them in whole rupees, and rounding them to the paisa
+    first would round twice (10181.496 -> 10181.50 -> 10182). Results are
+    rupee floats for the templates.
+    """
+    work_order_paise, executed_paise, excess_paise, saving_paise = (
+        int(total) for total in amount_columns(deviation_items, DEVIATION_COLUMNS).sum(axis=0)
+    )
+    extra_paise = int(amount_columns(extra_items, ('amount',)).sum())
+
+    # Bill (first page) totals
+    bill_premium = apply_rate(executed_paise, tender_premium_percent)
+    bill_grand_total = executed_paise + bill_premium
+    extra_premium = apply_rate(extra_paise, tender_premium_percent)
+    extra_items_sum = extra_paise + extra_premium
+    grand_total = bill_grand_total + extra_items_sum
+
+    # Deductions
+    sd_amount = exact_rate(grand_total, SECURITY_DEPOSIT_RATE)
+    it_amount = exact_rate(grand_total, INCOME_TAX_RATE)
+    gst_amount = round_up_to_even_rupees(exact_rate(grand_total, GST_RATE))
+    lc_amount = exact_rate(grand_total, LABOUR_CESS_RATE)
+    total_deductions = sd_amount + it_amount + gst_amount + lc_amount
+
+    # Deviation statement: extra items all count as executed and excess
+    executed_total = executed_paise + extra_paise
+    overall_excess = excess_paise + extra_paise
+    tender_premium_f = apply_rate(work_order_paise, tender_premium_percent)
+    tender_premium_h = apply_rate(executed_total, tender_premium_percent)
+    tender_premium_j = apply_rate(overall_excess, tender_premium_percent)
+    tender_premium_l = apply_rate(saving_paise, tender_premium_percent)
+
+    return {
+        'bill_total': to_rupees(executed_paise),
+        'bill_premium': to_rupees(bill_premium),
+        'bill_grand_total': to_rupees(bill_grand_total),
+        'extra_items_base': to_rupees(extra_paise),
+        'extra_premium': to_rupees(extra_premium),
+        'extra_items_sum': to_rupees(extra_items_sum),
+        'totals': {
+            'grand_total': to_rupees(grand_total),
+            'sd_amount': to_rupees(sd_amount),
+            'it_amount': to_rupees(it_amount),
+            'gst_amount': to_rupees(gst_amount),
+            'lc_amount': to_rupees(lc_amount),
+            'total_deductions': to_rupees(total_deductions),
+            'net_payable': to_rupees(grand_total - total_deductions)
+        },
+        'deviation_summary': {
+            'work_order_total': to_rupees(work_order_paise),
+            'executed_total': to_rupees(executed_total),
+            'overall_excess': to_rupees(overall_excess),
+            'overall_saving': to_rupees(saving_paise),
+            'tender_premium_f': to_rupees(tender_premium_f),
+            'grand_total_f': to_rupees(work_order_paise + tender_premium_f),
+            'tender_premium_h': to_rupees(tender_premium_h),
+            'grand_total_h': to_rupees(executed_total + tender_premium_h),
+            'tender_premium_j': to_rupees(tender_premium_j),
+            'grand_total_j': to_rupees(overall_excess + tender_premium_j),
+            'tender_premium_l': to_rupees(tender_premium_l),
+            'grand_total_l': to_rupees(saving_paise + tender_premium_l),
+            'net_difference': to_rupees(executed_total + tender_premium_h - work_order_paise - tender_premium_f)
+        }
+    }
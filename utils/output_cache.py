@@ -0,0 +1,117 @@
+import functools
+import hashlib
+import os
+import threading
+import uuid
+import zipfile
+from pathlib import Path
+from typing import Dict, Optional
+
+# Bump when the cached outputs of a workbook change: their layout or the figures they show
+OUTPUT_FORMAT_VERSION = '2'
+
+# Sources whose changes alter the outputs generated from the same workbook
+CODE_DIR = Path(__file__).resolve().parent
+
+DEFAULT_CACHE_DIR = Path(os.environ.get(
+    'BILL_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache')
+)) / 'outputs'
+
+DEFAULT_MAX_BYTES = int(os.environ.get('BILL_OUTPUT_CACHE_MB', 512)) * 1024 * 1024
+
+@functools.lru_cache(maxsize=None)
+def code_version() -> str:
+    """Get a hash of the utils package sources, used to invalidate outputs cached by other code"""
+    digest = hashlib.sha256()
+    for path in sorted(CODE_DIR.glob('*.py')):
+        digest.update(path.name.encode() + b'\0')
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+class OutputCache:
+    """On-disk LRU cache of generated outputs keyed by the uploaded workbook content"""
+
+    def __init__(self, cache_dir: Optional[Path] = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir) if cache_dir else DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def make_key(self, file_bytes: bytes, *versions: str) -> str:
+        """Build a cache key from the workbook bytes plus the code, template and config versions"""
+        digest = hashlib.sha256()
+        digest.update(OUTPUT_FORMAT_VERSION.encode())
+        digest.update(b'\0' + code_version().encode())
+        for version in versions:
+            digest.update(b'\0' + str(version).encode())
+        digest.update(b'\0')
+        digest.update(file_bytes)
+        return digest.hexdigest()
+
+    def get_path(self, key: str) -> Path:
+        """Get the archive path for a cache key"""
+        return self.cache_dir / f"{key}.zip"
+
+    def get(self, key: str) -> Optional[Dict[str, bytes]]:
+        """Load cached outputs, or None on a miss"""
+        path = self.get_path(key)
+        try:
+            with zipfile.ZipFile(path) as zf:
+                outputs = {name: zf.read(name) for name in zf.namelist()}
+            # Touch the entry so eviction treats it as recently used
+            os.utime(path)
+            return outputs
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading output cache entry {key}: {str(e)}")
+            return None
+
+    def put(self, key: str, outputs: Dict[str, bytes]):
+        """Store outputs under a cache key and evict old entries beyond the size limit"""
+        tmp_path = None
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            path = self.get_path(key)
+            tmp_path = path.with_name(f"{key}.{uuid.uuid4().hex}.tmp")
+
+            # PDFs are already compressed, so entries are stored as-is
+            with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED) as zf:
+                for name, data in outputs.items():
+                    zf.writestr(name, data)
+            os.replace(tmp_path, path)
+            tmp_path = None
+
+            self.evict()
+        except Exception as e:
+            print(f"Error writing output cache entry {key}: {str(e)}")
+        finally:
+            # A failed write leaves no partial entry behind
+            if tmp_path is not None:
+                tmp_path.unlink(missing_ok=True)
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits its size limit"""
+        with self._lock:
+            entries = []
+            for path in self.cache_dir.glob('*.zip'):
+                try:
+                    stat = path.stat()
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                except FileNotFoundError:
+                    continue
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                    total -= size
+                except FileNotFoundError:
+                    continue
+
+    def clear(self):
+        """Remove every cache entry"""
+        for path in self.cache_dir.glob('*.zip'):
+            path.unlink(missing_ok=True)
@@ -1,117 +1,473 @@
 import io
-from typing import List
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from reportlab.lib.pagesizes import A4, landscape
 from reportlab.lib.units import mm
 from reportlab.pdfgen import canvas
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle, Spacer
+from reportlab.platypus import BaseDocTemplate, Frame, PageTemplate, Paragraph, Table, TableStyle, Spacer
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 import weasyprint
+from weasyprint.text.fonts import FontConfiguration
+
+from . import instrumentation
+from .instrumentation import instrumented
+from .table_renderer import TableRenderer, TABLE_DOCUMENTS
+from .chunked_report import ChunkedDeviationStatement, DEFAULT_CHUNK_ROWS, chunk_deviation_statement
+
+# Job type that lays out several (html, document_type) sections into one PDF
+COMBINED_DOCUMENT = 'combined_report'
+
+# PDF engines: WeasyPrint lays out the HTML reports; ReportLab draws the
+# tabular documents straight from the report context (the others still use WeasyPrint)
+WEASYPRINT_ENGINE = 'weasyprint'
+REPORTLAB_ENGINE = 'reportlab'
+PDF_ENGINES = (WEASYPRINT_ENGINE, REPORTLAB_ENGINE)
+DEFAULT_PDF_ENGINE = os.environ.get('BILL_PDF_ENGINE', WEASYPRINT_ENGINE)
+
+# Per-process generator used by rendering pool workers
+_worker_generator = None
+
+# Parsed page stylesheets keyed by orientation, plus the font configuration
+# they were parsed against; built once per process and shared by all renders
+_stylesheet_cache = {}
+_stylesheet_cache_stats = {'hits': 0, 'misses': 0}
+_font_config = None
+_stylesheet_lock = threading.Lock()
+
+def default_render_workers() -> int:
+    """Worker count for the rendering pool (BILL_PDF_WORKERS overrides the CPU count)"""
+    try:
+        return max(1, int(os.environ.get('BILL_PDF_WORKERS', os.cpu_count() or 1)))
+    except ValueError:
+        return os.cpu_count() or 1
+
+def _render_pdf_job(job: Tuple[Any, str, bool]) -> Tuple[bytes, List[Dict[str, Any]]]:
+    """Render a single (html, document_type, record) job inside a pool worker
+    
+    Returns the PDF with the stage records of the worker when record is set.
+    """
+    global _worker_generator
+    if _worker_generator is None:
+        _worker_generator = PDFGenerator(max_workers=1)
+    content, document_type, record = job
+    if not record:
+        return _worker_generator.render_job((content, document_type)), []
+    with instrumentation.recording() as run:
+        pdf_bytes = _worker_generator.render_job((content, document_type))
+    return pdf_bytes, [stage_record.to_dict() for stage_record in run.records]
+
+def _html_size(html_content) -> int:
+    return len(html_content.encode()) if isinstance(html_content, str) else 0
+
+def _context_rows(context, document_type: str) -> int:
+    """Item rows a tabular document is drawn with"""
+    keys = {
+        'first_page': ('bill_items', 'extra_items'),
+        'deviation_statement': ('deviation_items', 'extra_items_for_deviation'),
+        'extra_items': ('extra_items',)
+    }.get(document_type, ())
+    return sum(len(context.get(key) or ()) for key in keys)
 
 class PDFGenerator:
     """Class to handle PDF generation from HTML templates"""
     
-    def __init__(self):
+    def __init__(self, max_workers: Optional[int] = None, engine: Optional[str] = None,
+                 chunk_rows: Optional[int] = None):
         self.page_margins = {
             'top': 10 * mm,
             'bottom': 10 * mm,
             'left': 10 * mm,
             'right': 10 * mm
         }
+        self.max_workers = max_workers if max_workers else default_render_workers()
+        self.engine = engine if engine in PDF_ENGINES else DEFAULT_PDF_ENGINE
+        self.table_renderer = TableRenderer()
+        # WeasyPrint lays out deviation statements longer than this many rows in blocks; 0 never chunks
+        self.chunk_rows = DEFAULT_CHUNK_ROWS if chunk_rows is None else chunk_rows
+        # Rendering pool, started on first use and kept across batches
+        self._executor = None
+        self._executor_workers = 0
+        self._executor_lock = threading.Lock()
     
-    def generate_pdf(self, html_content: str, document_type: str) -> bytes:
-        """Generate PDF from HTML content using WeasyPrint"""
-        try:
-            # Determine page orientation
-            if document_type == 'deviation_statement':
-                css_string = """
-                @page {
-                    size: A4 landscape;
-                    margin: 10mm;
-                }
-                body {
-                    font-family: Arial, sans-serif;
-                    font-size: 9pt;
-                    line-height: 1.2;
-                }
-                table {
-                    width: 100%;
-                    border-collapse: collapse;
-                    font-size: 8pt;
-                }
-                th, td {
-                    border: 1px solid black;
-                    padding: 3px;
-                    text-align: left;
-                    vertical-align: top;
-                }
-                th {
-                    background-color: #f0f0f0;
-                    font-weight: bold;
-                    text-align: center;
-                }
-                """
+    def get_job_content(self, html_content: str, report_data, document_type: str, engine: Optional[str] = None):
+        """Content of a PDF job: the report context for a tabular document on the ReportLab engine, else the HTML
+        
+        On WeasyPrint, a deviation statement longer than chunk_rows rows is
+        a ChunkedDeviationStatement instead. render_job renders a job by what
+        it carries, so pool workers need no settings of their own.
+        """
+        engine = engine or self.engine
+        if engine == REPORTLAB_ENGINE and report_data is not None and document_type in TABLE_DOCUMENTS:
+            return report_data
+        if document_type == 'deviation_statement':
+            return chunk_deviation_statement(report_data, self.chunk_rows) or html_content
+        return html_content
+    
+    def config_version(self, engine: Optional[str] = None) -> str:
+        """Settings that change the rendered PDFs, for cache keys"""
+        return f"pdf_engine={engine or self.engine};chunk_rows={self.chunk_rows}"
+    
+    def generate_pdfs(self, jobs: List[Tuple[Any, str]], max_workers: Optional[int] = None,
+                      workbooks: Optional[List[str]] = None,
+                      on_rendered: Optional[Callable[[int], None]] = None) -> List[bytes]:
+        """Render a batch of (html, document_type) jobs on a process pool, preserving job order
+        
+        A job whose document type is COMBINED_DOCUMENT carries a list of
+        (html, document_type) sections instead of a single HTML string, and a
+        job for the ReportLab engine the report context (see get_job_content).
+        workbooks optionally names the workbook of each job, for the stage
+        records of the performance run. on_rendered is called with the index
+        of each job once its PDF is ready, for progress reporting.
+        """
+        jobs = list(jobs)
+        workbooks = workbooks or [None] * len(jobs)
+        pool_workers = max_workers or self.max_workers
+        run = instrumentation.get_active_run()
+        results = [None] * len(jobs)
+        
+        if min(pool_workers, len(jobs)) > 1:
+            executor = self.get_executor(pool_workers)
+            try:
+                self.generate_pdfs_in_pool(jobs, executor, workbooks, on_rendered, run, results)
+                return results
+            except (BrokenProcessPool, OSError, RuntimeError) as e:
+                self.discard_executor(executor)
+                print(f"Parallel PDF rendering unavailable, rendering the remaining jobs serially: {str(e)}")
+        
+        # Serially, a combined job reuses the layouts of the sections rendered before it;
+        # jobs the pool already finished (and reported) are kept
+        layouts = {}
+        for index, (job, workbook) in enumerate(zip(jobs, workbooks)):
+            if results[index] is None:
+                with instrumentation.workbook(workbook):
+                    results[index] = self.render_job(job, layouts)
+                if on_rendered:
+                    on_rendered(index)
+            if job[1] == COMBINED_DOCUMENT:
+                layouts.clear()
+        return results
+    
+    def get_executor(self, workers: int) -> ProcessPoolExecutor:
+        """The rendering pool, started on first use and kept for later batches
+        
+        A batch asking for a different number of workers replaces it; batches
+        already running on the old pool finish there.
+        """
+        with self._executor_lock:
+            if self._executor is not None and self._executor_workers != workers:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=workers)
+                self._executor_workers = workers
+            return self._executor
+    
+    def discard_executor(self, executor: ProcessPoolExecutor):
+        """Drop a pool that failed; the next batch starts a fresh one"""
+        executor.shutdown(wait=False, cancel_futures=True)
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+    
+    def shutdown(self, wait: bool = True):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=True)
+                self._executor = None
+    
+    def generate_pdfs_in_pool(self, jobs: List[Tuple[Any, str]], executor: ProcessPoolExecutor,
+                              workbooks: List[Optional[str]], on_rendered: Optional[Callable[[int], None]], run,
+                              results: List[Optional[bytes]]):
+        """Pool path of generate_pdfs, filling in results as each job completes
+        
+        Workers share no layouts, so a combined job whose sections are all
+        jobs of the same batch is not laid out again: once its sections are
+        rendered, their PDFs are merged here. Other combined jobs go to the
+        pool like any job. If the pool breaks, the results finished so far
+        stay in place for generate_pdfs to complete serially.
+        """
+        section_indexes = {
+            (id(content), document_type): index
+            for index, (content, document_type) in enumerate(jobs)
+            if document_type != COMBINED_DOCUMENT
+        }
+        merged = {}
+        for index, (sections, document_type) in enumerate(jobs):
+            if document_type == COMBINED_DOCUMENT:
+                indexes = [section_indexes.get((id(content), section_type)) for content, section_type in sections if content]
+                if indexes and None not in indexes:
+                    merged[index] = indexes
+        
+        pool_indexes = [index for index in range(len(jobs)) if index not in merged]
+        rendered = executor.map(
+            _render_pdf_job,
+            [(jobs[index][0], jobs[index][1], run is not None) for index in pool_indexes]
+        )
+        # Jobs complete in order, and a combined job always follows its sections
+        for index in range(len(jobs)):
+            if index in merged:
+                with instrumentation.workbook(workbooks[index]):
+                    results[index] = self.create_combined_pdf([results[section] for section in merged[index]])
             else:
-                css_string = """
-                @page {
-                    size: A4 portrait;
-                    margin: 10mm;
-                }
-                body {
-                    font-family: Arial, sans-serif;
-                    font-size: 9pt;
-                    line-height: 1.3;
-                }
-                table {
-                    width: 100%;
-                    border-collapse: collapse;
-                }
-                th, td {
-                    border: 1px solid black;
-                    padding: 4px;
-                    text-align: left;
-                    vertical-align: top;
-                }
-                th {
-                    background-color: #f0f0f0;
-                    font-weight: bold;
-                    text-align: center;
-                }
-                """
+                results[index], records = next(rendered)
+                # Records made inside the workers are merged into this process's run
+                if run is not None:
+                    run.extend(records, workbooks[index] or instrumentation.current_workbook())
+            if on_rendered:
+                on_rendered(index)
+    
+    def render_job(self, job: Tuple[Any, str], layouts: Optional[Dict] = None) -> bytes:
+        """Render one (html, document_type) job; a job carrying a report context is drawn with ReportLab"""
+        content, document_type = job
+        if document_type == COMBINED_DOCUMENT:
+            return self.generate_combined_pdf(content, layouts)
+        if isinstance(content, dict):
+            return self.generate_table_pdf(content, document_type, layouts)
+        if isinstance(content, ChunkedDeviationStatement):
+            return self.generate_chunked_pdf(content, document_type, layouts)
+        return self.generate_pdf(content, document_type, layouts)
+    
+    def get_page_orientation(self, document_type: str) -> str:
+        """Get the page orientation for a document type"""
+        return 'landscape' if document_type == 'deviation_statement' else 'portrait'
+    
+    def get_page_css(self, document_type: str) -> str:
+        """Get the page stylesheet for a document type"""
+        # Determine page orientation
+        if self.get_page_orientation(document_type) == 'landscape':
+            return """
+            @page {
+                size: A4 landscape;
+                margin: 10mm;
+            }
+            body {
+                font-family: Arial, sans-serif;
+                font-size: 9pt;
+                line-height: 1.2;
+            }
+            table {
+                width: 100%;
+                border-collapse: collapse;
+                font-size: 8pt;
+            }
+            th, td {
+                border: 1px solid black;
+                padding: 3px;
+                text-align: left;
+                vertical-align: top;
+            }
+            th {
+                background-color: #f0f0f0;
+                font-weight: bold;
+                text-align: center;
+            }
+            """
+        return """
+        @page {
+            size: A4 portrait;
+            margin: 10mm;
+        }
+        body {
+            font-family: Arial, sans-serif;
+            font-size: 9pt;
+            line-height: 1.3;
+        }
+        table {
+            width: 100%;
+            border-collapse: collapse;
+        }
+        th, td {
+            border: 1px solid black;
+            padding: 4px;
+            text-align: left;
+            vertical-align: top;
+        }
+        th {
+            background-color: #f0f0f0;
+            font-weight: bold;
+            text-align: center;
+        }
+        """
+    
+    def get_stylesheet(self, document_type: str):
+        """Get the cached (CSS, FontConfiguration) pair for a document type"""
+        global _font_config
+        orientation = self.get_page_orientation(document_type)
+        
+        with _stylesheet_lock:
+            if orientation in _stylesheet_cache:
+                _stylesheet_cache_stats['hits'] += 1
+                return _stylesheet_cache[orientation], _font_config
             
-            # Generate PDF using WeasyPrint
-            pdf_buffer = io.BytesIO()
-            weasyprint.HTML(string=html_content).write_pdf(
-                pdf_buffer,
-                stylesheets=[weasyprint.CSS(string=css_string)]
-            )
+            _stylesheet_cache_stats['misses'] += 1
+            if _font_config is None:
+                _font_config = FontConfiguration()
             
-            pdf_buffer.seek(0)
-            return pdf_buffer.getvalue()
+            stylesheet = weasyprint.CSS(string=self.get_page_css(document_type), font_config=_font_config)
+            _stylesheet_cache[orientation] = stylesheet
+            return stylesheet, _font_config
+    
+    def warm(self) -> int:
+        """Parse the page stylesheets (and the font configuration) up front; returns how many are cached"""
+        for document_type in ('first_page', 'deviation_statement'):
+            try:
+                self.get_stylesheet(document_type)
+            except Exception as e:
+                print(f"Error preparing stylesheet for {document_type}: {str(e)}")
+        return len(_stylesheet_cache)
+    
+    def stylesheet_cache_info(self) -> Dict[str, int]:
+        """Get hit/miss counters for the stylesheet cache of this process"""
+        return {
+            'hits': _stylesheet_cache_stats['hits'],
+            'misses': _stylesheet_cache_stats['misses'],
+            'size': len(_stylesheet_cache)
+        }
+    
+    def render_document(self, html_content: str, document_type: str, layouts: Optional[Dict] = None):
+        """Lay out HTML content as a WeasyPrint document, reusing an earlier layout when given one"""
+        key = (document_type, html_content)
+        if layouts is not None and key in layouts:
+            return layouts[key]
+        
+        stylesheet, font_config = self.get_stylesheet(document_type)
+        document = weasyprint.HTML(string=html_content).render(
+            stylesheets=[stylesheet],
+            font_config=font_config
+        )
+        
+        if layouts is not None:
+            layouts[key] = document
+        return document
+    
+    @instrumented('generate_pdf',
+                  detail=lambda result, self, html_content, document_type, *args, **kwargs: document_type,
+                  bytes_in=lambda result, self, html_content, *args, **kwargs: _html_size(html_content))
+    def generate_pdf(self, html_content: str, document_type: str, layouts: Optional[Dict] = None) -> bytes:
+        """Generate PDF from HTML content using WeasyPrint"""
+        try:
+            return self.render_document(html_content, document_type, layouts).write_pdf()
             
         except Exception as e:
             # Fallback to ReportLab if WeasyPrint fails
             return self.generate_pdf_reportlab(html_content, document_type)
     
-    def generate_pdf_reportlab(self, html_content: str, document_type: str) -> bytes:
-        """Fallback PDF generation using ReportLab"""
-        buffer = io.BytesIO()
+    @instrumented('generate_combined_pdf',
+                  detail=lambda result, self, sections, *args, **kwargs: f"{len(sections)} sections",
+                  bytes_in=lambda result, self, sections, *args, **kwargs: sum(_html_size(html) for html, _ in sections))
+    def generate_combined_pdf(self, sections: List[Tuple[str, str]], layouts: Optional[Dict] = None) -> bytes:
+        """Lay out every (html, document_type) section and write them as one PDF
         
-        # Determine page size and orientation
-        if document_type == 'deviation_statement':
-            pagesize = landscape(A4)
-        else:
-            pagesize = A4
+        Each section keeps its own page size and orientation; the pages are
+        collected into a single document and serialized once, so there is no
+        render-then-merge round trip.
+        """
+        sections = [(html_content, document_type) for html_content, document_type in sections if html_content]
+        if not sections:
+            return b''
         
-        doc = SimpleDocTemplate(
+        # Sections drawn by ReportLab or laid out in blocks are rendered on their own and merged with the others
+        if any(not isinstance(html_content, str) for html_content, _ in sections):
+            return self.create_combined_pdf([self.render_job(section, layouts) for section in sections])
+        
+        try:
+            documents = [
+                self.render_document(html_content, document_type, layouts)
+                for html_content, document_type in sections
+            ]
+            pages = [page for document in documents for page in document.pages]
+            return documents[0].copy(pages).write_pdf()
+            
+        except Exception as e:
+            print(f"Error rendering combined PDF: {str(e)}")
+            return self.create_combined_pdf([
+                self.generate_pdf(html_content, document_type) for html_content, document_type in sections
+            ])
+    
+    @instrumented('generate_table_pdf',
+                  detail=lambda result, self, report_data, document_type, *args, **kwargs: document_type,
+                  rows=lambda result, self, report_data, document_type, *args, **kwargs: _context_rows(report_data, document_type))
+    def generate_table_pdf(self, report_data, document_type: str, layouts: Optional[Dict] = None) -> bytes:
+        """Draw a tabular document (first page, deviation statement, extra items) from the report context with ReportLab
+        
+        Like render_document's layouts, layouts keeps each drawn PDF so a
+        combined report rendered after it does not draw it again.
+        """
+        key = (document_type, id(report_data))
+        if layouts is not None and key in layouts:
+            return layouts[key]
+        
+        try:
+            buffer = io.BytesIO()
+            doc = self.create_reportlab_document(buffer, document_type)
+            doc.build(self.table_renderer.build_story(document_type, report_data, doc.width))
+            if layouts is not None:
+                layouts[key] = buffer.getvalue()
+            return buffer.getvalue()
+            
+        except Exception as e:
+            print(f"Error drawing {document_type} with ReportLab: {str(e)}")
+            return self.generate_pdf_reportlab('', document_type)
+    
+    @instrumented('generate_chunked_pdf',
+                  detail=lambda result, self, chunked, document_type, *args, **kwargs: f"{document_type}, {len(chunked)} blocks",
+                  rows=lambda result, self, chunked, document_type, *args, **kwargs: _context_rows(chunked.report_data, document_type))
+    def generate_chunked_pdf(self, chunked: ChunkedDeviationStatement, document_type: str,
+                             layouts: Optional[Dict] = None) -> bytes:
+        """Lay out a long document block by block and concatenate the pages
+        
+        Each block's HTML is generated, laid out and written on its own
+        before the next is generated, so WeasyPrint's DOM and box tree only
+        ever hold one block, however many rows the bill has. As with
+        generate_table_pdf, layouts keeps the result for a combined report.
+        """
+        key = (document_type, id(chunked))
+        if layouts is not None and key in layouts:
+            return layouts[key]
+        
+        try:
+            block_pdfs = []
+            for html_content in chunked.iter_html():
+                block_pdfs.append(self.render_document(html_content, document_type).write_pdf())
+            pdf_bytes = self.create_combined_pdf(block_pdfs)
+            if layouts is not None:
+                layouts[key] = pdf_bytes
+            return pdf_bytes
+            
+        except Exception as e:
+            print(f"Error rendering {document_type} in blocks: {str(e)}")
+            return self.generate_pdf_reportlab('', document_type)
+    
+    def create_reportlab_document(self, buffer, document_type: str) -> BaseDocTemplate:
+        """ReportLab document with the page size, orientation and margins of a document type
+        
+        Its frame has no padding of its own, so content spans the full width
+        inside the margins as in the HTML layout.
+        """
+        doc = BaseDocTemplate(
             buffer,
-            pagesize=pagesize,
+            pagesize=landscape(A4) if self.get_page_orientation(document_type) == 'landscape' else A4,
             topMargin=self.page_margins['top'],
             bottomMargin=self.page_margins['bottom'],
             leftMargin=self.page_margins['left'],
-            rightMargin=self.page_margins['right']
+            rightMargin=self.page_margins['right'],
+            title=self.get_document_title(document_type)
         )
+        doc.addPageTemplates([PageTemplate('page', frames=[Frame(
+            doc.leftMargin, doc.bottomMargin, doc.width, doc.height,
+            leftPadding=0, rightPadding=0, topPadding=0, bottomPadding=0
+        )])])
+        return doc
+    
+    def generate_pdf_reportlab(self, html_content: str, document_type: str) -> bytes:
+        """Fallback PDF generation using ReportLab"""
+        buffer = io.BytesIO()
+        doc = self.create_reportlab_document(buffer, document_type)
         
         # Create basic content
         styles = getSampleStyleSheet()
@@ -163,6 +519,9 @@ class PDFGenerator:
         }
         return titles.get(document_type, 'REPORT')
     
+    @instrumented('create_combined_pdf',
+                  detail=lambda result, self, pdf_list, *args, **kwargs: f"{len(pdf_list)} documents",
+                  bytes_in=lambda result, self, pdf_list, *args, **kwargs: sum(len(pdf) for pdf in pdf_list if pdf))
     def create_combined_pdf(self, pdf_list: List[bytes]) -> bytes:
         """Combine multiple PDFs into a single document"""
         try:
@@ -0,0 +1,54 @@
+from typing import Any
+
+class ReportContext(dict):
+    """Read-only dict handed to the report templates
+
+    Templates read it exactly like the plain dict it replaces, but nothing
+    can modify it, so one context can be rendered by several templates at
+    once and cached safely.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("ReportContext is read-only")
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    __ior__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+
+    def __reduce__(self):
+        return (ReportContext, (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+class GeneratedReports(dict):
+    """HTML reports keyed like generate_all_reports returns them, with the context they were rendered from
+
+    The context lets the PDF stage draw the tabular documents directly
+    instead of laying out their HTML.
+    """
+
+    def __init__(self, reports=(), context=None):
+        super().__init__(reports)
+        self.context = context
+
+    def __reduce__(self):
+        return (GeneratedReports, (dict(self), self.context))
+
+def freeze(value: Any) -> Any:
+    """Recursively turn dicts into ReportContexts and lists into tuples"""
+    if isinstance(value, ReportContext):
+        return value
+    if isinstance(value, dict):
+        return ReportContext((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
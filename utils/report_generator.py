@@ -1,40 +1,95 @@
 from typing import Dict, Any
+import contextvars
 import math
-from .template_renderer import TemplateRenderer
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from .template_renderer import get_shared_renderer
+from .instrumentation import instrumented
+from .report_context import GeneratedReports, freeze
+from .money import calculate_totals
+from .items import (WorkOrderItem, BillQuantityItem, ExtraItem, MergedItem, DeviationItem,
+                    ExtraDeviationItem, as_record)
+from .join_index import JoinDiagnostics, JoinedItems, join_by_serial, pair_with_previous
+
+def count_report_rows(result, self, data, *args, **kwargs) -> int:
+    """Number of bill and extra item rows a report is generated from"""
+    return len(data.get('bill_items') or []) + len(data.get('extra_items') or [])
+
+def count_input_rows(result, self, data, *args, **kwargs) -> int:
+    """Number of parsed item rows report data is prepared from"""
+    return sum(
+        len((data.get(key) or {}).get('items', []))
+        for key in ('work_order_data', 'bill_quantity_data', 'extra_items_data')
+    )
 
 class ReportGenerator:
     """Class to generate all types of reports from processed data"""
     
     def __init__(self):
-        self.template_renderer = TemplateRenderer()
+        self.template_renderer = get_shared_renderer()
         self.tender_premium_percent = 0.04  # 4% default
+        # Templates rendered at once by generate_all_reports; 1 renders them in turn.
+        # Jinja rendering holds the GIL, so threads only pay off on free-threaded builds.
+        self.render_threads = 1
     
+    @instrumented('generate_all_reports', rows=count_input_rows)
     def generate_all_reports(self, data: Dict[str, Any]) -> Dict[str, str]:
         """Generate all report types from processed data"""
         # Calculate totals and prepare data
-        report_data = self.prepare_report_data(data)
-        
-        reports = {
-            'first_page_html': self.generate_first_page_report(report_data),
-            'deviation_statement_html': self.generate_deviation_statement(report_data),
-            'note_sheet_html': self.generate_note_sheet(report_data),
-            'certificate_ii_html': self.generate_certificate_ii(report_data),
-            'certificate_iii_html': self.generate_certificate_iii(report_data)
+        return self.render_reports(self.prepare_report_data(data))
+    
+    def render_reports(self, report_data) -> Dict[str, str]:
+        """Render every report from an already prepared report context, returned with it"""
+        generators = {
+            'first_page_html': self.generate_first_page_report,
+            'deviation_statement_html': self.generate_deviation_statement,
+            'note_sheet_html': self.generate_note_sheet,
+            'certificate_ii_html': self.generate_certificate_ii,
+            'certificate_iii_html': self.generate_certificate_iii
         }
         
         # Add extra items report if data exists
         if report_data.get('extra_items'):
-            reports['extra_items_html'] = self.generate_extra_items_report(report_data)
+            generators['extra_items_html'] = self.generate_extra_items_report
         
-        return reports
+        if self.render_threads <= 1:
+            return GeneratedReports(((key, generate(report_data)) for key, generate in generators.items()), report_data)
+        
+        # The context is read-only, so the templates can render it concurrently.
+        # Each task runs in a copy of the caller's context to keep instrumentation attribution.
+        with ThreadPoolExecutor(max_workers=min(self.render_threads, len(generators))) as executor:
+            futures = {
+                key: executor.submit(contextvars.copy_context().run, generate, report_data)
+                for key, generate in generators.items()
+            }
+            return GeneratedReports(((key, future.result()) for key, future in futures.items()), report_data)
     
+    def get_report_templates(self, report_data) -> Dict[str, str]:
+        """Map each report generate_all_reports produces to the template it renders"""
+        templates = {
+            'first_page_html': 'first_page.html',
+            'deviation_statement_html': 'deviation_statement.html',
+            'note_sheet_html': 'note_sheet.html',
+            'certificate_ii_html': 'certificate_ii.html',
+            'certificate_iii_html': 'certificate_iii.html'
+        }
+        if report_data.get('extra_items'):
+            templates['extra_items_html'] = 'extra_items.html'
+        return templates
+    
+    def config_version(self) -> str:
+        """Get a string identifying the calculation settings, used to invalidate cached outputs"""
+        return f"tender_premium_percent={self.tender_premium_percent}"
+    
+    @instrumented('prepare_report_data', rows=count_input_rows)
     def prepare_report_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        """Prepare and calculate all necessary data for reports"""
-        # Extract basic info
-        title_data = data.get('title_data', {})
+        """Prepare and calculate all necessary data for reports
+        
+        Returns a read-only context with every derived summary computed, so
+        the report templates never modify it.
+        """
         work_order_data = data.get('work_order_data', {})
         bill_quantity_data = data.get('bill_quantity_data', {})
-        extra_items_data = data.get('extra_items_data', {})
         
         # Merge work order and bill quantity data
         merged_items = self.merge_work_order_and_bill_data(
@@ -42,28 +97,31 @@ class ReportGenerator:
             bill_quantity_data.get('items', [])
         )
         
-        # Calculate main bill totals
-        bill_total = sum(item.get('amount_bill', 0) for item in merged_items)
-        bill_premium = bill_total * self.tender_premium_percent
-        bill_grand_total = bill_total + bill_premium
+        return self.build_report_data(data, merged_items, self.prepare_deviation_items(merged_items),
+                                      merged_items.diagnostics)
+    
+    def build_report_data(self, data: Dict[str, Any], merged_items, deviation_items,
+                          join_diagnostics: JoinDiagnostics = None) -> Dict[str, Any]:
+        """Calculate totals and assemble the report context from already merged and deviation items"""
+        join_diagnostics = join_diagnostics or JoinDiagnostics()
+        if join_diagnostics.has_warnings:
+            print(f"Serial number join warnings for {data.get('filename', 'workbook')}:\n{join_diagnostics.summary()}")
         
-        # Calculate extra items totals
-        extra_items = extra_items_data.get('items', []) if extra_items_data else []
-        extra_items_base = sum(item.get('amount', 0) for item in extra_items)
-        extra_premium = extra_items_base * self.tender_premium_percent
-        extra_items_sum = extra_items_base + extra_premium
+        # Extract basic info
+        title_data = data.get('title_data', {})
+        work_order_data = data.get('work_order_data', {})
+        extra_items_data = data.get('extra_items_data', {})
         
-        # Calculate final totals
-        grand_total = bill_grand_total + extra_items_sum
+        extra_items = extra_items_data.get('items', []) if extra_items_data else []
         
-        # Calculate deductions
-        sd_amount = grand_total * 0.10  # 10% Security Deposit
-        it_amount = grand_total * 0.02  # 2% Income Tax
-        gst_amount = self.round_up_to_even(grand_total * 0.02)  # 2% GST rounded up to even
-        lc_amount = grand_total * 0.01  # 1% Labour Cess
+        # Previous running bill of the agreement, attached from the bill ledger (none for a first bill)
+        previous_bill = data.get('previous_bill') or {}
         
-        total_deductions = sd_amount + it_amount + gst_amount + lc_amount
-        net_payable = grand_total - total_deductions
+        # Bill totals, deductions (SD 10%, IT 2%, GST 2% rounded up to even, LC 1%)
+        # and deviation aggregates, in exact paise from one pass over the items
+        money = calculate_totals(deviation_items, extra_items, self.tender_premium_percent)
+        grand_total = money['totals']['grand_total']
+        extra_items_sum = money['extra_items_sum']
         
         # Prepare comprehensive data structure
         report_data = {
@@ -79,28 +137,21 @@ class ReportGenerator:
             # Items data
             'bill_items': merged_items,
             'extra_items': extra_items,
-            'deviation_items': self.prepare_deviation_items(merged_items),
+            'deviation_items': deviation_items,
             
             # Financial calculations
             'work_order_amount': work_order_data.get('total', 0),
-            'bill_total': bill_total,
-            'bill_premium': bill_premium,
-            'bill_grand_total': bill_grand_total,
-            'extra_items_base': extra_items_base,
-            'extra_premium': extra_premium,
+            'bill_total': money['bill_total'],
+            'bill_premium': money['bill_premium'],
+            'bill_grand_total': money['bill_grand_total'],
+            'extra_items_base': money['extra_items_base'],
+            'extra_premium': money['extra_premium'],
             'extra_items_sum': extra_items_sum,
             'tender_premium_percent': self.tender_premium_percent,
             
             # Summary totals
-            'totals': {
-                'grand_total': grand_total,
-                'sd_amount': sd_amount,
-                'it_amount': it_amount,
-                'gst_amount': gst_amount,
-                'lc_amount': lc_amount,
-                'total_deductions': total_deductions,
-                'net_payable': net_payable
-            },
+            'totals': money['totals'],
+            'deviation_summary': money['deviation_summary'],
             
             # Additional data for certificates
             'measurement_officer': 'JEN AC',
@@ -110,166 +161,111 @@ class ReportGenerator:
             'officer_designation': 'AAO - As Auditor',
             'authorising_officer_name': 'Executive Engineer',
             'authorising_officer_designation': 'PWD Udaipur',
-            'payable_words': self.number_to_words(net_payable),
+            'payable_words': self.number_to_words(money['totals']['net_payable']),
             
-            # Last bill amount (zero for first bill)
-            'last_bill_amount': 0.00,  # Default to 0 for first bill
+            # Last bill amount (zero for first bill) and the up-to-date quantities of each
+            # bill and extra item row in it, matched by normalized serial number
+            'last_bill': self.describe_last_bill(previous_bill),
+            'last_bill_amount': previous_bill.get('payable_amount', 0.00),
+            'previous_bill_items': pair_with_previous(merged_items, previous_bill['items']) if previous_bill else [],
+            'previous_extra_items': pair_with_previous(extra_items, previous_bill['extra_items']) if previous_bill else [],
             
             # Notes for note sheet
-            'notes': self.generate_notes(grand_total, work_order_data.get('total', 0), extra_items_sum)
+            'notes': self.generate_notes(grand_total, work_order_data.get('total', 0), extra_items_sum),
+            
+            # Unmatched, orphaned and duplicate rows of the work order / bill quantity join
+            'join_diagnostics': join_diagnostics.to_dict()
         }
         
-        return report_data
+        # Extra item rows of the deviation statement
+        report_data.update(self.prepare_deviation_data(report_data))
+        
+        return freeze(report_data)
     
     def merge_work_order_and_bill_data(self, work_order_items, bill_items):
-        """Merge work order and bill quantity data"""
-        merged = []
+        """Merge work order and bill quantity data
         
-        # Create lookup for bill items by serial number
-        bill_lookup = {item.get('serial_no', ''): item for item in bill_items}
-        
-        for wo_item in work_order_items:
-            serial_no = wo_item.get('serial_no', '')
-            bill_item = bill_lookup.get(serial_no, {})
-            
-            merged_item = {
-                'serial_no': serial_no,
-                'description': wo_item.get('description', ''),
-                'unit': wo_item.get('unit', ''),
-                'quantity_wo': wo_item.get('quantity', 0),
-                'rate': wo_item.get('rate', 0),
-                'amount_wo': wo_item.get('amount', 0),
-                'quantity_bill': bill_item.get('quantity_bill', 0),
-                'amount_bill': bill_item.get('amount_bill', 0),
-                'remark': wo_item.get('remark', '')
-            }
-            
-            merged.append(merged_item)
+        Rows are joined on normalized serial numbers (see join_by_serial).
+        Merged items are views over the parsed rows rather than copies; the
+        returned list carries the join diagnostics.
+        """
+        work_order_items = [as_record(item, WorkOrderItem) for item in work_order_items]
+        bill_items = [as_record(item, BillQuantityItem) for item in bill_items]
+        matches, diagnostics = join_by_serial(work_order_items, bill_items)
         
-        return merged
+        return JoinedItems(map(MergedItem, work_order_items, matches), diagnostics)
     
     def prepare_deviation_items(self, merged_items):
-        """Prepare deviation analysis for each item"""
-        deviation_items = []
+        """Prepare deviation analysis for each item
         
-        for item in merged_items:
-            qty_wo = item.get('quantity_wo', 0)
-            qty_bill = item.get('quantity_bill', 0)
-            rate = item.get('rate', 0)
-            
-            # Calculate excess and saving
-            if qty_bill > qty_wo:
-                excess_qty = qty_bill - qty_wo
-                excess_amt = excess_qty * rate
-                saving_qty = 0
-                saving_amt = 0
-            else:
-                excess_qty = 0
-                excess_amt = 0
-                saving_qty = qty_wo - qty_bill
-                saving_amt = saving_qty * rate
-            
-            deviation_item = {
-                'serial_no': item.get('serial_no', ''),
-                'description': item.get('description', ''),
-                'unit': item.get('unit', ''),
-                'qty_wo': qty_wo,
-                'rate': rate,
-                'amt_wo': item.get('amount_wo', 0),
-                'qty_bill': qty_bill,
-                'amt_bill': item.get('amount_bill', 0),
-                'excess_qty': excess_qty,
-                'excess_amt': excess_amt,
-                'saving_qty': saving_qty,
-                'saving_amt': saving_amt,
-                'remark': item.get('remark', '')
-            }
-            
-            deviation_items.append(deviation_item)
-        
-        return deviation_items
+        Excess and saving are derived from the merged item on access.
+        """
+        return [DeviationItem(as_record(item, MergedItem)) for item in merged_items]
     
+    @instrumented('generate_first_page_report', rows=count_report_rows)
     def generate_first_page_report(self, data):
         """Generate first page report HTML"""
         return self.template_renderer.render_template('first_page.html', data)
     
+    @instrumented('generate_deviation_statement', rows=count_report_rows)
     def generate_deviation_statement(self, data):
         """Generate deviation statement HTML"""
-        # Calculate deviation summary
-        deviation_summary = self.calculate_deviation_summary(data)
-        data['deviation_summary'] = deviation_summary
+        # Data from prepare_report_data already carries the deviation summaries
+        if 'deviation_summary' not in data:
+            data = {**data, **self.prepare_deviation_data(data)}
+        
+        return self.template_renderer.render_template('deviation_statement.html', data)
+    
+    def prepare_deviation_data(self, data):
+        """Calculate the deviation summary (unless already present) and extra item rows of the deviation statement"""
+        deviation_data = {}
+        if 'deviation_summary' not in data:
+            deviation_data['deviation_summary'] = self.calculate_deviation_summary(data)
         
         # Add extra items to deviation if they exist
         if data.get('extra_items'):
-            data['extra_items_for_deviation'] = self.prepare_extra_items_for_deviation(data.get('extra_items', []))
+            deviation_data['extra_items_for_deviation'] = self.prepare_extra_items_for_deviation(data.get('extra_items', []))
         
-        return self.template_renderer.render_template('deviation_statement.html', data)
+        return deviation_data
     
+    @instrumented('generate_note_sheet', rows=count_report_rows)
     def generate_note_sheet(self, data):
         """Generate note sheet HTML"""
         return self.template_renderer.render_template('note_sheet.html', data)
     
+    @instrumented('generate_certificate_ii', rows=count_report_rows)
     def generate_certificate_ii(self, data):
         """Generate Certificate II HTML"""
         return self.template_renderer.render_template('certificate_ii.html', data)
     
+    @instrumented('generate_certificate_iii', rows=count_report_rows)
     def generate_certificate_iii(self, data):
         """Generate Certificate III HTML"""
         return self.template_renderer.render_template('certificate_iii.html', data)
     
+    @instrumented('generate_extra_items_report', rows=count_report_rows)
     def generate_extra_items_report(self, data):
         """Generate extra items report HTML"""
         return self.template_renderer.render_template('extra_items.html', data)
     
-    def calculate_deviation_summary(self, data):
-        """Calculate deviation summary totals"""
-        deviation_items = data.get('deviation_items', [])
-        extra_items = data.get('extra_items', [])
-        
-        # Calculate totals from regular deviation items
-        work_order_total = sum(item.get('amt_wo', 0) for item in deviation_items)
-        executed_total = sum(item.get('amt_bill', 0) for item in deviation_items)
-        overall_excess = sum(item.get('excess_amt', 0) for item in deviation_items)
-        overall_saving = sum(item.get('saving_amt', 0) for item in deviation_items)
-        
-        # Add extra items to totals (all extra items are considered excess)
-        extra_items_total = sum(item.get('amount', 0) for item in extra_items)
-        executed_total += extra_items_total
-        overall_excess += extra_items_total
-        
-        tender_premium_percent = data.get('tender_premium_percent', 0.04)
-        
-        # Calculate with tender premium
-        tender_premium_f = work_order_total * tender_premium_percent
-        grand_total_f = work_order_total + tender_premium_f
-        
-        tender_premium_h = executed_total * tender_premium_percent
-        grand_total_h = executed_total + tender_premium_h
-        
-        tender_premium_j = overall_excess * tender_premium_percent
-        grand_total_j = overall_excess + tender_premium_j
-        
-        tender_premium_l = overall_saving * tender_premium_percent
-        grand_total_l = overall_saving + tender_premium_l
-        
-        net_difference = grand_total_h - grand_total_f
-        
+    def describe_last_bill(self, previous_bill):
+        """Number and date of the agreement's previous running bill, or None for a first bill"""
+        if not previous_bill.get('bill_number'):
+            return None
+        bill_date = previous_bill.get('bill_date')
         return {
-            'work_order_total': work_order_total,
-            'executed_total': executed_total,
-            'overall_excess': overall_excess,
-            'overall_saving': overall_saving,
-            'tender_premium_f': tender_premium_f,
-            'grand_total_f': grand_total_f,
-            'tender_premium_h': tender_premium_h,
-            'grand_total_h': grand_total_h,
-            'tender_premium_j': tender_premium_j,
-            'grand_total_j': grand_total_j,
-            'tender_premium_l': tender_premium_l,
-            'grand_total_l': grand_total_l,
-            'net_difference': net_difference
+            'number': previous_bill['bill_number'],
+            'date': datetime.strptime(bill_date, '%Y-%m-%d').strftime('%d/%m/%Y') if bill_date else previous_bill.get('bill_key', '')
         }
     
+    def calculate_deviation_summary(self, data):
+        """Calculate deviation summary totals"""
+        return calculate_totals(
+            data.get('deviation_items', []),
+            data.get('extra_items', []),
+            data.get('tender_premium_percent', 0.04)
+        )['deviation_summary']
+    
     def round_up_to_even(self, value):
         """Round up to the next even number"""
         rounded = math.ceil(value)
@@ -301,25 +297,8 @@ class ReportGenerator:
         return notes
     
     def prepare_extra_items_for_deviation(self, extra_items):
-        """Prepare extra items for deviation statement"""
-        deviation_extra_items = []
-        
-        for item in extra_items:
-            deviation_item = {
-                'serial_no': item.get('serial_no', ''),
-                'description': item.get('description', ''),
-                'unit': item.get('unit', ''),
-                'qty_wo': 0,  # Extra items don't have work order quantities
-                'rate': item.get('rate', 0),
-                'amt_wo': 0,  # Extra items don't have work order amounts
-                'qty_bill': item.get('quantity', 0),
-                'amt_bill': item.get('amount', 0),
-                'excess_qty': item.get('quantity', 0),  # All quantity is excess for extra items
-                'excess_amt': item.get('amount', 0),    # All amount is excess for extra items
-                'saving_qty': 0,
-                'saving_amt': 0,
-                'remark': item.get('remark', 'Extra Item')
-            }
-            deviation_extra_items.append(deviation_item)
+        """Prepare extra items for deviation statement
         
-        return deviation_extra_items
+        Extra items have no work order quantity, so all of it is excess.
+        """
+        return [ExtraDeviationItem(as_record(item, ExtraItem)) for item in extra_items]
@@ -0,0 +1,149 @@
+import hashlib
+import io
+import os
+import posixpath
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+from xml.etree import ElementTree
+
+# Bump when the processed sheet results change shape
+SHEET_FORMAT_VERSION = '1'
+
+DEFAULT_MAX_ENTRIES = int(os.environ.get('BILL_SHEET_CACHE_SIZE', 64))
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+DOC_REL_ID = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+
+# Byte-level scans of the raw parts; nothing here builds a full XML tree of a sheet
+SHARED_STRING_TYPE = re.compile(rb'\bt=["\']s["\']')
+SHARED_STRING_CELL = re.compile(
+    rb'<(?:\w+:)?c\b[^>]*\bt=["\']s["\'][^>]*>\s*<(?:\w+:)?v>\s*(\d+)\s*</(?:\w+:)?v>'
+)
+SHARED_STRING_ITEM = re.compile(rb'<(?:\w+:)?si(?:\s*/>|\b.*?</(?:\w+:)?si>)', re.DOTALL)
+STYLE_SECTIONS = re.compile(
+    rb'<(?:\w+:)?(numFmts|cellXfs)\b.*?</(?:\w+:)?\1>', re.DOTALL
+)
+WORKBOOK_PROPERTIES = re.compile(rb'<(?:\w+:)?workbookPr\b[^>]*>')
+
+def get_sheet_parts(archive: zipfile.ZipFile) -> Dict[str, str]:
+    """Map each sheet name, in workbook order, to the path of its XML part in the archive"""
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    rels = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    targets = {rel.get('Id'): rel.get('Target', '') for rel in rels.iter(f'{REL_NS}Relationship')}
+
+    parts = {}
+    for sheet in workbook.iter(f'{MAIN_NS}sheet'):
+        target = targets.get(sheet.get(DOC_REL_ID))
+        if not target:
+            continue
+        if target.startswith('/'):
+            parts[sheet.get('name')] = target.lstrip('/')
+        else:
+            parts[sheet.get('name')] = posixpath.normpath(posixpath.join('xl', target))
+    return parts
+
+def read_part(archive: zipfile.ZipFile, name: str) -> bytes:
+    try:
+        return archive.read(name)
+    except KeyError:
+        return b''
+
+def get_sheet_digests(file_content: bytes, sheet_names) -> Dict[str, str]:
+    """Hash the raw XML part of each named sheet of an xlsx workbook
+
+    A digest also covers what the sheet's cells depend on outside its own
+    part: the shared strings it references, the number formats and cell
+    formats (which decide whether a number reads as a date) and the
+    workbook's date system. Unchanged sheets therefore hash the same in
+    every running bill, whatever changed elsewhere in the workbook.
+    """
+    with zipfile.ZipFile(io.BytesIO(file_content)) as archive:
+        parts = get_sheet_parts(archive)
+        styles = b''.join(match.group(0) for match in STYLE_SECTIONS.finditer(read_part(archive, 'xl/styles.xml')))
+        workbook_properties = WORKBOOK_PROPERTIES.search(read_part(archive, 'xl/workbook.xml'))
+        shared_strings = None
+
+        digests = {}
+        for sheet_name in sheet_names:
+            if sheet_name not in parts:
+                continue
+            sheet_xml = archive.read(parts[sheet_name])
+
+            digest = hashlib.blake2b(digest_size=20)
+            digest.update(SHEET_FORMAT_VERSION.encode())
+            digest.update(b'\0' + (workbook_properties.group(0) if workbook_properties else b''))
+            digest.update(b'\0' + styles)
+            digest.update(b'\0' + sheet_xml)
+
+            references = SHARED_STRING_CELL.findall(sheet_xml)
+            if references or SHARED_STRING_TYPE.search(sheet_xml):
+                if shared_strings is None:
+                    shared_xml = read_part(archive, 'xl/sharedStrings.xml')
+                    shared_strings = [match.group(0) for match in SHARED_STRING_ITEM.finditer(shared_xml)]
+                if len(references) == len(SHARED_STRING_TYPE.findall(sheet_xml)):
+                    for index in references:
+                        position = int(index)
+                        digest.update(b'\0' + (shared_strings[position] if position < len(shared_strings) else b''))
+                else:
+                    # Some references were not recognised; fall back to every shared string
+                    digest.update(b'\0'.join([b''] + shared_strings))
+
+            digests[sheet_name] = digest.hexdigest()
+        return digests
+
+def copy_result(result: Any) -> Any:
+    """Copy the containers of a processed sheet so callers can't change the cached one
+
+    Item records are read-only, so they are shared rather than copied.
+    """
+    if isinstance(result, dict):
+        return {key: copy_result(value) for key, value in result.items()}
+    if isinstance(result, list):
+        return list(result)
+    return result
+
+class SheetCache:
+    """In-process LRU cache of processed sheets keyed by sheet content digest
+
+    Running bills for one agreement repeat the same Work Order (and usually
+    Title) sheet, so only the sheets that changed are parsed again.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Copy of the cached result for a key, or None on a miss"""
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                return None
+            self._entries.move_to_end(key)
+        return copy_result(result)
+
+    def put(self, key: Hashable, result: Any):
+        """Store a processed sheet and evict the least recently used beyond max_entries"""
+        if self.max_entries <= 0 or result is None:
+            return
+        result = copy_result(result)
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+# Shared by every ExcelProcessor in the process unless one is given its own
+DEFAULT_SHEET_CACHE = SheetCache()
@@ -0,0 +1,412 @@
+from typing import Any, Dict, List, Sequence, Tuple
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.lib.utils import simpleSplit
+from reportlab.platypus import Flowable, Paragraph, Spacer, Table, TableStyle
+from xml.sax.saxutils import escape
+
+# Documents the table renderer lays out directly from the report context
+TABLE_DOCUMENTS = ('first_page', 'deviation_statement', 'extra_items')
+
+FONT = 'Helvetica'
+BOLD_FONT = 'Helvetica-Bold'
+HEADER_BACKGROUND = colors.HexColor('#f0f0f0')
+SECTION_BACKGROUND = colors.HexColor('#e0e0e0')
+
+# Column widths (mm) of each template's table, scaled to the frame like its width: 100%
+FIRST_PAGE_COLUMNS = (11.1, 74.2, 11.7, 16, 16, 15.3, 22.7, 17.6, 13.9)
+DEVIATION_COLUMNS = (6, 95, 10, 10, 12, 12, 12, 12, 12, 12, 12, 12, 40)
+EXTRA_ITEMS_COLUMNS = (15, 80, 15, 20, 20, 25, 25)
+
+def number(value) -> str:
+    """Item figures as the templates print them: two decimals, blank for zero"""
+    return "%.2f" % value if value else ""
+
+def rounded(value) -> str:
+    """Totals as the templates' round filter prints them"""
+    try:
+        return str(round(float(value), 2))
+    except (ValueError, TypeError):
+        return '0'
+
+def percent(value) -> str:
+    return "%.2f%%" % (value * 100)
+
+class PagedTable(Flowable):
+    """Item table that splits across pages in time linear in its rows, repeating its header row on each page
+
+    ReportLab's Table and LongTable recompute the row heights and spans of
+    every remaining row each time they split, which is quadratic in the
+    rows of a long bill. Here row heights are known up front (cells are
+    pre-wrapped strings), so each page takes just the rows that fit and
+    becomes a small Table of its own, starting with the header.
+    """
+
+    def __init__(self, rows: List[List], widths: List[float], row_heights: List[float],
+                 commands: List[Tuple], start: int = 1):
+        super().__init__()
+        self.rows = rows
+        self.widths = widths
+        self.row_heights = row_heights
+        self.start = start
+
+        # Commands confined to one body row move with it; the rest apply to every page's table
+        self.commands = []
+        self.row_commands = {}
+        for command in commands:
+            (_, first_row), (_, last_row) = command[1], command[2]
+            if first_row == last_row and first_row >= 1:
+                self.row_commands.setdefault(first_row, []).append(command)
+            else:
+                self.commands.append(command)
+
+        if row_heights[0] is None:
+            header = Table([rows[0]], colWidths=widths)
+            header.setStyle(TableStyle(self.commands))
+            row_heights[0] = header.wrap(sum(widths), 10 ** 6)[1]
+
+    def continuation(self, start: int) -> 'PagedTable':
+        """The rows from start on, as a fresh flowable (without the layout flags ReportLab set on this one)"""
+        rest = PagedTable.__new__(PagedTable)
+        Flowable.__init__(rest)
+        for name in ('rows', 'widths', 'row_heights', 'commands', 'row_commands'):
+            setattr(rest, name, getattr(self, name))
+        rest.start = start
+        return rest
+
+    def make_table(self, end: int) -> Table:
+        """Table of the header and the body rows from start up to end"""
+        table = Table([self.rows[0]] + self.rows[self.start:end], colWidths=self.widths,
+                      rowHeights=[self.row_heights[0]] + self.row_heights[self.start:end])
+        commands = list(self.commands)
+        for row in range(self.start, end):
+            for command in self.row_commands.get(row, ()):
+                offset = row - self.start + 1
+                commands.append((command[0], (command[1][0], offset), (command[2][0], offset)) + tuple(command[3:]))
+        table.setStyle(TableStyle(commands))
+        return table
+
+    def wrap(self, availWidth, availHeight):
+        self.width = sum(self.widths)
+        self.height = self.row_heights[0] + sum(self.row_heights[self.start:])
+        return self.width, self.height
+
+    def split(self, availWidth, availHeight):
+        height = self.row_heights[0]
+        end = self.start
+        while end < len(self.rows) and height + self.row_heights[end] <= availHeight:
+            height += self.row_heights[end]
+            end += 1
+        if end == self.start:
+            return []
+        if end == len(self.rows):
+            return [self.make_table(end)]
+        return [self.make_table(end), self.continuation(end)]
+
+    def draw(self):
+        table = self.make_table(len(self.rows))
+        table.wrapOn(self.canv, self.width, self.height)
+        table.drawOn(self.canv, 0, 0)
+
+class TableRenderer:
+    """Lays out the tabular reports as ReportLab flowables straight from the report context
+
+    Mirrors the first page, deviation statement and extra items templates
+    (titles, columns, item rows and totals) without going through HTML and
+    CSS layout. Item tables repeat their header row on every page. Text
+    cells are pre-wrapped to their column width as plain strings, which
+    ReportLab draws far faster than one Paragraph per cell, and the tables
+    are PagedTables so thousands of rows paginate in linear time.
+    """
+
+    def __init__(self):
+        self.styles = {
+            'title': ParagraphStyle('TableTitle', fontName=BOLD_FONT, fontSize=14, leading=17, alignment=TA_CENTER),
+            'subtitle': ParagraphStyle('TableSubtitle', fontName=FONT, fontSize=11, leading=14,
+                                       alignment=TA_CENTER, spaceBefore=3, spaceAfter=3),
+            'body': ParagraphStyle('TableBody', fontName=FONT, fontSize=9, leading=11, spaceAfter=7),
+            'header': ParagraphStyle('TableHeader', fontName=BOLD_FONT, fontSize=8, leading=9.5, alignment=TA_CENTER)
+        }
+
+    def build_story(self, document_type: str, data: Dict[str, Any], width: float) -> List:
+        """Flowables of a tabular document for a frame of the given width (points)"""
+        builders = {
+            'first_page': self.build_first_page,
+            'deviation_statement': self.build_deviation_statement,
+            'extra_items': self.build_extra_items
+        }
+        return builders[document_type](data, width)
+
+    def get_widths(self, columns: Sequence[float], width: float) -> List[float]:
+        scale = width / (sum(columns) * mm)
+        return [column * mm * scale for column in columns]
+
+    def title(self, text: str, font_size: float, space_after: float) -> Paragraph:
+        style = ParagraphStyle('Title', parent=self.styles['title'], fontSize=font_size,
+                               leading=font_size * 1.2, spaceAfter=space_after)
+        return Paragraph(f"<u>{escape(text)}</u>", style)
+
+    def header_row(self, labels: Sequence[str], font_size: float) -> List[Paragraph]:
+        style = ParagraphStyle('Header', parent=self.styles['header'], fontSize=font_size, leading=font_size * 1.2)
+        return [Paragraph(escape(label), style) for label in labels]
+
+    def wrap(self, text, column_width: float, font_size: float, padding: float) -> str:
+        """Break text into lines that fit its column"""
+        text = '' if text is None else str(text)
+        if not text:
+            return text
+        return '\n'.join(simpleSplit(text, FONT, font_size, column_width - 2 * padding)) or text
+
+    def item_table(self, rows: List[List], widths: List[float], font_size: float, padding: float,
+                   commands: List[Tuple], number_columns: Sequence[int]) -> PagedTable:
+        """Bordered item table with a repeating grey header row"""
+        leading = font_size * 1.2
+        row_heights = [None] + [
+            max(cell.count('\n') + 1 if isinstance(cell, str) else 1 for cell in row) * leading + 2 * padding
+            for row in rows[1:]
+        ]
+        return PagedTable(rows, widths, row_heights, [
+            ('FONT', (0, 0), (-1, -1), FONT, font_size, leading),
+            ('GRID', (0, 0), (-1, -1), 0.75, colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('LEFTPADDING', (0, 0), (-1, -1), padding),
+            ('RIGHTPADDING', (0, 0), (-1, -1), padding),
+            ('TOPPADDING', (0, 0), (-1, -1), padding),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), padding),
+            ('BACKGROUND', (0, 0), (-1, 0), HEADER_BACKGROUND),
+            ('VALIGN', (0, 0), (-1, 0), 'MIDDLE'),
+        ] + [('ALIGN', (column, 1), (column, -1), 'RIGHT') for column in number_columns] + commands)
+
+    def build_first_page(self, data: Dict[str, Any], width: float) -> List:
+        """Contractor bill: particulars, bill and extra item rows with the since-last columns, totals"""
+        font_size, padding = 8, 2.25
+        widths = self.get_widths(FIRST_PAGE_COLUMNS, width)
+        body = self.styles['body']
+
+        last_bill = data.get('last_bill')
+        if last_bill:
+            bill_serial = f"Running Bill No. {last_bill['number'] + 1}"
+            last_bill_text = escape(f"Running Bill No. {last_bill['number']} dated {last_bill['date']}")
+        else:
+            bill_serial, last_bill_text = "First &amp; Final Bill", "Not Applicable"
+
+        story = [
+            self.title("CONTRACTOR BILL", 14, 0),
+            Paragraph("FOR CONTRACTORS &amp; SUPPLIERS ONLY FOR PAYMENT FOR WORK OR SUPPLIES ACTUALLY MEASURED",
+                      self.styles['subtitle']),
+            Paragraph("WORK ORDER", self.styles['subtitle']),
+            Spacer(1, 15),
+            Paragraph("<b>Cash Book Voucher No.</b> ___________ <b>Date:</b> ___________", body),
+            Paragraph(f"<b>Name of Contractor or supplier:</b><br/>{escape(str(data.get('name_of_firm', '')))}", body),
+            Paragraph(f"<b>Name of Work:</b><br/>{escape(str(data.get('name_of_work', '')))}", body),
+            Paragraph(
+                f"<b>Serial No. of this bill:</b> {bill_serial}<br/>"
+                f"<b>No. and date of the last bill:</b> {last_bill_text}<br/>"
+                f"<b>Reference to work order or Agreement:</b> {escape(str(data.get('agreement_no', '')))}<br/>"
+                f"<b>Date of written order to commence work:</b> {escape(str(data.get('date_commencement', '')))}<br/>"
+                f"<b>Date of completion:</b> {escape(str(data.get('date_completion', '')))}<br/>"
+                f"<b>Date of actual completion of work:</b> {escape(str(data.get('actual_completion', '')))}<br/>"
+                f"<b>Date of measurement:</b> {escape(str(data.get('measurement_date', '')))}",
+                body
+            ),
+            Paragraph(f"<b>WORK ORDER AMOUNT RS. {int(round(float(data.get('work_order_amount') or 0), 0))}</b>", body),
+            Spacer(1, 4),
+        ]
+
+        rows = [self.header_row((
+            "Item No.",
+            'Item of Work supplies (Grouped under "sub-head" and "sub work" of estimate)',
+            "Unit",
+            "Quantity executed (or supplied) since last certificate",
+            "Quantity executed (or supplied) upto date as per MB",
+            "Rate",
+            "Amount upto date",
+            "Amount Since previous bill (Total for each sub-head)",
+            "Remark"
+        ), font_size)]
+        commands = []
+
+        def add_items(items, previous_items, quantity_field, amount_field):
+            for index, item in enumerate(items):
+                previous = previous_items[index] if previous_items else None
+                quantity = getattr(item, quantity_field)
+                amount = getattr(item, amount_field)
+                rows.append([
+                    self.wrap(item.serial_no, widths[0], font_size, padding),
+                    self.wrap(item.description, widths[1], font_size, padding),
+                    self.wrap(item.unit, widths[2], font_size, padding),
+                    number(quantity - (previous['quantity'] if previous else 0)),
+                    number(quantity),
+                    number(item.rate),
+                    number(amount),
+                    number(amount - (previous['amount'] if previous else 0)),
+                    self.wrap(item.remark, widths[8], font_size, padding)
+                ])
+
+        add_items(data.get('bill_items') or (), data.get('previous_bill_items'), 'quantity_bill', 'amount_bill')
+        if data.get('extra_items'):
+            commands += [
+                ('SPAN', (0, len(rows)), (-1, len(rows))),
+                ('ALIGN', (0, len(rows)), (-1, len(rows)), 'CENTER'),
+                ('FONT', (0, len(rows)), (-1, len(rows)), BOLD_FONT, font_size, font_size * 1.2),
+            ]
+            rows.append(["Extra Items (With Premium)"] + [''] * 8)
+            add_items(data['extra_items'], data.get('previous_extra_items'), 'quantity', 'amount')
+
+        payable = data.get('bill_grand_total', 0) + data.get('extra_items_sum', 0)
+        last_bill_amount = data.get('last_bill_amount')
+        totals = [
+            ("Grand Total Rs.", rounded(data.get('bill_total', 0)), True),
+            (f"Tender Premium @ {percent(data.get('tender_premium_percent', 0))}", rounded(data.get('bill_premium', 0)), False),
+        ]
+        if data.get('extra_items_sum', 0) > 0:
+            totals.append(("Sum of Extra Items (including Tender Premium) Rs.", rounded(data['extra_items_sum']), False))
+        totals += [
+            ("Payable Amount Rs.", rounded(payable), True),
+            ("Less Amount Paid vide Last Bill Rs.", rounded(last_bill_amount) if last_bill_amount else "0.00", False),
+            ("Net Payable Amount Rs.", rounded(payable - (last_bill_amount or 0)), True),
+        ]
+        for label, amount, bold in totals:
+            row = len(rows)
+            rows.append([label, '', '', '', '', '', amount, '', ''])
+            commands += [('SPAN', (0, row), (5, row)), ('SPAN', (7, row), (8, row))]
+            if bold:
+                commands.append(('FONT', (0, row), (-1, row), BOLD_FONT, font_size, font_size * 1.2))
+        commands.append(('BACKGROUND', (0, len(rows) - 1), (-1, len(rows) - 1), HEADER_BACKGROUND))
+
+        story.append(self.item_table(rows, widths, font_size, padding, commands, (3, 4, 5, 6, 7)))
+        return story
+
+    def build_deviation_statement(self, data: Dict[str, Any], width: float) -> List:
+        """Deviation statement: work order against executed quantities and amounts, with the summary rows"""
+        font_size, padding = 7, 1.5
+        widths = self.get_widths(DEVIATION_COLUMNS, width)
+
+        story = [self.title("Deviation Statement", 12, 15)]
+        rows = [self.header_row((
+            "ITEM No.", "Description", "Unit", "Qty as per Work Order", "Rate", "Amt as per Work Order Rs.",
+            "Qty Executed", "Amt as per Executed Rs.", "Excess Qty", "Excess Amt Rs.", "Saving Qty",
+            "Saving Amt Rs.", "REMARKS/ REASON."
+        ), font_size)]
+        commands = [
+            ('ALIGN', (0, 1), (-1, -1), 'CENTER'),
+            ('ALIGN', (1, 1), (1, -1), 'LEFT'),
+            ('ALIGN', (12, 1), (12, -1), 'LEFT'),
+            ('ALIGN', (3, 1), (11, -1), 'RIGHT'),
+        ]
+
+        def add_items(items):
+            for item in items:
+                rows.append([
+                    self.wrap(item.serial_no, widths[0], font_size, padding),
+                    self.wrap(item.description, widths[1], font_size, padding),
+                    self.wrap(item.unit, widths[2], font_size, padding),
+                    number(item.qty_wo),
+                    number(item.rate),
+                    number(item.amt_wo),
+                    number(item.qty_bill),
+                    number(item.amt_bill),
+                    number(item.excess_qty),
+                    number(item.excess_amt),
+                    number(item.saving_qty),
+                    number(item.saving_amt),
+                    self.wrap(item.remark, widths[12], font_size, padding)
+                ])
+
+        add_items(data.get('deviation_items') or ())
+        if data.get('extra_items_for_deviation'):
+            row = len(rows)
+            commands += [
+                ('SPAN', (0, row), (-1, row)),
+                ('ALIGN', (0, row), (-1, row), 'CENTER'),
+                ('FONT', (0, row), (-1, row), BOLD_FONT, font_size, font_size * 1.2),
+                ('BACKGROUND', (0, row), (-1, row), SECTION_BACKGROUND),
+            ]
+            rows.append(["Extra Items"] + [''] * 12)
+            add_items(data['extra_items_for_deviation'])
+
+        summary = data.get('deviation_summary') or {}
+        for label, columns, bold in (
+            ("Grand Total Rs.", ('work_order_total', 'executed_total', 'overall_excess', 'overall_saving'), True),
+            (f"Add Tender Premium ({percent(data.get('tender_premium_percent', 0))})",
+             ('tender_premium_f', 'tender_premium_h', 'tender_premium_j', 'tender_premium_l'), False),
+            ("Grand Total including Tender Premium Rs.",
+             ('grand_total_f', 'grand_total_h', 'grand_total_j', 'grand_total_l'), True),
+        ):
+            row = len(rows)
+            rows.append([label, '', '', '', ''] + [
+                cell for column in columns for cell in (rounded(summary.get(column, 0)), '')
+            ])
+            commands += [('SPAN', (0, row), (4, row)), ('ALIGN', (0, row), (4, row), 'LEFT')]
+            if bold:
+                commands.append(('FONT', (0, row), (-1, row), BOLD_FONT, font_size, font_size * 1.2))
+
+        net_difference = summary.get('net_difference', 0)
+        grand_total_f = summary.get('grand_total_f', 0)
+        for label, value in (
+            ("Overall Saving With Respect to the Work Order Amount Rs.", rounded(net_difference)),
+            ("Percentage of Deviation %",
+             "%.2f%%" % ((net_difference / grand_total_f * 100) if grand_total_f > 0 else 0)),
+        ):
+            row = len(rows)
+            rows.append([label] + [''] * 11 + [value])
+            commands += [
+                ('SPAN', (0, row), (11, row)),
+                ('ALIGN', (12, row), (12, row), 'RIGHT'),
+                ('FONT', (0, row), (-1, row), BOLD_FONT, font_size, font_size * 1.2),
+            ]
+
+        story.append(self.item_table(rows, widths, font_size, padding, commands, ()))
+        return story
+
+    def build_extra_items(self, data: Dict[str, Any], width: float) -> List:
+        """Extra items with their total, tender premium and sum"""
+        font_size, padding = 9, 3.75
+        # The template's container adds 10mm of padding inside the page margins
+        width -= 20 * mm
+        widths = self.get_widths(EXTRA_ITEMS_COLUMNS, width)
+
+        story = [Spacer(1, 10 * mm), self.title("Extra Items", 14, 20)]
+        rows = [self.header_row(("Serial No.", "Description", "Unit", "Quantity", "Rate", "Amount", "Remark"), font_size)]
+        commands = []
+
+        extra_items = data.get('extra_items') or ()
+        for item in extra_items:
+            rows.append([
+                self.wrap(item.serial_no, widths[0], font_size, padding),
+                self.wrap(item.description, widths[1], font_size, padding),
+                self.wrap(item.unit, widths[2], font_size, padding),
+                number(item.quantity),
+                number(item.rate),
+                number(item.amount),
+                self.wrap(item.remark, widths[6], font_size, padding)
+            ])
+        if not extra_items:
+            commands += [
+                ('SPAN', (0, 1), (-1, 1)),
+                ('ALIGN', (0, 1), (-1, 1), 'CENTER'),
+                ('FONT', (0, 1), (-1, 1), 'Helvetica-Oblique', font_size, font_size * 1.2),
+            ]
+            rows.append(["No extra items"] + [''] * 6)
+
+        for label, amount, rule in (
+            ("Total Rs.", data.get('extra_items_base', 0), True),
+            (f"Tender Premium @ {percent(data.get('tender_premium_percent', 0))}", data.get('extra_premium', 0), False),
+            ("Sum of Extra Items (with Premium) Rs.", data.get('extra_items_sum', 0), True),
+        ):
+            row = len(rows)
+            rows.append([label, '', '', '', '', rounded(amount), ''])
+            commands += [
+                ('SPAN', (0, row), (4, row)),
+                ('ALIGN', (0, row), (4, row), 'RIGHT'),
+                ('FONT', (0, row), (5, row), BOLD_FONT, font_size, font_size * 1.2),
+            ]
+            if rule:
+                commands.append(('LINEABOVE', (0, row), (-1, row), 1.5, colors.black))
+        commands.append(('BACKGROUND', (0, len(rows) - 1), (-1, len(rows) - 1), HEADER_BACKGROUND))
+
+        story.append(self.item_table(rows, widths, font_size, padding, commands, (3, 4, 5)))
+        return story
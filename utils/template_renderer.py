@@ -1,16 +1,43 @@
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, nodes, select_autoescape
+import hashlib
 import os
-from typing import Dict, Any
+import threading
+from typing import Dict, Any, FrozenSet, Iterator, Optional
+
+from .instrumentation import instrumented
+
+# Compiled templates are kept here and shared by every process, keyed by a
+# checksum of the template source so edited templates are recompiled
+DEFAULT_BYTECODE_CACHE_DIR = os.path.join(
+    os.environ.get('BILL_CACHE_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache')),
+    'templates'
+)
+
+# Process-wide renderer returned by get_shared_renderer()
+_shared_renderer = None
+_shared_renderer_lock = threading.Lock()
+
+def get_shared_renderer() -> 'TemplateRenderer':
+    """Get the renderer shared by everything in this process, creating and warming it once"""
+    global _shared_renderer
+    with _shared_renderer_lock:
+        if _shared_renderer is None:
+            renderer = TemplateRenderer()
+            renderer.warm()
+            _shared_renderer = renderer
+        return _shared_renderer
 
 class TemplateRenderer:
     """Class to handle HTML template rendering using Jinja2"""
     
-    def __init__(self):
+    def __init__(self, bytecode_cache_dir: Optional[str] = DEFAULT_BYTECODE_CACHE_DIR):
         # Set up Jinja2 environment
         template_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates')
+        self.template_dir = template_dir
         self.env = Environment(
             loader=FileSystemLoader(template_dir),
-            autoescape=select_autoescape(['html', 'xml'])
+            autoescape=select_autoescape(['html', 'xml']),
+            bytecode_cache=self.create_bytecode_cache(bytecode_cache_dir)
         )
         
         # Add custom filters
@@ -19,6 +46,7 @@ class TemplateRenderer:
         self.env.filters['format_currency'] = self.format_currency
         self.env.filters['format_date'] = self.format_date
     
+    @instrumented('render_template', detail=lambda result, self, template_name, *args, **kwargs: template_name)
     def render_template(self, template_name: str, data: Dict[str, Any]) -> str:
         """Render a template with the provided data"""
         try:
@@ -28,6 +56,70 @@ class TemplateRenderer:
             print(f"Error rendering template {template_name}: {str(e)}")
             return self.create_fallback_html(template_name, data)
     
+    def generate_template(self, template_name: str, data: Dict[str, Any], **context) -> Iterator[str]:
+        """Stream a template's output piece by piece, with extra variables (e.g. chunk) besides data"""
+        template = self.env.get_template(template_name)
+        return template.generate(data=data, **context)
+    
+    def create_bytecode_cache(self, cache_dir: Optional[str]) -> Optional[FileSystemBytecodeCache]:
+        """Create the on-disk bytecode cache, or run without one if the directory is unusable"""
+        if not cache_dir:
+            return None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            return FileSystemBytecodeCache(cache_dir)
+        except OSError as e:
+            print(f"Template bytecode cache disabled: {str(e)}")
+            return None
+    
+    def warm(self) -> int:
+        """Load and compile every template up front so the first render pays no compile cost"""
+        loaded = 0
+        for template_name in self.env.list_templates(extensions=['html']):
+            try:
+                self.env.get_template(template_name)
+                loaded += 1
+            except Exception as e:
+                print(f"Error loading template {template_name}: {str(e)}")
+        return loaded
+    
+    def context_fields(self, template_name: str) -> Optional[FrozenSet[str]]:
+        """Get the top-level data fields a template reads, or None if it may read all of them
+        
+        Found by walking the template's syntax tree for data.<field> and
+        data['field']; any other use of data (passing it on, includes,
+        inheritance) counts as reading the whole context.
+        """
+        source = self.env.loader.get_source(self.env, template_name)[0]
+        tree = self.env.parse(source)
+        if any(True for _ in tree.find_all((nodes.Extends, nodes.Include, nodes.Import, nodes.FromImport))):
+            return None
+        
+        fields = set()
+        reads_everything = False
+        pending = [(tree, None)]
+        while pending:
+            node, parent = pending.pop()
+            if isinstance(node, nodes.Name) and node.name == 'data':
+                if isinstance(parent, nodes.Getattr) and parent.node is node:
+                    fields.add(parent.attr)
+                elif isinstance(parent, nodes.Getitem) and parent.node is node and isinstance(parent.arg, nodes.Const):
+                    fields.add(parent.arg.value)
+                else:
+                    reads_everything = True
+            pending.extend((child, node) for child in node.iter_child_nodes())
+        
+        return None if reads_everything else frozenset(fields)
+    
+    def template_version(self) -> str:
+        """Get a hash of the template files, used to invalidate cached outputs"""
+        digest = hashlib.sha256()
+        for template_name in sorted(self.env.list_templates()):
+            digest.update(template_name.encode())
+            with open(os.path.join(self.template_dir, template_name), 'rb') as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+    
     def create_fallback_html(self, template_name: str, data: Dict[str, Any]) -> str:
         """Create fallback HTML when template rendering fails"""
         title = template_name.replace('.html', '').replace('_', ' ').title()